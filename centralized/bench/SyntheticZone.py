@@ -0,0 +1,194 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/bench/SyntheticZone.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Module generating DNS-SD zones and rule sets of configurable size for the
+benchmarks.
+"""
+
+import random          # for reproducible random rule sets
+
+import dns.name
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+import dns.zone
+import netaddr         # for manipulation of IP addresses
+
+# Base of the addresses of the hosts: each router gets a /16 (IPv4) or a /64
+# (IPv6) in which its hosts are numbered.
+IPV4_BASE = netaddr.IPAddress("10.0.0.0")
+IPV6_BASE = netaddr.IPAddress("2001:db8::")
+
+TTL = 3600
+
+def routerName(index):
+  return "r%i" % index
+
+def typeName(index):
+  """Gets the name of a service type. Odd types are TCP, even types UDP."""
+
+  if index % 2:
+    return "_t%i._tcp" % index
+  return "_t%i._udp" % index
+
+def instanceName(index):
+  """Gets the name of a service instance, with spaces like in real DNS-SD
+  names so that the unescaping of names is exercised."""
+
+  return "Room%i Device%i" % (index % 10, index)
+
+def hostAddresses(router, host, addresses, dual_stack):
+  """Gets the addresses of a host.
+
+  Args:
+    router: index of the router.
+    host: index of the host in the router.
+    addresses: number of addresses of each family.
+    dual_stack: whether the host has addresses of both families. Otherwise,
+      even hosts only have IPv4 addresses and odd hosts IPv6 addresses.
+
+  Returns:
+    A tuple (IPv4 addresses, IPv6 addresses).
+  """
+
+  ipv4 = []
+  ipv6 = []
+  for i in range(addresses):
+    number = host * addresses + i + 1
+    if dual_stack or host % 2 == 0:
+      ipv4.append(str(IPV4_BASE + (router << 16) + number))
+    if dual_stack or host % 2 == 1:
+      ipv6.append(str(IPV6_BASE + (router << 64) + number))
+
+  return ipv4, ipv6
+
+def zone(domain, routers, types, instances, addresses=1, dual_stack=1.0,
+         interfaces=2, seed=0):
+  """Generates a DNS-SD zone announcing the services of routers.
+
+  Each router is a subdomain of the domain, listed in b._dns-sd._udp, with a
+  TXT record announcing its public interfaces. Each router announces the same
+  number of service types, each type the same number of instances, and each
+  instance is on its own host.
+
+  Args:
+    domain: name of the zone.
+    routers: number of routers (subdomains).
+    types: number of service types per router.
+    instances: number of instances per service type.
+    addresses: number of addresses of each family per host.
+    dual_stack: fraction of the hosts having both IPv4 and IPv6 addresses.
+    interfaces: number of public interfaces per router.
+    seed: seed of the choice of dual-stack hosts.
+
+  Returns:
+    A dns.zone.Zone with absolute names.
+  """
+
+  generator = random.Random(seed)
+  origin = dns.name.from_text(domain)
+  result = dns.zone.Zone(origin, relativize=False)
+
+  def add(name, rdtype, text):
+    rdtype = dns.rdatatype.from_text(rdtype)
+    rdata = dns.rdata.from_text(dns.rdataclass.IN, rdtype, text, origin,
+                                relativize=False)
+    result.find_rdataset(dns.name.from_text(name, origin), rdtype,
+                         create=True).add(rdata, TTL)
+
+  add("@", 'SOA', "ns hostmaster 1 3600 600 86400 %i" % TTL)
+  add("@", 'NS', "ns")
+  add("ns", 'A', "127.0.0.1")
+
+  public = ",".join(["eth%i" % i for i in range(interfaces)])
+
+  for r in range(routers):
+    router = routerName(r)
+    add("b._dns-sd._udp", 'PTR', router)
+    add(router, 'TXT', '"public=%s"' % public)
+
+    host = 0
+    for t in range(types):
+      stype = "%s.%s" % (typeName(t), router)
+      add("_services._dns-sd._udp.%s" % router, 'PTR', stype)
+
+      for i in range(instances):
+        instance = "%s.%s" % (instanceName(i).replace(" ", "\\032"), stype)
+        hostname = "h%i.%s" % (host, router)
+        add(stype, 'PTR', instance)
+        add(instance, 'SRV', "0 0 %i %s" % (1024 + i, hostname))
+
+        ipv4, ipv6 = hostAddresses(r, host, addresses,
+                                   generator.random() < dual_stack)
+        for address in ipv4:
+          add(hostname, 'A', address)
+        for address in ipv6:
+          add(hostname, 'AAAA', address)
+
+        host += 1
+
+  return result
+
+def rules(count, routers, types, seed=0):
+  """Generates a rule set.
+
+  Rules mix both IP versions and actions, rules applying to every router and to
+  a single one, and patterns matching every service, a type or a subset of the
+  instances, so that matching cost is realistic.
+
+  Args:
+    count: number of rules.
+    routers: number of routers of the zone.
+    types: number of service types per router.
+    seed: seed of the random generator.
+
+  Returns:
+    An array of rules (dictionaries) as returned by PolicyManager.getRules().
+  """
+
+  generator = random.Random(seed)
+
+  result = []
+  for _ in range(count):
+    if generator.random() < 0.5:
+      length = generator.choice([8, 16, 24, 32])
+      address = netaddr.IPNetwork("172.%i.%i.%i/%i" %
+                                  (generator.randint(16, 31),
+                                   generator.randint(0, 255),
+                                   generator.randint(0, 255), length))
+    else:
+      length = generator.choice([32, 48, 64, 128])
+      address = netaddr.IPNetwork("2001:db8:%x:%x::%x/%i" %
+                                  (generator.randint(0, 0xffff),
+                                   generator.randint(0, 0xffff),
+                                   generator.randint(1, 0xffff), length))
+
+    if generator.random() < 0.5:
+      router = "*"
+    else:
+      router = routerName(generator.randrange(routers))
+
+    name = generator.choice([".*", ".*", "Room%i.*" % generator.randrange(10),
+                             ".*Device%i.*" % generator.randrange(10)])
+    stype = generator.choice([".*", "%s\\..*" %
+                              typeName(generator.randrange(max(types, 1)))])
+
+    result.append({'src-address': str(address.network),
+                   'src-prefix-length': str(length),
+                   'name': name,
+                   'type': stype,
+                   'router': router,
+                   'action': generator.choice(["allow", "deny"])})
+
+  return result
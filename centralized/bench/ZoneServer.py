@@ -0,0 +1,427 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/bench/ZoneServer.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Module providing a minimal authoritative DNS server answering from an
+in-memory zone, used as a stand-in for BIND by the benchmarks and the tests.
+"""
+
+import SocketServer    # for the UDP and TCP servers
+import random          # for the slow answers
+import socket          # to send NOTIFY messages
+import struct          # for the length prefix of DNS over TCP
+import threading       # to serve in the background
+import time            # to delay the slow answers
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.opcode
+import dns.rcode
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+
+# Maximum size of a UDP response without EDNS (RFC 1035 Section 4.2.1).
+UDP_MAX_SIZE = 512
+
+# Maximum number of records per message of a zone transfer.
+TRANSFER_RECORDS = 100
+
+class UDPHandler(SocketServer.BaseRequestHandler):
+  """Answers a query received over UDP, truncated if it is too large."""
+
+  def handle(self):
+    wire, sock = self.request
+
+    response = self.server.zone_server.answer(wire)
+    if response is None:
+      return
+
+    self.server.zone_server.wait()
+
+    try:
+      wire = response.to_wire(max_size=self.server.zone_server.udpSize(
+        response))
+    except dns.exception.TooBig:
+      # The client has to retry over TCP.
+      response.answer = []
+      response.flags |= dns.flags.TC
+      wire = response.to_wire()
+
+    sock.sendto(wire, self.client_address)
+
+class TCPHandler(SocketServer.BaseRequestHandler):
+  """Answers the queries received over a TCP connection."""
+
+  def handle(self):
+    while True:
+      prefix = self.receive(2)
+      if prefix is None:
+        return
+
+      wire = self.receive(struct.unpack("!H", prefix)[0])
+      if wire is None:
+        return
+
+      responses = self.server.zone_server.answerTCP(wire)
+      if responses is None:
+        return
+
+      for response in responses:
+        wire = response.to_wire()
+        self.request.sendall(struct.pack("!H", len(wire)) + wire)
+
+  def receive(self, length):
+    """Receives exactly length bytes.
+
+    Args:
+      length: number of bytes to receive.
+
+    Returns:
+      The bytes received or None if the connection was closed.
+    """
+
+    data = ""
+    while len(data) < length:
+      chunk = self.request.recv(length - len(data))
+      if not chunk:
+        return None
+      data += chunk
+
+    return data
+
+class ThreadingUDPServer(SocketServer.ThreadingUDPServer):
+  daemon_threads = True
+
+class ThreadingTCPServer(SocketServer.ThreadingTCPServer):
+  daemon_threads      = True
+  allow_reuse_address = True
+
+class ZoneServer:
+  """Authoritative server of a zone listening over UDP and TCP on the same
+  port of the loopback interface.
+
+  Queries are answered from the zone with the AA flag, NXDOMAIN when the name
+  does not exist and an empty answer when it has no record of the queried type.
+  UDP answers larger than the size announced by the client are truncated so
+  that the client falls back to TCP, like with a real server.
+
+  The zone can be changed with update(), which increments the serial and keeps
+  the differences so that zone transfers over TCP are incremental (IXFR) when
+  the serial of the client is known, and full (AXFR) otherwise. notify()
+  sends a NOTIFY message like a primary server after a change.
+
+  A fraction of the UDP answers may be delayed, like those of a loaded
+  server, to measure tail latencies."""
+
+  def __init__(self, zone, address="127.0.0.1", port=0, slow=None):
+    """Constructor.
+
+    Args:
+      zone: dns.zone.Zone to serve, with absolute names.
+      address: address to listen on.
+      port: port to listen on. 0 to let the system choose one.
+      slow: (fraction, seconds) to delay a fraction of the UDP answers, or
+        None to answer at once.
+    """
+
+    self.zone = zone
+    self.slow = slow
+    self.lock = threading.Lock()
+
+    self.queries   = 0   # Number of queries answered.
+    self.transfers = []  # Type of each zone transfer served (AXFR or IXFR).
+
+    # Differences (serial, deleted records, added records) from each serial
+    # to the next one, records being tuples (name, TTL, rdata).
+    self.journal = []
+
+    self.udp = ThreadingUDPServer((address, port), UDPHandler)
+    self.udp.zone_server = self
+    self.address, self.port = self.udp.server_address
+
+    self.tcp = ThreadingTCPServer((address, self.port), TCPHandler)
+    self.tcp.zone_server = self
+
+    self.threads = []
+
+  def start(self):
+    """Starts serving in background threads."""
+
+    for server in [self.udp, self.tcp]:
+      thread = threading.Thread(target=server.serve_forever)
+      thread.daemon = True
+      thread.start()
+      self.threads.append(thread)
+
+  def stop(self):
+    """Stops serving."""
+
+    for server in [self.udp, self.tcp]:
+      server.shutdown()
+      server.server_close()
+
+  def wait(self):
+    """Delays an answer if it is one of the slow ones."""
+
+    if self.slow is not None and random.random() < self.slow[0]:
+      time.sleep(self.slow[1])
+
+  def answer(self, wire):
+    """Computes the response to a query.
+
+    Args:
+      wire: content of the query.
+
+    Returns:
+      A dns.message.Message or None if the query is invalid.
+    """
+
+    try:
+      query = dns.message.from_wire(wire)
+    except dns.exception.DNSException:
+      return None
+
+    with self.lock:
+      self.queries += 1
+
+    response = dns.message.make_response(query)
+    response.flags |= dns.flags.AA
+
+    if len(query.question) != 1:
+      response.set_rcode(dns.rcode.FORMERR)
+      return response
+
+    question = query.question[0]
+    if question.rdtype in [dns.rdatatype.AXFR, dns.rdatatype.IXFR]:
+      # Zone transfers are only served over TCP.
+      response.set_rcode(dns.rcode.REFUSED)
+      return response
+
+    with self.lock:
+      try:
+        node = self.zone.get_node(question.name)
+      except KeyError: # Not in the zone.
+        response.set_rcode(dns.rcode.REFUSED)
+        return response
+      if node is None:
+        response.set_rcode(dns.rcode.NXDOMAIN)
+        return response
+
+      rdataset = node.get_rdataset(dns.rdataclass.IN, question.rdtype)
+      if rdataset is not None:
+        response.find_rrset(response.answer, question.name, dns.rdataclass.IN,
+                            question.rdtype, create=True).update(rdataset)
+
+    return response
+
+  def answerTCP(self, wire):
+    """Computes the responses to a query received over TCP.
+
+    Args:
+      wire: content of the query.
+
+    Returns:
+      An array of dns.message.Message, several for a zone transfer, or None if
+      the query is invalid.
+    """
+
+    try:
+      query = dns.message.from_wire(wire)
+    except dns.exception.DNSException:
+      return None
+
+    if (len(query.question) != 1 or
+        not query.question[0].rdtype in [dns.rdatatype.AXFR,
+                                         dns.rdatatype.IXFR]):
+      response = self.answer(wire)
+      if response is None:
+        return None
+      return [response]
+
+    with self.lock:
+      self.queries += 1
+      records = self.transfer(query)
+
+    # The records are split in several messages, like large zones are.
+    responses = []
+    for i in range(0, len(records), TRANSFER_RECORDS):
+      response = dns.message.make_response(query)
+      response.flags |= dns.flags.AA
+      for name, ttl, rdata in records[i:i + TRANSFER_RECORDS]:
+        rrset = dns.rrset.RRset(name, dns.rdataclass.IN, rdata.rdtype)
+        rrset.add(rdata, ttl)
+        response.answer.append(rrset)
+      responses.append(response)
+
+    return responses
+
+  def transfer(self, query):
+    """Gets the records of the answer to a zone transfer, the lock being held.
+
+    Args:
+      query: AXFR or IXFR query (dns.message.Message).
+
+    Returns:
+      An array of records (name, TTL, rdata): the whole zone between two SOA
+      for an AXFR or an IXFR from an unknown serial, the SOA alone for an
+      IXFR from the current serial, or the sequences of differences (old SOA,
+      deleted records, new SOA, added records) between two SOA for an IXFR
+      from an older serial (RFC 1995).
+    """
+
+    origin = self.zone.origin
+    soa    = self.zone.find_rdataset(origin, dns.rdatatype.SOA)
+    record = (origin, soa.ttl, soa[0])
+
+    if query.question[0].rdtype == dns.rdatatype.IXFR:
+      serial = None
+      for rrset in query.authority:
+        if rrset.rdtype == dns.rdatatype.SOA:
+          serial = rrset[0].serial
+
+      if serial == soa[0].serial:
+        self.transfers.append('IXFR')
+        return [record]
+
+      serials = [entry[0] for entry in self.journal]
+      if serial in serials:
+        self.transfers.append('IXFR')
+        records = [record]
+        for old, deleted, added in self.journal[serials.index(serial):]:
+          records.append((origin, soa.ttl, self.soa(old)))
+          records.extend(deleted)
+          records.append((origin, soa.ttl, self.soa(old + 1)))
+          records.extend(added)
+        records.append(record)
+        return records
+
+    self.transfers.append('AXFR')
+    return [record] + self.records() + [record]
+
+  def records(self):
+    """Gets the records of the zone, except its SOA, the lock being held.
+
+    Returns:
+      An array of records (name, TTL, rdata).
+    """
+
+    return [(name, rdataset.ttl, rdata)
+            for name, rdataset in self.zone.iterate_rdatasets()
+            if rdataset.rdtype != dns.rdatatype.SOA
+            for rdata in rdataset]
+
+  def soa(self, serial):
+    """Gets the SOA of the zone with another serial, the lock being held."""
+
+    rdata = self.zone.find_rdataset(self.zone.origin, dns.rdatatype.SOA)[0]
+    return dns.rdata.from_text(dns.rdataclass.IN, dns.rdatatype.SOA,
+                               " ".join([rdata.mname.to_text(),
+                                         rdata.rname.to_text(), str(serial),
+                                         str(rdata.refresh), str(rdata.retry),
+                                         str(rdata.expire),
+                                         str(rdata.minimum)]))
+
+  def update(self, added=(), deleted=()):
+    """Changes the zone and increments its serial.
+
+    Args:
+      added: array of the records to add, as tuples (name relative to the
+        origin, type, text of the rdata, TTL).
+      deleted: array of the records to delete, as tuples (name relative to
+        the origin, type, text of the rdata).
+
+    Returns:
+      The new serial.
+    """
+
+    origin = self.zone.origin
+    with self.lock:
+      removed = []
+      for name, rdtype, text in deleted:
+        name   = dns.name.from_text(name, origin)
+        rdtype = dns.rdatatype.from_text(rdtype)
+        rdata  = dns.rdata.from_text(dns.rdataclass.IN, rdtype, text, origin,
+                                     relativize=False)
+        rdataset = self.zone.get_rdataset(name, rdtype)
+        if rdataset is None or not rdata in rdataset:
+          continue
+        removed.append((name, rdataset.ttl, rdata))
+        rdataset.discard(rdata)
+        if len(rdataset) == 0:
+          self.zone.delete_rdataset(name, rdtype)
+
+      inserted = []
+      for name, rdtype, text, ttl in added:
+        name   = dns.name.from_text(name, origin)
+        rdtype = dns.rdatatype.from_text(rdtype)
+        rdata  = dns.rdata.from_text(dns.rdataclass.IN, rdtype, text, origin,
+                                     relativize=False)
+        self.zone.find_rdataset(name, rdtype, create=True).add(rdata, ttl)
+        inserted.append((name, ttl, rdata))
+
+      rdataset = self.zone.find_rdataset(origin, dns.rdatatype.SOA)
+      serial = rdataset[0].serial
+      self.journal.append((serial, removed, inserted))
+      soa = self.soa(serial + 1)
+      rdataset.clear()
+      rdataset.add(soa)
+
+    return serial + 1
+
+  def notify(self, address, port, timeout=1.0):
+    """Sends a NOTIFY message for the zone, as a primary server does after a
+    change.
+
+    Args:
+      address: address of the secondary.
+      port: port of the secondary.
+      timeout: number of seconds to wait for the acknowledgement.
+
+    Returns:
+      True if the NOTIFY was acknowledged, False otherwise.
+    """
+
+    message = dns.message.make_query(self.zone.origin, dns.rdatatype.SOA)
+    # The opcode is part of the flags.
+    message.flags = dns.flags.AA
+    message.set_opcode(dns.opcode.NOTIFY)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+      sock.settimeout(timeout)
+      sock.sendto(message.to_wire(), (address, port))
+      response = dns.message.from_wire(sock.recv(65535))
+      return message.is_response(response)
+    except (socket.error, dns.exception.DNSException):
+      return False
+    finally:
+      sock.close()
+
+  def udpSize(self, response):
+    """Gets the maximum size of the UDP response to a query.
+
+    Args:
+      response: response to the query.
+
+    Returns:
+      The payload size announced with EDNS by the client, or 512 bytes.
+    """
+
+    if response.edns >= 0:
+      return max(response.request_payload, UDP_MAX_SIZE)
+
+    return UDP_MAX_SIZE
@@ -0,0 +1,154 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/bench/hedged-resolver-benchmark.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Benchmark of the crawl with hedged queries (HedgedResolver) against the crawl
+through the recursive resolver.
+
+A synthetic zone is served by several local stand-in authoritative servers
+(127.0.0.1, 127.0.0.2, ... on the same port), each delaying a fraction of its
+answers, like loaded servers. The zone is crawled several times through the
+resolver of dnspython, which only queries the first server, and then as many
+times with a HedgedResolver querying all of them. The percentiles of the
+crawl times of both are reported, along with whether the services found are
+the same and the fraction of the queries which were hedged.
+
+Usage example:
+  ./hedged-resolver-benchmark.py --servers 3 --slow 0.05 --delay 0.3 \\
+    --crawls 40 --workers 8
+"""
+
+import sys             # for sys.path and sys.exit
+import os              # for paths
+import argparse        # for the command line
+import random          # for reproducible delays
+import time            # for timings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "python"))
+
+import dns.resolver
+
+import DNSWrapper      # to crawl the zone
+import HedgedResolver  # to hedge the queries of the crawl
+import ServiceModel    # to compare the services found
+import SyntheticZone   # to generate the zone
+import ZoneServer      # to serve the zone
+
+DOMAIN = "bench.example."
+
+def percentile(times, fraction):
+  """Gets a percentile of sorted durations."""
+
+  return times[min(len(times) - 1, int(fraction * len(times)))]
+
+def crawl(arguments, resolver):
+  """Crawls the zone several times.
+
+  Args:
+    arguments: parsed command line.
+    resolver: HedgedResolver, or None to use the recursive resolver.
+
+  Returns:
+    A tuple (services found by the last crawl, sorted crawl times, number of
+    queries sent).
+  """
+
+  times    = []
+  services = None
+  queries  = 0
+  for _ in range(arguments.crawls):
+    wrapper = DNSWrapper.DNSWrapper(DOMAIN, arguments.workers, None, None,
+                                    resolver)
+    start = time.time()
+    services = wrapper.getServices()
+    times.append(time.time() - start)
+    queries += wrapper.queries
+    if services is None:
+      return None, None, queries
+
+  return services, sorted(times), queries
+
+def report(name, times):
+  """Prints the percentiles of crawl times."""
+
+  print("  %-7s p50 %6.3fs  p90 %6.3fs  p99 %6.3fs  max %6.3fs" %
+        (name, percentile(times, 0.5), percentile(times, 0.9),
+         percentile(times, 0.99), times[-1]))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description="Benchmark of the crawl with hedged queries against local "
+                "authoritative servers answering slowly from time to time.")
+  parser.add_argument("--routers", type=int, default=4)
+  parser.add_argument("--types", type=int, default=3)
+  parser.add_argument("--instances", type=int, default=4)
+  parser.add_argument("--servers", type=int, default=3,
+                      help="authoritative servers (default: 3)")
+  parser.add_argument("--slow", type=float, default=0.05,
+                      help="fraction of the answers delayed by each server "
+                           "(default: 0.05)")
+  parser.add_argument("--delay", type=float, default=0.3,
+                      help="delay of the slow answers in seconds "
+                           "(default: 0.3)")
+  parser.add_argument("--percentile", type=float, default=0.95,
+                      help="percentile of the RTTs after which a query is "
+                           "hedged (default: 0.95)")
+  parser.add_argument("--crawls", type=int, default=40,
+                      help="crawls of each mode (default: 40)")
+  parser.add_argument("--workers", type=int, default=8,
+                      help="concurrent queries of the crawl (default: 8)")
+  parser.add_argument("--seed", type=int, default=0)
+  arguments = parser.parse_args()
+
+  random.seed(arguments.seed)
+  zone = SyntheticZone.zone(DOMAIN, arguments.routers, arguments.types,
+                            arguments.instances)
+
+  servers = []
+  port = 0
+  for i in range(arguments.servers):
+    server = ZoneServer.ZoneServer(zone, "127.0.0.%i" % (i + 1), port,
+                                   (arguments.slow, arguments.delay))
+    server.start()
+    port = server.port
+    servers.append(server)
+
+  resolver = dns.resolver.Resolver(configure=False)
+  resolver.nameservers = [servers[0].address]
+  resolver.port        = port
+  resolver.lifetime    = 5.0
+  dns.resolver.default_resolver = resolver
+
+  try:
+    print("routers=%i types=%i instances=%i servers=%i slow=%.2f delay=%.3fs" %
+          (arguments.routers, arguments.types, arguments.instances,
+           arguments.servers, arguments.slow, arguments.delay))
+
+    plain, plain_times, _ = crawl(arguments, None)
+    hedged_resolver = HedgedResolver.HedgedResolver(
+      DOMAIN, arguments.percentile, port=port,
+      servers=[server.address for server in servers])
+    hedged, hedged_times, queries = crawl(arguments, hedged_resolver)
+    if plain is None or hedged is None:
+      print("  Crawl of the zone failed.")
+      sys.exit(1)
+
+    report("plain", plain_times)
+    report("hedged", hedged_times)
+    print("  same services: %s, hedged queries: %.1f%%" %
+          (ServiceModel.dump(plain) == ServiceModel.dump(hedged),
+           100.0 * hedged_resolver.hedged / max(queries, 1)))
+  finally:
+    for server in servers:
+      server.stop()
@@ -0,0 +1,379 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/bench/policy-manager-benchmark.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Benchmark of the policy manager against synthetic DNS-SD zones.
+
+For each combination of the sizes given on the command line, a synthetic zone
+is served by a local stand-in authoritative server (no BIND needed) and one
+generation of the policy manager is run in a fresh process, timing separately:
+  - crawl: DNSWrapper.getServices() and the public interfaces of the routers,
+  - match: PolicyEngine.match() for every router,
+  - write: RuleWriter.write() for every router, in a temporary directory.
+Throughput and peak memory (resident set high-water mark) of each phase are
+reported and appended as JSON lines to a results file, along with the commit
+they were measured at, so that regressions can be spotted across commits.
+
+Usage example:
+  ./policy-manager-benchmark.py --routers 10,100 --instances 5 --rules 50,500
+"""
+
+import sys             # for sys.path and sys.exit
+import os              # for paths
+import argparse        # for the command line
+import itertools       # for the combinations of sizes
+import json            # to store the results
+import logging         # for the logger of the policy engine
+import multiprocessing # to measure each run in a fresh process
+import platform        # to describe the machine
+import resource        # for peak memory
+import shutil          # to remove temporary directories
+import subprocess      # to get the current commit
+import tempfile        # for the output directory
+import time            # for timings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "python"))
+
+import dns.resolver
+
+import DNSWrapper      # to crawl the zone
+import PolicyEngine    # to match rules against services
+import RuleWriter      # to write the firewall files
+import SyntheticZone   # to generate zones and rules
+import ZoneServer      # to serve the zones
+
+DOMAIN = "bench.example."
+
+# Sizes which can be varied, with their default values.
+SIZES = [('routers', [10]), ('types', [5]), ('instances', [5]),
+         ('addresses', [1]), ('rules', [100])]
+
+def peakMemory():
+  """Gets the resident set high-water mark of the current process.
+
+  Returns:
+    The peak memory in MiB.
+  """
+
+  # Kilobytes on Linux.
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def rate(count, elapsed):
+  """Gets a throughput, whatever the resolution of the clock."""
+
+  return count / max(elapsed, 1e-6)
+
+def currentCommit():
+  """Gets the commit of the working tree of the benchmark.
+
+  Returns:
+    The hash of the commit or None if it cannot be found.
+  """
+
+  try:
+    return subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                   cwd=os.path.dirname(os.path.abspath(
+                                     __file__)),
+                                   stderr=open(os.devnull, 'w')).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def serve(parameters, pipe):
+  """Serves a synthetic zone until the pipe is closed. Run in its own process
+  so that the memory and CPU used by the server are not measured.
+
+  Args:
+    parameters: dictionary of the sizes and settings of the run.
+    pipe: connection on which the port of the server is sent.
+  """
+
+  zone = SyntheticZone.zone(DOMAIN, parameters['routers'], parameters['types'],
+                            parameters['instances'], parameters['addresses'],
+                            parameters['dual_stack'], parameters['interfaces'],
+                            parameters['seed'])
+  server = ZoneServer.ZoneServer(zone)
+  server.start()
+  pipe.send(server.port)
+
+  # Waiting for the benchmark to be over.
+  try:
+    pipe.recv()
+  except EOFError:
+    pass
+  server.stop()
+
+def measure(parameters, port, queue):
+  """Runs one generation of the policy manager and measures its phases.
+
+  Args:
+    parameters: dictionary of the sizes and settings of the run.
+    port: port of the stand-in server.
+    queue: queue on which the dictionary of the measures is put.
+  """
+
+  logger = logging.getLogger("policy-manager-benchmark")
+
+  resolver = dns.resolver.Resolver(configure=False)
+  resolver.nameservers = ["127.0.0.1"]
+  resolver.port        = port
+  resolver.lifetime    = parameters['timeout']
+  dns.resolver.default_resolver = resolver
+
+  rules = SyntheticZone.rules(parameters['rules'], parameters['routers'],
+                              parameters['types'], parameters['seed'])
+  directory = tempfile.mkdtemp(prefix="policy-manager-benchmark-")
+
+  phases = dict()
+  try:
+    # Crawl.
+    memory = peakMemory()
+    start  = time.time()
+
+    wrapper = DNSWrapper.DNSWrapper(DOMAIN, parameters['workers'])
+    services = wrapper.getServices()
+    if services is None:
+      queue.put({'error': "Crawl of the zone failed."})
+      return
+
+    interfaces = dict()
+    for router in services.values():
+      interfaces[router.name] = wrapper.getPublicInterfaces(router.name)
+
+    elapsed = time.time() - start
+    count = sum([router.count() for router in services.values()])
+    phases['crawl'] = {'seconds': elapsed,
+                       'queries': wrapper.queries,
+                       'failures': wrapper.failures,
+                       'services': count,
+                       'queries_per_second': rate(wrapper.queries, elapsed),
+                       'services_per_second': rate(count, elapsed),
+                       'peak_mb': peakMemory(),
+                       'growth_mb': peakMemory() - memory}
+
+    # Match.
+    memory = peakMemory()
+    start  = time.time()
+
+    engine  = PolicyEngine.PolicyEngine(logger, rules)
+    matches = dict()
+    for router in services.values():
+      if interfaces[router.name]:
+        matches[router.name] = engine.match(router.name, router.types,
+                                            interfaces[router.name])
+
+    elapsed = time.time() - start
+    count = sum([len(entries) for entries in matches.values()])
+    phases['match'] = {'seconds': elapsed,
+                       'routers': len(matches),
+                       'entries': count,
+                       'routers_per_second': rate(len(matches), elapsed),
+                       'entries_per_second': rate(count, elapsed),
+                       'peak_mb': peakMemory(),
+                       'growth_mb': peakMemory() - memory}
+
+    # Write.
+    memory = peakMemory()
+    start  = time.time()
+
+    writer = RuleWriter.RuleWriter(directory, parameters['formats'],
+                                   parameters['aggregation'],
+                                   parameters['optimize'])
+    count = 0
+    for router in matches.keys():
+      count += writer.write(router, matches[router])
+
+    elapsed = time.time() - start
+    size = sum([os.path.getsize(os.path.join(directory, name))
+                for name in os.listdir(directory)])
+    phases['write'] = {'seconds': elapsed,
+                       'rules': count,
+                       'bytes': size,
+                       'rules_per_second': rate(count, elapsed),
+                       'bytes_per_second': rate(size, elapsed),
+                       'peak_mb': peakMemory(),
+                       'growth_mb': peakMemory() - memory}
+  except Exception as e:
+    queue.put({'error': "Run failed: %s" % e})
+    return
+  finally:
+    shutil.rmtree(directory, ignore_errors=True)
+
+  queue.put({'phases': phases})
+
+def run(parameters):
+  """Runs the benchmark for one combination of sizes.
+
+  Args:
+    parameters: dictionary of the sizes and settings of the run.
+
+  Returns:
+    A dictionary with the measures of each phase ('phases') or the
+    description of the failure ('error').
+  """
+
+  parent, child = multiprocessing.Pipe()
+  server = multiprocessing.Process(target=serve, args=(parameters, child))
+  server.daemon = True
+  server.start()
+
+  try:
+    if not parent.poll(parameters['timeout'] * 10):
+      return {'error': "Stand-in server did not start."}
+    port = parent.recv()
+
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=measure,
+                                      args=(parameters, port, queue))
+    process.start()
+    try:
+      result = queue.get()
+    finally:
+      process.join()
+    return result
+  finally:
+    parent.send(None)
+    server.join()
+
+def compare(record, previous):
+  """Prints the evolution of the duration of each phase since a previous run.
+
+  Args:
+    record: record of the current run.
+    previous: record of a previous run with the same parameters.
+  """
+
+  print("  compared to %s (%s):" % (previous.get('commit') or "unknown commit",
+                                    previous.get('date')))
+  for phase in ['crawl', 'match', 'write']:
+    before = previous['phases'][phase]['seconds']
+    after  = record['phases'][phase]['seconds']
+    if before > 0:
+      print("    %-5s %+7.1f%%" % (phase, (after - before) * 100 / before))
+
+def report(record):
+  """Prints the measures of a run.
+
+  Args:
+    record: record of the run.
+  """
+
+  phases = record['phases']
+  crawl, match, write = phases['crawl'], phases['match'], phases['write']
+  print("  crawl %8.3fs %9.0f queries/s %9.0f services/s  peak %7.1f MiB " %
+        (crawl['seconds'], crawl['queries_per_second'],
+         crawl['services_per_second'], crawl['peak_mb']) +
+        "(+%.1f)" % crawl['growth_mb'])
+  print("  match %8.3fs %9.0f routers/s %9.0f entries/s   peak %7.1f MiB " %
+        (match['seconds'], match['routers_per_second'],
+         match['entries_per_second'], match['peak_mb']) +
+        "(+%.1f)" % match['growth_mb'])
+  print("  write %8.3fs %9.0f rules/s   %9.0f KiB/s       peak %7.1f MiB " %
+        (write['seconds'], write['rules_per_second'],
+         write['bytes_per_second'] / 1024, write['peak_mb']) +
+        "(+%.1f)" % write['growth_mb'])
+
+def integers(text):
+  """Parses a comma-separated list of integers of the command line."""
+
+  try:
+    return [int(value) for value in text.split(",")]
+  except ValueError:
+    raise argparse.ArgumentTypeError("'%s' is not a list of integers." % text)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description="Benchmark of the policy manager against synthetic DNS-SD "
+                "zones served locally. Sizes accept comma-separated lists, "
+                "every combination is measured.")
+  for size, default in SIZES:
+    parser.add_argument("--" + size, type=integers, default=default,
+                        help="default: %s" % ",".join(map(str, default)))
+  parser.add_argument("--dual-stack", type=float, default=1.0,
+                      help="fraction of dual-stack hosts (default: 1.0)")
+  parser.add_argument("--interfaces", type=int, default=2,
+                      help="public interfaces per router (default: 2)")
+  parser.add_argument("--workers", type=int, default=1,
+                      help="concurrent queries of the crawl (default: 1)")
+  parser.add_argument("--format", default="script",
+                      help="space-separated output formats (default: script)")
+  parser.add_argument("--aggregation", choices=RuleWriter.AGGREGATIONS,
+                      default="none")
+  parser.add_argument("--optimize", action="store_true",
+                      help="compact the rules with RuleOptimizer")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--timeout", type=float, default=5.0,
+                      help="lifetime of a DNS query in seconds (default: 5)")
+  parser.add_argument("--results", default="benchmark-results.json",
+                      help="file the results are appended to, one JSON "
+                           "object per line (default: %(default)s)")
+  arguments = parser.parse_args()
+
+  formats = arguments.format.split()
+  for fmt in formats:
+    if not fmt in RuleWriter.FORMATS:
+      parser.error("Unknown output format '%s'." % fmt)
+
+  # Previous results, to compare with.
+  history = []
+  if os.path.exists(arguments.results):
+    with open(arguments.results) as f:
+      for line in f:
+        try:
+          history.append(json.loads(line))
+        except ValueError:
+          pass
+
+  commit = currentCommit()
+  failed = False
+  names  = [size for size, _ in SIZES]
+  for values in itertools.product(*[getattr(arguments, size)
+                                    for size in names]):
+    parameters = dict(zip(names, values))
+    parameters.update({'dual_stack': arguments.dual_stack,
+                       'interfaces': arguments.interfaces,
+                       'workers': arguments.workers,
+                       'formats': formats,
+                       'aggregation': arguments.aggregation,
+                       'optimize': arguments.optimize,
+                       'seed': arguments.seed,
+                       'timeout': arguments.timeout})
+
+    print("routers=%(routers)i types=%(types)i instances=%(instances)i " %
+          parameters + "addresses=%(addresses)i rules=%(rules)i" % parameters)
+
+    result = run(parameters)
+    if 'error' in result:
+      print("  %s" % result['error'])
+      failed = True
+      continue
+
+    record = {'commit': commit,
+              'date': time.strftime("%Y-%m-%dT%H:%M:%S"),
+              'python': platform.python_version(),
+              'machine': platform.node(),
+              'parameters': parameters,
+              'phases': result['phases']}
+    report(record)
+
+    previous = [old for old in history
+                if old.get('parameters') == parameters and 'phases' in old]
+    if previous:
+      compare(record, previous[-1])
+
+    with open(arguments.results, 'a') as f:
+      f.write(json.dumps(record, sort_keys=True) + "\n")
+    history.append(record)
+
+  if failed:
+    sys.exit(1)
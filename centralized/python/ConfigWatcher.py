@@ -0,0 +1,218 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/python/ConfigWatcher.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Module keeping the rules of the configuration file in memory and re-parsing
+them only when the content of the file changes.
+"""
+
+import os              # for stat
+import hashlib         # to detect content changes
+import threading       # to share the watcher between threads
+
+from lxml import etree # to parse .xml and .dtd files
+
+# inotify is optional: without it, the file is polled with stat().
+try:
+  import pyinotify
+except ImportError:
+  pyinotify = None
+
+class ConfigWatcher:
+  """Watches the configuration file of the policy manager.
+
+  The compiled DTD and the parsed rules are kept in memory. The file is read
+  again only when inotify reports a write (or, without inotify, when its
+  modification time, size or inode changes) and re-parsed only when the hash
+  of its content changes. When inotify is available, a write also sets events
+  so that the rules are regenerated immediately, e.g. right after the web
+  interface saved new rules. A watcher may be shared by the managers of
+  several domains, each subscribing its own event."""
+
+  def __init__(self, logger, directory='/etc/policy-manager/', event=None):
+    """Constructor.
+
+    Args:
+      logger: logger used to report events.
+      directory: directory of config.xml and config.dtd.
+      event: threading.Event set when the configuration file is written. May
+        be None.
+    """
+
+    self.logger = logger
+    self.path   = os.path.join(directory, 'config.xml')
+    self.events = []
+    self.lock   = threading.Lock()
+    if event is not None:
+      self.events.append(event)
+
+    self.dtd    = None  # Compiled DTD, loaded once.
+    self.stat   = None  # (mtime, size, inode) of the file when last read.
+    self.digest = None  # Hash of the content of the file when last parsed.
+    self.rules  = None  # Rules of the file when last parsed.
+
+    # Set when the file has to be read again.
+    self.dirty = True
+
+    self.notifier = None
+    if pyinotify is not None:
+      try:
+        self.watch(directory)
+      except (OSError, pyinotify.NotifierError) as e:
+        self.logger.warning("Unable to watch %s with inotify, polling " %
+                            directory + "instead: %s" % e)
+        self.notifier = None
+
+  def watch(self, directory):
+    """Starts watching the directory of the configuration file with inotify.
+
+    Args:
+      directory: directory of config.xml.
+    """
+
+    watcher = self
+
+    class Handler(pyinotify.ProcessEvent):
+      def process_default(self, event):
+        if event.pathname == watcher.path:
+          watcher.dirty = True
+          for subscriber in list(watcher.events):
+            subscriber.set()
+
+    manager = pyinotify.WatchManager()
+    # The web interface rewrites the file in place, editors usually replace it.
+    manager.add_watch(directory, pyinotify.IN_CLOSE_WRITE |
+                                 pyinotify.IN_MOVED_TO |
+                                 pyinotify.IN_DELETE, quiet=False)
+    self.notifier = pyinotify.ThreadedNotifier(manager, Handler())
+    self.notifier.daemon = True
+    self.notifier.start()
+
+  def subscribe(self, event):
+    """Adds an event to set when the configuration file is written.
+
+    Args:
+      event: threading.Event.
+    """
+
+    self.events.append(event)
+
+  def stop(self):
+    """Stops watching the configuration file."""
+
+    if self.notifier is not None:
+      self.notifier.stop()
+      self.notifier = None
+
+  def refresh(self):
+    """Re-parses the configuration file if its content changed.
+
+    Returns:
+      The hash of the content of the file, or None if it cannot be read.
+    """
+
+    with self.lock:
+      return self.check()
+
+  def check(self):
+    """Same as refresh(), without locking."""
+
+    # With inotify, the file is only read when it has been written.
+    if self.notifier is not None and not self.dirty:
+      return self.digest
+    self.dirty = False
+
+    try:
+      st = os.stat(self.path)
+      stat = (st.st_mtime, st.st_size, st.st_ino)
+      if stat == self.stat:
+        return self.digest
+
+      with open(self.path, 'rb') as f:
+        content = f.read()
+    except (IOError, OSError) as e:
+      self.logger.error("Unable to read configuration file: %s" % e)
+      self.stat = None
+      self.digest = None
+      return None
+
+    self.stat = stat
+    digest = hashlib.sha1(content).hexdigest()
+    if digest != self.digest:
+      self.logger.debug("Configuration file changed. Parsing it.")
+      self.rules  = self.parse(content)
+      self.digest = digest
+
+    return self.digest
+
+  def getRules(self):
+    """Gets rules from the configuration file.
+
+    Returns:
+      An array of the rules (which are dictionaries) or None in case of failure.
+    """
+
+    with self.lock:
+      if self.digest is None:
+        self.check()
+
+      return self.rules
+
+  def parse(self, content):
+    """Parses the rules of the configuration file.
+
+    Args:
+      content: content of the configuration file.
+
+    Returns:
+      An array of the rules (which are dictionaries) or None in case of failure.
+    """
+
+    # Checking configuration file versus DTD.
+    try:
+      if self.dtd is None:
+        self.dtd = etree.DTD(os.path.join(os.path.dirname(self.path),
+                                          "config.dtd"))
+      xml = etree.ElementTree(etree.fromstring(content))
+      if (not self.dtd.validate(xml)):
+        self.logger.error("Configuration file is not a valid instance of DTD. "+
+                          "Firewall rules not generated.")
+        return None
+    except etree.LxmlError as e:
+      self.logger.error("Error while parsing configuration file: %s" % e)
+      return None
+
+    # Since we performed the DTD validation, we are sure the requested tags
+
+    rules = []
+    rules_tag = xml.find("./rules")
+    if (rules_tag == None):
+      pass # Rules are not mandatory.
+    else:
+      # For each rule.
+      for el in rules_tag:
+        action = el.text.strip() # Remove leading/trailing blanks.
+        if (action.lower() != "allow" and action.lower() != "deny"):
+          self.logger.warning("Action '%s' is neither 'allow' nor 'deny'. " +
+                              "Rule ignored.", action)
+          continue
+
+        # Add each rule in the 'rules' array.
+        d = dict(el.items())
+        d["action"] = action.lower()
+        rules.append(d)
+
+    if (len(rules) == 0):
+      self.logger.warning("No rules found.")
+
+    return rules
@@ -17,8 +17,15 @@ import dns.resolver
 import dns.exception
 import dns.query
 import dns.name
+import dns.rdatatype
 import socket
 import re
+import multiprocessing.pool
+import collections
+import threading
+import time
+
+import ServiceModel
 
 LABEL_NAME_ERROR  = 11
 NS_UNRESOLVED     = 12
@@ -37,14 +44,442 @@ def unescape(line):
   new = regex.sub(replace, line)
   return new.replace("\\", "")
 
+def add(found, type, service):
+  """Adds a service to the services found for a type, the type having failed
+  to be crawled if the service is None.
+
+  Args:
+    found: dictionary of the services (array of ServiceModel.Service) of each
+      type, None for the types which could not be crawled.
+    type: FQDN of the type.
+    service: ServiceModel.Service, None if it could not be crawled or False
+      if it does not exist.
+  """
+
+  if found[type] is None or service is False:
+    return
+  if service is None:
+    found[type] = None
+  else:
+    found[type].append(service)
+
+class ResolverCache:
+  """A bounded cache of DNS answers honoring their TTL.
+
+  Positive answers are kept until their expiration. NXDOMAIN and NoAnswer are
+  cached too (RFC 2308), for the TTL of the SOA of the negative response. When
+  the cache is full, the least recently used entry is evicted. The cache is
+  thread-safe so that it can be shared between concurrent queries and between
+  wrappers."""
+
+  def __init__(self, size=10000, max_ttl=None, negative_ttl=60):
+    """Constructor.
+
+    Args:
+      size: maximum number of entries.
+      max_ttl: if not None, maximum number of seconds an entry is kept,
+        whatever its TTL.
+      negative_ttl: number of seconds a negative answer is kept when its TTL
+        cannot be found in the response.
+    """
+
+    self.size         = size
+    self.max_ttl      = max_ttl
+    self.negative_ttl = negative_ttl
+    self.entries      = collections.OrderedDict() # key -> (expiration, value)
+    self.lock         = threading.Lock()
+
+    self.hits      = 0
+    self.misses    = 0
+    self.evictions = 0
+
+  def get(self, name, rdtype):
+    """Gets a cached answer.
+
+    Args:
+      name: queried name (string or dns.name.Name).
+      rdtype: queried type (e.g. 'PTR').
+
+    Returns:
+      A tuple (found, value). value is either a dns.resolver.Answer or the
+      exception (NXDOMAIN or NoAnswer) to raise.
+    """
+
+    key = (str(name).lower(), rdtype)
+    with self.lock:
+      entry = self.entries.pop(key, None)
+      if entry is None or entry[0] <= time.time():
+        self.misses += 1
+        return False, None
+
+      # Most recently used entries are at the end.
+      self.entries[key] = entry
+      self.hits += 1
+      return True, entry[1]
+
+  def put(self, name, rdtype, value):
+    """Caches an answer.
+
+    Args:
+      name: queried name (string or dns.name.Name).
+      rdtype: queried type (e.g. 'PTR').
+      value: either a dns.resolver.Answer or a NXDOMAIN or NoAnswer exception.
+    """
+
+    if isinstance(value, dns.exception.DNSException):
+      expiration = time.time() + self.negativeTTL(value)
+    else:
+      expiration = value.expiration
+
+    if self.max_ttl is not None:
+      expiration = min(expiration, time.time() + self.max_ttl)
+
+    key = (str(name).lower(), rdtype)
+    with self.lock:
+      self.entries.pop(key, None)
+      self.entries[key] = (expiration, value)
+
+      while len(self.entries) > self.size:
+        self.entries.popitem(last=False)
+        self.evictions += 1
+
+  def negativeTTL(self, exception):
+    """Gets the number of seconds a negative answer may be cached.
+
+    Args:
+      exception: NXDOMAIN or NoAnswer exception raised by dnspython.
+
+    Returns:
+      The minimum of the TTL and of the MINIMUM field of the SOA of the
+      response (RFC 2308 Section 5), or the default negative TTL.
+    """
+
+    kwargs = getattr(exception, 'kwargs', None) or dict()
+    responses = list((kwargs.get('responses') or dict()).values())
+    if kwargs.get('response') is not None:
+      responses.append(kwargs['response'])
+
+    for response in responses:
+      if response is None:
+        continue
+      for rrset in response.authority:
+        if rrset.rdtype == dns.rdatatype.SOA:
+          return min(rrset.ttl, rrset[0].minimum)
+
+    return self.negative_ttl
+
+  def invalidate(self, names, domain):
+    """Removes the entries of names whose records changed, e.g. as listed by
+    an incremental transfer, and the negative entries of their ancestors in
+    the domain, which may have been created by the change.
+
+    Args:
+      names: iterable of the names (string or dns.name.Name) changed.
+      domain: domain the names belong to.
+    """
+
+    domain  = domain.strip(".").lower()
+    changed = set([str(name).strip(".").lower() for name in names])
+    parents = set()
+    for name in changed:
+      while name.endswith("." + domain):
+        name = name.split(".", 1)[1]
+        parents.add(name)
+
+    with self.lock:
+      for key, entry in self.entries.items():
+        name = key[0].strip(".")
+        if name in changed or (
+            name in parents and
+            isinstance(entry[1], dns.exception.DNSException)):
+          del self.entries[key]
+
+  def clear(self, domain=None):
+    """Removes entries, e.g. when the serial of a zone changes.
+
+    Args:
+      domain: if not None, only the entries of this domain and of its
+        subdomains are removed, so that the entries of the other domains
+        sharing the cache are kept.
+    """
+
+    with self.lock:
+      if domain is None:
+        self.entries.clear()
+        return
+
+      domain = domain.strip(".").lower()
+      for key in self.entries.keys():
+        name = key[0].strip(".")
+        if name == domain or name.endswith("." + domain):
+          del self.entries[key]
+
+class CrawlRecovery:
+  """The failures of the crawl of the subdomains of a domain, so that a
+  subdomain which cannot be crawled does not fail the crawl of the others.
+
+  The router found by the last successful crawl of each subdomain is kept,
+  unless disabled to bound the memory. When the crawl of a subdomain fails,
+  the types which could not be crawled are taken from it and marked stale,
+  or the whole router if its types could not be listed. The subdomain is
+  then only crawled again after a delay doubling at each consecutive failure,
+  its last known router being used in the meantime. A subdomain whose router
+  is crawled but whose other records still fail (see postpone()) keeps
+  counting its consecutive failures until confirm() is called."""
+
+  def __init__(self, delay, maximum, keep=True):
+    """Constructor.
+
+    Args:
+      delay: number of seconds before the first retry of a subdomain.
+      maximum: maximum number of seconds between two retries.
+      keep: whether the routers of the successful crawls are kept. Without
+        them, a subdomain which cannot be crawled is left out of the result
+        of the crawl.
+    """
+
+    self.delay    = delay
+    self.maximum  = maximum
+    self.keep     = keep
+    self.routers  = dict() # subdomain -> last ServiceModel.Router crawled
+    self.failures = dict() # subdomain -> (consecutive failures, retry time)
+    self.pending  = dict() # subdomain -> failures before an unconfirmed
+                           # success
+
+  def retain(self, subdomains):
+    """Forgets the subdomains which are no longer crawled.
+
+    Args:
+      subdomains: array of the subdomains (FQDN) still crawled.
+    """
+
+    subdomains = set(subdomains)
+    for entries in [self.routers, self.failures, self.pending]:
+      for subdomain in entries.keys():
+        if not subdomain in subdomains:
+          del entries[subdomain]
+
+  def due(self, subdomain):
+    """Tells whether a subdomain has to be crawled, i.e. whether its last
+    crawl succeeded or its retry delay expired."""
+
+    entry = self.failures.get(subdomain)
+    return entry is None or entry[1] <= time.time()
+
+  def next(self):
+    """Gets the time of the next retry, or None if no subdomain failed."""
+
+    if not self.failures:
+      return None
+    return min([retry for _, retry in self.failures.values()])
+
+  def failing(self):
+    """Gets the subdomains (FQDN) whose last crawl failed."""
+
+    return self.failures.keys()
+
+  def fallback(self, subdomain):
+    """Gets the last router crawled in a subdomain, all its types being
+    marked stale.
+
+    Args:
+      subdomain: FQDN of the subdomain.
+
+    Returns:
+      A ServiceModel.Router, or None if the subdomain was never crawled (or
+      routers are not kept).
+    """
+
+    router = self.routers.get(subdomain)
+    if router is None:
+      return None
+
+    return ServiceModel.Router(subdomain, [
+      ServiceModel.ServiceType(stype.name, stype.services, True)
+      for stype in router.types])
+
+  def success(self, router):
+    """Records a successful crawl.
+
+    Args:
+      router: ServiceModel.Router crawled.
+    """
+
+    entry = self.failures.pop(router.fqdn, None)
+    if entry is not None:
+      self.pending[router.fqdn] = entry[0]
+    if self.keep:
+      self.routers[router.fqdn] = router
+
+  def confirm(self, subdomain):
+    """Records that the crawl of a subdomain fully succeeded, e.g. once the
+    public interfaces of its router are known, so that its next failure is
+    delayed again from the first retry delay.
+
+    Args:
+      subdomain: FQDN of the subdomain.
+    """
+
+    self.pending.pop(subdomain, None)
+
+  def postpone(self, subdomain):
+    """Records a failed crawl of a subdomain, e.g. of the public interfaces
+    of its router, so that it is crawled again after its retry delay. The
+    failures are counted from the last one if the crawl of the router was not
+    confirmed since.
+
+    Args:
+      subdomain: FQDN of the subdomain.
+    """
+
+    count = self.pending.pop(subdomain, 0)
+    count = self.failures.get(subdomain, (count, None))[0] + 1
+    delay = min(self.maximum, self.delay * 2 ** min(count - 1, 30))
+    self.failures[subdomain] = (count, time.time() + delay)
+
+  def failure(self, subdomain, types, found):
+    """Records a failed crawl and completes its result with the last router
+    crawled in the subdomain.
+
+    Args:
+      subdomain: FQDN of the subdomain.
+      types: array of the types (FQDN) of the subdomain, None if they could
+        not be crawled.
+      found: dictionary of the services (array of ServiceModel.Service) of
+        each type, None for the types which could not be crawled.
+
+    Returns:
+      A ServiceModel.Router whose types which could not be crawled are those
+      of the last router crawled, marked stale. The whole last router if it
+      does not have all of them. None if there is no last router.
+    """
+
+    self.postpone(subdomain)
+
+    previous = self.routers.get(subdomain)
+    if previous is None or types is None:
+      return self.fallback(subdomain)
+
+    known = dict([(stype.name, stype) for stype in previous.types])
+    stypes = []
+    for type in types:
+      name = ServiceModel.typeName(type, subdomain)
+      if found.get(type) is not None:
+        stypes.append(ServiceModel.ServiceType(name, found[type]))
+      elif name in known:
+        stypes.append(ServiceModel.ServiceType(name, known[name].services,
+                                               True))
+      else:
+        return self.fallback(subdomain)
+
+    return ServiceModel.Router(subdomain, stypes)
+
 class DNSWrapper:
   """A wrapper around the dnspython library to allow to easily perform DNS
   requests on a particular domain."""
 
-  def __init__(self, domain):
-    """Constructor."""
+  def __init__(self, domain, workers=1, cache=None, pool=None,
+               resolver=None):
+    """Constructor.
 
-    self.domain = domain
+    Args:
+      domain: domain to query.
+      workers: number of concurrent queries used to crawl the services.
+      cache: ResolverCache used for the queries of the crawl, possibly shared
+        with other wrappers. None to disable caching.
+      pool: multiprocessing.pool.ThreadPool of 'workers' threads used for the
+        concurrent queries, possibly shared with other wrappers. None to
+        create one on the first concurrent crawl.
+      resolver: HedgedResolver the queries are sent to. None to use the
+        recursive resolver of the system.
+    """
+
+    self.domain   = domain
+    self.workers  = workers
+    self.cache    = cache
+    self.pool     = pool
+    self.resolver = resolver
+
+    # Queries sent on the network and failed queries (negative answers are not
+    # failures), for the metrics.
+    self.queries  = 0
+    self.failures = 0
+    self.counters = threading.Lock()
+
+  def query(self, name, rdtype):
+    """Performs a DNS query, answered from the cache when possible. All the
+    queries of the crawl go through this method.
+
+    Args:
+      name: name to query (string or dns.name.Name).
+      rdtype: type of the record to query (e.g. 'PTR').
+
+    Returns:
+      An iterable of the rdata of the answer.
+
+    Raises:
+      The exceptions of dns.resolver.query().
+    """
+
+    if self.cache is None:
+      return self.lookup(name, rdtype)
+
+    found, value = self.cache.get(name, rdtype)
+    if found:
+      if isinstance(value, dns.exception.DNSException):
+        raise value
+      return value
+
+    try:
+      answer = self.lookup(name, rdtype)
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+      self.cache.put(name, rdtype, e)
+      raise
+
+    self.cache.put(name, rdtype, answer)
+    return answer
+
+  def lookup(self, name, rdtype):
+    """Performs a DNS query on the network, bypassing the cache. A query sent
+    to several servers by the HedgedResolver counts as one query.
+
+    Args:
+      name: name to query (string or dns.name.Name).
+      rdtype: type of the record to query (e.g. 'PTR').
+
+    Returns:
+      A dns.resolver.Answer.
+
+    Raises:
+      The exceptions of dns.resolver.query().
+    """
+
+    try:
+      if self.resolver is not None:
+        answer = self.resolver.query(name, rdtype)
+      else:
+        answer = dns.resolver.query(name, rdtype)
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+      self.count(False)
+      raise
+    except dns.exception.DNSException:
+      self.count(True)
+      raise
+
+    self.count(False)
+    return answer
+
+  def count(self, failed):
+    """Counts a query sent on the network.
+
+    Args:
+      failed: whether the query failed (timeout, SERVFAIL, ...).
+    """
+
+    with self.counters:
+      self.queries += 1
+      if failed:
+        self.failures += 1
 
   def getSerial(self):
     """Gets the serial field of the SOA of the domain.
@@ -53,8 +488,9 @@ class DNSWrapper:
       The serial field of the SOA or 0 if query fails.
     """
 
+    # The serial is what tells us the zone changed, it is never cached.
     try:
-      answers = dns.resolver.query(self.domain, 'SOA')
+      answers = self.lookup(self.domain, 'SOA')
 
       for rdata in answers:
         soa = rdata.serial
@@ -67,102 +503,337 @@ class DNSWrapper:
 
     return soa
 
-  def getServices(self):
+  def getServices(self, owned=None, recovery=None):
     """Gets the services announced in the domain and its subdomains.
 
-    Returns:
-      A dictionary A whose keys are the different subdomains found. Elements of 
-      A are dictionaries B whose keys are the different types found in the 
-      subdomain. Elements of B are arrays of dictionaries C representing the
-      services of the given type in the given subdomain. Those services are 
-      represented by the keys: name, port, host, addresses (array of addresses). 
+    When the wrapper has more than one worker, each level of the tree
+    (subdomains, types, instances) is crawled concurrently so that the crawl
+    time depends on the depth of the tree rather than on the number of
+    instances.
 
-      None in case of failure.
+    Args:
+      owned: function taking the FQDN of a subdomain and returning whether it
+        has to be crawled. None to crawl all the subdomains.
+      recovery: CrawlRecovery isolating the failures of the subdomains. None
+        to fail the whole crawl as soon as a query fails.
+
+    Returns:
+      A dictionary whose keys are the different subdomains found. Elements
+      are ServiceModel.Router, holding the types found in the subdomain and
+      the services of each type. With a CrawlRecovery, the subdomains which
+      could not be crawled have their last router (see
+      CrawlRecovery.failure()), or are left out if there is none.
+
+      None in case of failure (of the listing of the subdomains only, with a
+      CrawlRecovery).
     """
-    
-    services = dict()
 
     # Getting subdomains.
+    subdomains = self.getSubdomains()
+    if subdomains is None:
+      return None
+    if owned is not None:
+      subdomains = [subdomain for subdomain in subdomains if owned(subdomain)]
+
+    # Subdomains whose retry delay did not expire keep their last router.
+    services = dict()
+    if recovery is not None:
+      recovery.retain(subdomains)
+      for subdomain in subdomains:
+        if not recovery.due(subdomain):
+          router = recovery.fallback(subdomain)
+          if router is not None:
+            services[subdomain] = router
+      subdomains = [subdomain for subdomain in subdomains
+                    if recovery.due(subdomain)]
+
+    # For each subdomain, getting the different types.
+    types = self.map(self.getTypes, subdomains)
+    if None in types and recovery is None:
+      return None
+
+    pairs = []
+    for subdomain, subdomain_types in zip(subdomains, types):
+      for type in subdomain_types or []:
+        pairs.append((subdomain, type))
+
+    # For each type, getting the different services.
+    instances = self.map(self.getInstances, [type for _, type in pairs])
+    if None in instances and recovery is None:
+      return None
+
+    targets = []
+    for (subdomain, type), type_instances in zip(pairs, instances):
+      for instance in type_instances or []:
+        targets.append((subdomain, type, instance))
+
+    # For each instance, getting host, addresses and port.
+    results = self.map(self.getInstance,
+                       [instance for _, _, instance in targets])
+    if None in results and recovery is None:
+      return None
+
+    found = dict() # subdomain -> type -> array of ServiceModel.Service
+    for (subdomain, type), type_instances in zip(pairs, instances):
+      found.setdefault(subdomain, dict())[type] = (
+        [] if type_instances is not None else None)
+    for (subdomain, type, _), service in zip(targets, results):
+      add(found[subdomain], type, service)
+
+    for subdomain, subdomain_types in zip(subdomains, types):
+      router = self.build(subdomain, subdomain_types,
+                          found.get(subdomain, dict()), recovery)
+      if router is not None:
+        services[subdomain] = router
+
+    return services
+
+  def iterServices(self, owned=None, recovery=None):
+    """Gets the services announced in the domain one router at a time, so that
+    the services of a router can be used and forgotten before the next router
+    is crawled.
+
+    When the wrapper has more than one worker, the instances of a router are
+    crawled concurrently.
+
+    Args:
+      owned: same as for getServices().
+      recovery: same as for getServices().
+
+    Returns:
+      A generator of ServiceModel.Router, one per subdomain. In case of
+      failure, it yields None and stops. With a CrawlRecovery, the subdomains
+      which could not be crawled are handled as by getServices().
+    """
+
+    subdomains = self.getSubdomains()
+    if subdomains is None:
+      yield None
+      return
+    if owned is not None:
+      subdomains = [subdomain for subdomain in subdomains if owned(subdomain)]
+    if recovery is not None:
+      recovery.retain(subdomains)
+
+    for router in self.iterRouters(subdomains, recovery):
+      yield router
+
+  def iterRouters(self, subdomains, recovery=None):
+    """Gets the services announced in subdomains one router at a time.
+
+    Args:
+      subdomains: array of the subdomains (FQDN) to crawl.
+      recovery: same as for getServices().
+
+    Returns:
+      Same as iterServices().
+    """
+
+    for subdomain in subdomains:
+      if recovery is not None and not recovery.due(subdomain):
+        router = recovery.fallback(subdomain)
+      else:
+        router = self.getRouter(subdomain, recovery)
+        if router is None and recovery is None:
+          yield None
+          return
+
+      if router is not None:
+        yield router
+
+  def getRouter(self, subdomain, recovery=None):
+    """Gets the services announced in a subdomain.
+
+    Args:
+      subdomain: FQDN of the subdomain.
+      recovery: same as for getServices().
+
+    Returns:
+      A ServiceModel.Router or None in case of failure (see build()).
+    """
+
+    types = self.getTypes(subdomain)
+    if types is None and recovery is None:
+      return None
+
+    instances = self.map(self.getInstances, types or [])
+    if None in instances and recovery is None:
+      return None
+
+    targets = []
+    for type, type_instances in zip(types or [], instances):
+      for instance in type_instances or []:
+        targets.append((type, instance))
+
+    results = self.map(self.getInstance, [instance for _, instance in targets])
+    if None in results and recovery is None:
+      return None
+
+    found = dict() # type -> array of ServiceModel.Service
+    for type, type_instances in zip(types or [], instances):
+      found[type] = [] if type_instances is not None else None
+    for (type, _), service in zip(targets, results):
+      add(found, type, service)
+
+    return self.build(subdomain, types, found, recovery)
+
+  def build(self, subdomain, types, found, recovery):
+    """Builds the router of a subdomain from the results of its crawl.
+
+    Servers may return records in any order: the model sorts types, services
+    and addresses so that the same zone always gives the same services, and
+    thus the same fingerprints.
+
+    Args:
+      subdomain: FQDN of the subdomain.
+      types: array of the types (FQDN) of the subdomain, None if they could
+        not be crawled.
+      found: dictionary of the services (array of ServiceModel.Service) of
+        each type, None for the types which could not be crawled.
+      recovery: CrawlRecovery the result of the crawl is recorded in, or None.
+
+    Returns:
+      A ServiceModel.Router. If the crawl failed, the one returned by
+      CrawlRecovery.failure(), or None without CrawlRecovery.
+    """
+
+    if types is None or None in found.values():
+      if recovery is None:
+        return None
+      return recovery.failure(subdomain, types, found)
+
+    router = ServiceModel.Router(subdomain, [
+      ServiceModel.ServiceType(ServiceModel.typeName(type, subdomain),
+                               found[type])
+      for type in types])
+    if recovery is not None:
+      recovery.success(router)
+
+    return router
+
+  def map(self, function, arguments):
+    """Applies a function to each element of an array, concurrently if the
+    wrapper has more than one worker.
+
+    Args:
+      function: function taking one argument.
+      arguments: array of arguments.
+
+    Returns:
+      The array of the results, in the order of the arguments.
+    """
+
+    if self.workers <= 1 or len(arguments) <= 1:
+      return [function(argument) for argument in arguments]
+
+    if self.pool is None:
+      self.pool = multiprocessing.pool.ThreadPool(self.workers)
+
+    return self.pool.map(function, arguments)
+
+  def getSubdomains(self):
+    """Gets the subdomains of the domain announcing services.
+
+    Returns:
+      An array of the subdomains or None in case of failure.
+    """
+
     try:
-      subdomains_answer = dns.resolver.query('b._dns-sd._udp.' + self.domain.strip("."), 'PTR')
+      answer = self.query('b._dns-sd._udp.' + self.domain.strip("."), 'PTR')
     except (dns.resolver.NoAnswer,
             dns.resolver.NXDOMAIN,
             dns.exception.DNSException):
       return None
 
-    # For each subdomain, getting the different types.
-    for subdomains in subdomains_answer:
-      subdomain = str(subdomains.target)
-      services[subdomain] = dict()
-      
+    return [str(rdata.target) for rdata in answer]
+
+  def getTypes(self, subdomain):
+    """Gets the service types announced in a subdomain.
+
+    Args:
+      subdomain: FQDN of the subdomain.
+
+    Returns:
+      An array of the types (FQDN), empty if the subdomain announces none
+      (e.g. its last type was removed), or None in case of failure.
+    """
+
+    try:
+      answer = self.query('_services._dns-sd._udp.' + subdomain.strip("."),
+                          'PTR')
+    except (dns.resolver.NoAnswer,
+            dns.resolver.NXDOMAIN):
+      return []
+    except dns.exception.DNSException:
+      return None
+
+    return [str(rdata.target) for rdata in answer]
+
+  def getInstances(self, type):
+    """Gets the instances of a service type.
+
+    Args:
+      type: FQDN of the type.
+
+    Returns:
+      An array of the instances (dns.name.Name), empty if the type has none,
+      or None in case of failure.
+    """
+
+    try:
+      answer = self.query(type, 'PTR')
+    except (dns.resolver.NoAnswer,
+            dns.resolver.NXDOMAIN):
+      return []
+    except dns.exception.DNSException:
+      return None
+
+    return [rdata.target for rdata in answer]
+
+  def getInstance(self, instance):
+    """Gets the host, port and addresses of a service instance.
+
+    Args:
+      instance: name (dns.name.Name) of the instance.
+
+    Returns:
+      A ServiceModel.Service, False if the instance does not exist (e.g. a
+      PTR record left after the instance was removed) or None in case of
+      failure.
+    """
+
+    # Host and port.
+    try:
+      srv_answer = self.query(instance, 'SRV')
+    except (dns.resolver.NoAnswer,
+            dns.resolver.NXDOMAIN):
+      return False
+    except dns.exception.DNSException:
+      return None
+
+    # Should be only one.
+    for srv in srv_answer:
+      port = srv.port
+      host = str(srv.target)
+
+    # Addresses of each IP version, packed into integers.
+    addresses = {4: [], 6: []}
+    for version, rdtype in [(6, 'AAAA'), (4, 'A')]:
       try:
-        types_answer = dns.resolver.query('_services._dns-sd._udp.' + subdomain.strip("."), 'PTR')
-      except (dns.resolver.NoAnswer,
-              dns.resolver.NXDOMAIN,
-              dns.exception.DNSException):
+        answers = self.query(srv.target, rdtype)
+
+        for rdata in answers:
+          value = ServiceModel.pack(version, rdata.address)
+          if value is not None:
+            addresses[version].append(value)
+      except (dns.resolver.NXDOMAIN,
+              dns.resolver.NoAnswer):
+        pass
+      except dns.exception.DNSException:
         return None
 
-      # For each type, getting the different services.
-      for types in types_answer:
-        type = str(types.target)
-        services[subdomain][type] = []
-
-        try:
-          instances_answer = dns.resolver.query(type, 'PTR')
-        except (dns.resolver.NoAnswer,
-                dns.resolver.NXDOMAIN,
-                dns.exception.DNSException):
-          return None
-
-        # For each instance, getting host, addresses and port.
-        for instances in instances_answer:
-          services[subdomain][type].append(dict())
-          instance = unescape(str(instances.target))
-          services[subdomain][type][-1]['name'] = instance
-
-          # Host and port.
-          try:
-            srv_answer = dns.resolver.query(instances.target, 'SRV')
-          except (dns.resolver.NoAnswer,
-                  dns.resolver.NXDOMAIN,
-                  dns.exception.DNSException):
-            return None
-
-          # Should be only one.
-          for srv in srv_answer:
-            services[subdomain][type][-1]['port'] = srv.port
-            services[subdomain][type][-1]['host'] = str(srv.target)
-
-          # IPv6 addresses.
-          addresses = []
-          try:
-            answers_IPv6 = dns.resolver.query(srv.target, 'AAAA')
-
-            for rdata in answers_IPv6:
-              addresses.append(rdata.address)
-          except (dns.resolver.NXDOMAIN,
-                  dns.resolver.NoAnswer,
-                  dns.resolver.NoNameservers,
-                  dns.exception.Timeout,
-                  dns.exception.DNSException):
-            pass
-
-          # IPv4 addresses.
-          try:
-            answers_IPv4 = dns.resolver.query(srv.target, 'A')
-
-            for rdata in answers_IPv4:
-              addresses.append(rdata.address)
-          except (dns.resolver.NXDOMAIN,
-                  dns.resolver.NoAnswer,
-                  dns.resolver.NoNameservers,
-                  dns.exception.Timeout,
-                  dns.exception.DNSException):
-            pass
-
-          services[subdomain][type][-1]['addresses'] = addresses
-
-    return services
+    return ServiceModel.Service(unescape(str(instance)), port, host,
+                                addresses[4], addresses[6])
 
   def getPublicInterfaces(self, router):
     """Gets the public interfaces announced by a router in the domain.
@@ -171,13 +842,13 @@ class DNSWrapper:
       router: name of the router.
 
     Returns:
-      An array of the interfaces announced by the router or None in case of 
-      failure.
+      An array of the interfaces announced by the router, empty if it
+      announces none, or None in case of failure.
     """
 
     interfaces = []
     try:
-      answer = dns.resolver.query(router + "." + self.domain.strip("."), 'TXT')
+      answer = self.query(router + "." + self.domain.strip("."), 'TXT')
 
       for rdata in answer:
         for string in rdata.strings:
@@ -187,10 +858,9 @@ class DNSWrapper:
             for ifc in ifcs:
               interfaces.append(ifc)
     except (dns.resolver.NXDOMAIN,
-            dns.resolver.NoAnswer,
-            dns.resolver.NoNameservers,
-            dns.exception.Timeout,
-            dns.exception.DNSException):
+            dns.resolver.NoAnswer):
+      return []
+    except dns.exception.DNSException:
       return None
 
     return interfaces
@@ -0,0 +1,160 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/python/DomainManager.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Module running the policy managers of several domains in one process.
+"""
+
+import os              # for paths
+import socket          # for socket errors
+import threading       # for the tasks of the domains
+import multiprocessing.pool # for the shared pool of the crawls
+
+import ConfigWatcher   # to follow the configuration file
+import DNSWrapper      # for the shared cache
+import Metrics         # to expose metrics
+import NotifyListener  # to be notified of changes of the DNS
+import ParallelCompiler # for the shared pool of compile workers
+import PolicyManager   # to manage each domain
+
+class DomainManager:
+  """Manages the rules of several domains in one process.
+
+  Each domain has its own PolicyManager, running in its own thread and woken
+  up by its own event, with its own serial, snapshot and output directory.
+  The configuration file, the cache of DNS answers, the pool of threads of
+  the crawls, the pool of processes computing the files, the metrics
+  (labelled by domain) and the NOTIFY listener are shared by all the
+  domains.
+
+  To start the process, simply call the start() method."""
+
+  def __init__(self, logger, domains, rate, options=None):
+    """Constructor.
+
+    Args:
+      logger: logger used to report events.
+      domains: array of tuples (domain, directory). The directory in which the
+        files of a domain are written may be None to default to a
+        subdirectory of /etc/policy-manager/ named after the domain.
+      rate: number of seconds between two checks for changes.
+      options: dictionary of the optional settings of the configuration file,
+        as for PolicyManager.
+    """
+
+    self.logger  = logger
+    self.rate    = rate
+    self.options = options or dict()
+    self.threads = []
+
+    # Resources shared by the domains. The compile workers are forked first,
+    # before any thread is started (see ParallelCompiler).
+    self.compiler = None
+    processes = self.options.get('processes', 1)
+    if processes > 1 and not self.options.get('stream', False):
+      self.compiler = ParallelCompiler.ParallelCompiler(self.logger, processes)
+    self.config = ConfigWatcher.ConfigWatcher(self.logger,
+                                              '/etc/policy-manager/')
+    self.cache = None
+    if self.options.get('cache') is not None:
+      size, max_ttl = self.options['cache']
+      self.cache = DNSWrapper.ResolverCache(size, max_ttl)
+    self.pool = None
+    if self.options.get('workers', 1) > 1:
+      self.pool = multiprocessing.pool.ThreadPool(self.options['workers'])
+    self.metrics = Metrics.Metrics()
+
+    self.managers = []
+    for domain, directory in domains:
+      name = domain.strip(".")
+
+      # The NOTIFY listener and the metrics endpoint are started once for all
+      # the domains.
+      options = dict(self.options)
+      options.pop('notify', None)
+      options.pop('metrics', None)
+      options['directory'] = directory or os.path.join('/etc/policy-manager/',
+                                                       name)
+      if options.get('snapshot', PolicyManager.SNAPSHOT_PATH) is not None:
+        path, extension = os.path.splitext(
+          options.get('snapshot', PolicyManager.SNAPSHOT_PATH))
+        options['snapshot'] = "%s-%s%s" % (path, name, extension)
+      if options.get('shard') is not None:
+        directory, instance, ttl = options['shard']
+        options['shard'] = (os.path.join(directory, name), instance, ttl)
+
+      shared = {'config': self.config,
+                'cache': self.cache,
+                'pool': self.pool,
+                'compiler': self.compiler,
+                'metrics': self.metrics.bind(domain=name)}
+      self.managers.append(PolicyManager.PolicyManager(self.logger, domain,
+                                                       rate, options, shared))
+
+  def start(self):
+    """Starts the process. Returns when all the domains are stopped."""
+
+    listener = None
+    if self.options.get('notify') is not None:
+      address, port = self.options['notify']
+      try:
+        listener = NotifyListener.NotifyListener(self.logger,
+                                                 self.managers[0].domain,
+                                                 self.managers[0].wakeup,
+                                                 address, port)
+        for manager in self.managers[1:]:
+          listener.add(manager.domain, manager.wakeup)
+        listener.start()
+      except socket.error as e:
+        self.logger.error("Unable to listen for NOTIFY on %s port %i: %s" %
+                          (address, port, e))
+        listener = None
+
+    server = None
+    if self.options.get('metrics') is not None:
+      address, port = self.options['metrics']
+      try:
+        server = Metrics.MetricsServer(self.logger, self.metrics, address, port)
+        server.start()
+      except socket.error as e:
+        self.logger.error("Unable to serve metrics on %s port %i: %s" %
+                          (address, port, e))
+        server = None
+
+    for manager in self.managers:
+      thread = threading.Thread(target=manager.start,
+                                name="domain-%s" % manager.domain)
+      thread.daemon = True
+      thread.start()
+      self.threads.append(thread)
+
+    # Waiting with a timeout so that signals are still handled.
+    for thread in self.threads:
+      while thread.is_alive():
+        thread.join(1)
+
+    if listener is not None:
+      listener.stop()
+    if server is not None:
+      server.stop()
+    if self.pool is not None:
+      self.pool.close()
+    if self.compiler is not None:
+      self.compiler.close()
+    self.config.stop()
+
+  def stop(self):
+    """Stops the computations of all the domains."""
+
+    for manager in self.managers:
+      manager.stop()
@@ -0,0 +1,292 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/python/FlowSimulator.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Module evaluating recorded flows against rules and services with NumPy, to
+see what a change of the rules would allow or deny before applying it.
+
+NumPy is only needed by this module, not by the policy manager.
+"""
+
+import socket          # to parse addresses
+import struct          # to convert addresses to integers
+
+import netaddr         # for manipulation of IP addresses
+import numpy           # for the evaluation of the flows
+
+import PolicyEngine    # to compile the rules
+
+# Verdict of a flow no rule applies to (the default policy of the router then
+# decides).
+NO_RULE = -1
+
+# Columns identifying the destination of a flow.
+ENDPOINT = [('version', numpy.int8), ('hi', numpy.uint64),
+            ('lo', numpy.uint64), ('port', numpy.int32), ('tcp', numpy.bool_)]
+
+LOW = (1 << 64) - 1
+
+def split(version, value):
+  """Splits the integer value of an address into two 64-bit halves, so that
+  IPv4 and IPv6 addresses fit in the same columns.
+
+  Args:
+    version: 4 or 6.
+    value: integer value of the address (IPv4 addresses are in the low half).
+
+  Returns:
+    A tuple (high half, low half).
+  """
+
+  if version == 4:
+    return (0, value)
+  return (value >> 64, value & LOW)
+
+def address(text):
+  """Parses an address.
+
+  Args:
+    text: text of the address.
+
+  Returns:
+    A tuple (version, high half, low half), or None if it is not valid.
+  """
+
+  try:
+    if ":" in text:
+      hi, lo = struct.unpack("!QQ", socket.inet_pton(socket.AF_INET6, text))
+      return (6, hi, lo)
+    return (4, 0, struct.unpack("!I", socket.inet_aton(text))[0])
+  except (socket.error, struct.error):
+    return None
+
+def batch(flows):
+  """Converts flows to the columns evaluated by FlowSimulator.evaluate().
+
+  Args:
+    flows: iterable of tuples (source, destination, port, protocol) where the
+      addresses are texts, the port an integer or its text and the protocol a
+      name or number (tcp, udp, 6, 17...). Invalid flows are kept, no rule
+      applies to them.
+
+  Returns:
+    A dictionary of NumPy arrays: version, src_hi, src_lo (source address) and
+    endpoint (structured array of the destination, see ENDPOINT).
+  """
+
+  sources   = []
+  endpoints = []
+  parsed    = dict()  # Addresses repeat a lot in flow logs.
+  for source, destination, port, protocol in flows:
+    src = parsed.get(source)
+    if src is None:
+      src = parsed[source] = address(source)
+    dst = parsed.get(destination)
+    if dst is None:
+      dst = parsed[destination] = address(destination)
+    try:
+      port = int(port)
+    except ValueError:
+      src = None
+    if src is None or dst is None or src[0] != dst[0]:
+      sources.append((0, 0, 0))
+      endpoints.append((0, 0, 0, 0, False))
+      continue
+
+    sources.append(src)
+    endpoints.append(dst + (port, str(protocol).lower() in ['tcp', '6']))
+
+  columns = numpy.array(sources, dtype=[('version', numpy.int8),
+                                        ('hi', numpy.uint64),
+                                        ('lo', numpy.uint64)]).reshape(-1)
+  return {'version': columns['version'],
+          'src_hi': columns['hi'],
+          'src_lo': columns['lo'],
+          'endpoint': numpy.array(endpoints, dtype=ENDPOINT).reshape(-1)}
+
+class FlowSimulator:
+  """Rules and services compiled into NumPy arrays, evaluating batches of
+  flows as the generated firewall rules would.
+
+  The source prefix of each rule is stored as network and mask columns, and
+  which rules apply to each destination (address, port and protocol of a
+  service) is stored as a boolean matrix, the type and name patterns of the
+  rules being evaluated once per string when the simulator is built. A flow is
+  decided by the first rule, in the order of the configuration file, whose
+  prefix contains its source and which applies to its destination. When a
+  destination is announced by several routers, the rules of all of them
+  apply to it. Interfaces are not considered."""
+
+  def __init__(self, logger, rules, services, chunk=1 << 22):
+    """Constructor.
+
+    Args:
+      logger: logger used to report ignored rules.
+      rules: array of the rules as returned by PolicyManager.getRules().
+      services: services as returned by DNSWrapper.getServices().
+      chunk: maximum number of (flow, rule) pairs evaluated at once, which
+        bounds the memory used by evaluate().
+    """
+
+    self.logger = logger
+    self.chunk  = chunk
+    self.engine = PolicyEngine.PolicyEngine(logger, rules)
+
+    # Columns of the rules, in the order of the configuration file.
+    self.rules = []
+    columns    = []
+    for rule in self.engine.rules:
+      try:
+        network = netaddr.IPNetwork(rule.source)
+      except (netaddr.core.AddrFormatError, ValueError):
+        self.logger.warning("%s is not a valid prefix. Rule ignored." %
+                            rule.source)
+        continue
+      self.rules.append(rule)
+      columns.append((rule.version,)
+                     + split(rule.version, network.first)
+                     + split(rule.version, int(network.netmask)))
+    position = dict([(rule.index, i) for i, rule in enumerate(self.rules)])
+
+    columns = numpy.array(columns, dtype=[('version', numpy.int8),
+                                          ('net_hi', numpy.uint64),
+                                          ('net_lo', numpy.uint64),
+                                          ('mask_hi', numpy.uint64),
+                                          ('mask_lo', numpy.uint64)])
+
+    # Flows are only compared with the rules of their IP version, on the
+    # words of the addresses of that version: for each version, the
+    # positions of its rules and tuples (column of the source address,
+    # networks, masks), in 32-bit words for IPv4.
+    self.columns = dict()
+    self.words   = dict()
+    for version in [4, 6]:
+      positions = numpy.nonzero(columns['version'] == version)[0]
+      self.columns[version] = positions
+      if version == 4:
+        self.words[version] = [
+          ('src_lo', columns['net_lo'][positions].astype(numpy.uint32),
+           columns['mask_lo'][positions].astype(numpy.uint32))]
+      else:
+        self.words[version] = [
+          (source, columns['net_' + half][positions],
+           columns['mask_' + half][positions])
+          for source, half in [('src_hi', 'hi'), ('src_lo', 'lo')]]
+
+    # Destinations and the rules applying to each of them.
+    endpoints = dict()  # (version, hi, lo, port, tcp) -> column of applies
+    applies   = []      # For each destination, the positions of its rules.
+    names     = dict()  # (pattern, string) -> bool
+    for router in services.values():
+      rules = [rule for rule in self.engine.rulesFor(router.name)
+               if rule.index in position]
+      for stype in router.types:
+        tcp = stype.protocol == 'tcp'
+        for service in stype.services:
+          for rule in rules:
+            values = service.addresses(rule.version)
+            if not values:
+              continue
+            for pattern, string in [(rule.type, stype.name),
+                                    (rule.name, service.name)]:
+              if not (pattern, string) in names:
+                names[(pattern, string)] = pattern.match(string) is not None
+            if not (names[(rule.type, stype.name)] and
+                    names[(rule.name, service.name)]):
+              continue
+
+            for value in values:
+              key = ((rule.version,) + split(rule.version, value)
+                     + (service.port, tcp))
+              if not key in endpoints:
+                endpoints[key] = len(applies)
+                applies.append(set())
+              applies[endpoints[key]].add(position[rule.index])
+
+    # Destinations sorted to be found with a binary search.
+    keys = sorted(endpoints.keys())
+    self.endpoints = numpy.array(keys, dtype=ENDPOINT).reshape(-1)
+    matrix = numpy.zeros((len(keys), len(self.rules)), numpy.bool_)
+    for i, key in enumerate(keys):
+      matrix[i, list(applies[endpoints[key]])] = True
+
+    # For each version, the columns of its rules, sliced once rather than at
+    # each batch.
+    self.applies = dict([(version, matrix[:, positions])
+                         for version, positions in self.columns.items()])
+
+    # Number of flows decided by each rule.
+    self.hits = numpy.zeros(len(self.rules), numpy.int64)
+
+  def evaluate(self, flows):
+    """Evaluates a batch of flows and counts the hits of the rules.
+
+    Args:
+      flows: columns of the flows, as returned by batch().
+
+    Returns:
+      A NumPy array of the position of the rule deciding each flow (see
+      rule()), or NO_RULE.
+    """
+
+    count    = len(flows['version'])
+    verdicts = numpy.empty(count, numpy.int64)
+    verdicts.fill(NO_RULE)
+    if count == 0 or len(self.rules) == 0 or len(self.endpoints) == 0:
+      return verdicts
+
+    # Destination of each flow, -1 if no rule applies to it.
+    found = numpy.searchsorted(self.endpoints, flows['endpoint'])
+    found = numpy.minimum(found, len(self.endpoints) - 1)
+    known = self.endpoints[found] == flows['endpoint']
+    found = numpy.where(known, found, -1)
+
+    for version, positions in self.columns.items():
+      if len(positions) == 0:
+        continue
+      selected = numpy.nonzero((flows['version'] == version) &
+                               (found >= 0))[0]
+      applies  = self.applies[version]
+
+      step = max(1, self.chunk // len(positions))
+      for start in range(0, len(selected), step):
+        rows = selected[start:start + step]
+
+        # Flows x rules of the version: does the rule apply to the flow?
+        matrix = applies[found[rows]]
+        for source, networks, masks in self.words[version]:
+          values = flows[source][rows].astype(networks.dtype)[:, None]
+          matrix &= (values & masks[None, :]) == networks[None, :]
+
+        # First applying rule of each flow.
+        decided = matrix.any(axis=1)
+        first   = matrix.argmax(axis=1)
+        verdicts[rows[decided]] = positions[first[decided]]
+
+    decided = verdicts[verdicts != NO_RULE]
+    self.hits += numpy.bincount(decided, minlength=len(self.rules))
+
+    return verdicts
+
+  def rule(self, position):
+    """Gets a rule evaluated by the simulator.
+
+    Args:
+      position: position of the rule, as returned by evaluate().
+
+    Returns:
+      A PolicyEngine.Rule, whose index is its position in the configuration
+      file.
+    """
+
+    return self.rules[position]
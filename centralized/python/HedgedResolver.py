@@ -0,0 +1,296 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/python/HedgedResolver.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Module sending the queries of the crawl directly to the authoritative servers
+of a domain, duplicating a query to another server when the first one is
+slower than usual, so that one slow server does not set the crawl time.
+"""
+
+import collections     # for the RTT samples
+import select          # to wait for the first response
+import socket          # to send the queries
+import threading       # to share the samples between concurrent queries
+import time            # to measure RTTs
+
+import dns.exception   # for invalid responses
+import dns.flags       # for authoritative and truncated responses
+import dns.message     # to build the queries and parse the responses
+import dns.name        # for the names in the domain
+import dns.query       # to retry truncated responses over TCP
+import dns.rcode       # for the status of the responses
+import dns.rdataclass  # for the class of the answers
+import dns.rdatatype   # for the type of the answers
+import dns.resolver    # for the answers and the recursive resolver
+
+class HedgedResolver:
+  """Resolver querying the authoritative servers of a domain (the name servers
+  of its NS records, primary and secondaries) with hedged queries.
+
+  The round-trip times of the last queries of each server are kept. A query
+  is sent to the server with the lowest median RTT. If it did not answer
+  within a percentile of its RTTs, the query is also sent to the next server,
+  and so on, the first response being used. When another server answers
+  first, the time waited is kept as the RTT of the slower ones. A server
+  which did not answer most of its last queries (timeout, SERVFAIL,
+  REFUSED, lost to other servers) moves to the end of the list.
+
+  The names outside the domain, the names delegated to other servers and all
+  the queries when no server of the domain is known are sent to the
+  recursive resolver."""
+
+  def __init__(self, domain, percentile=0.95, timeout=2.0, samples=100,
+               initial=0.1, port=53, servers=None):
+    """Constructor.
+
+    Args:
+      domain: domain whose authoritative servers are queried.
+      percentile: percentile of the RTTs of a server after which the query is
+        also sent to the next server (e.g. 0.95).
+      timeout: number of seconds after which a query fails.
+      samples: number of RTTs kept per server.
+      initial: number of seconds after which the query is sent to the next
+        server when a server has no RTT yet.
+      port: port of the servers.
+      servers: array of the addresses of the servers. None to use the name
+        servers of the NS records of the domain, found with the recursive
+        resolver and refreshed when their TTL expires.
+    """
+
+    self.origin     = dns.name.from_text(domain)
+    self.percentile = percentile
+    self.timeout    = timeout
+    self.samples    = samples
+    self.initial    = initial
+    self.port       = port
+    self.fixed      = servers is not None
+
+    self.addresses  = servers
+    self.expiration = None
+    self.rtts       = dict() # address -> deque of (RTT, whether answered)
+    self.lock       = threading.Lock()
+
+    # Queries sent to more than one server, for the metrics.
+    self.hedged = 0
+
+  def servers(self):
+    """Gets the servers of the domain, finding them if needed.
+
+    Returns:
+      An array of the addresses of the servers, from the fastest to the
+      slowest (see estimate()). Empty if they could not be found.
+    """
+
+    with self.lock:
+      if not self.fixed and (self.expiration is None or
+                             self.expiration <= time.time()):
+        self.addresses, self.expiration = self.discover()
+      addresses = list(self.addresses)
+
+    return sorted(addresses, key=self.estimate)
+
+  def discover(self):
+    """Finds the addresses of the name servers of the domain with the
+    recursive resolver.
+
+    Returns:
+      A tuple (array of the addresses, expiration time). If the NS records
+      cannot be found, the array is empty and they are looked for again after
+      a minute.
+    """
+
+    addresses = []
+    try:
+      answer = dns.resolver.query(self.origin, 'NS')
+    except dns.exception.DNSException:
+      return ([], time.time() + 60)
+
+    for rdata in answer:
+      for rdtype in ['AAAA', 'A']:
+        try:
+          addresses += [address.address
+                        for address in dns.resolver.query(rdata.target,
+                                                          rdtype)]
+        except dns.exception.DNSException:
+          pass
+
+    return (addresses, answer.expiration)
+
+  def estimate(self, address):
+    """Gets the median RTT of a server, 0 if it has none yet so that every
+    server gets measured, or the timeout if it did not answer most of its
+    last queries."""
+
+    with self.lock:
+      samples = list(self.rtts.get(address, []))
+    if not samples:
+      return 0
+    if 2 * len([rtt for rtt, answered in samples if answered]) < len(samples):
+      return self.timeout
+    return sorted([rtt for rtt, _ in samples])[len(samples) // 2]
+
+  def delay(self, address):
+    """Gets the number of seconds after which a query sent to a server is also
+    sent to the next one: the percentile of its RTTs."""
+
+    with self.lock:
+      rtts = sorted([rtt for rtt, _ in self.rtts.get(address, [])])
+    if not rtts:
+      return self.initial
+    return rtts[int(self.percentile * (len(rtts) - 1))]
+
+  def record(self, address, rtt, answered=True):
+    """Records the RTT of a server.
+
+    Args:
+      address: address of the server.
+      rtt: number of seconds the server took to answer, or waited for before
+        giving up (the timeout for failures).
+      answered: whether the server answered.
+    """
+
+    with self.lock:
+      if not address in self.rtts:
+        self.rtts[address] = collections.deque(maxlen=self.samples)
+      self.rtts[address].append((rtt, answered))
+
+  def query(self, name, rdtype):
+    """Performs a DNS query, as dns.resolver.query() does.
+
+    Args:
+      name: name to query (string or dns.name.Name).
+      rdtype: type of the record to query (e.g. 'PTR').
+
+    Returns:
+      A dns.resolver.Answer.
+
+    Raises:
+      dns.resolver.NXDOMAIN if the name does not exist, dns.resolver.NoAnswer
+      if it has no record of the given type, dns.resolver.NoNameservers if no
+      server answered and the exceptions of dns.resolver.query() for the
+      queries sent to the recursive resolver.
+    """
+
+    if not isinstance(name, dns.name.Name):
+      name = dns.name.from_text(name)
+    if not name.is_subdomain(self.origin):
+      return dns.resolver.query(name, rdtype)
+
+    servers = self.servers()
+    if not servers:
+      return dns.resolver.query(name, rdtype)
+
+    if not isinstance(rdtype, int):
+      rdtype = dns.rdatatype.from_text(rdtype)
+    request  = dns.message.make_query(name, rdtype)
+    response = self.exchange(request, servers)
+    if response is None:
+      raise dns.resolver.NoNameservers(request=request, errors=[])
+
+    if response.rcode() == dns.rcode.NXDOMAIN:
+      raise dns.resolver.NXDOMAIN(qnames=[name], responses={name: response})
+
+    # A referral: the name is delegated to other servers.
+    if not response.flags & dns.flags.AA:
+      return dns.resolver.query(name, rdtype)
+
+    return dns.resolver.Answer(name, rdtype, dns.rdataclass.IN, response)
+
+  def exchange(self, request, servers):
+    """Sends a query to servers, the next server being queried when the
+    previous ones did not answer within their delay (see delay()) or failed.
+
+    Args:
+      request: dns.message.Message of the query.
+      servers: array of the addresses of the servers, in the order they are
+        queried.
+
+    Returns:
+      The first successful response (NOERROR or NXDOMAIN), or None if no
+      server answered before the timeout.
+    """
+
+    wire     = request.to_wire()
+    pending  = list(servers)
+    sent     = dict() # socket -> (address, time the query was sent)
+    deadline = time.time() + self.timeout
+    hedge    = None   # Time the query is sent to the next server.
+
+    try:
+      while True:
+        now = time.time()
+        if pending and (hedge is None or hedge <= now):
+          address = pending.pop(0)
+          family = socket.AF_INET6 if ":" in address else socket.AF_INET
+          sock = socket.socket(family, socket.SOCK_DGRAM)
+          sock.setblocking(0)
+          try:
+            sock.sendto(wire, (address, self.port))
+          except socket.error:
+            sock.close()
+            self.record(address, self.timeout, False)
+            continue
+          if sent:
+            with self.lock:
+              self.hedged += 1
+          sent[sock] = (address, now)
+          hedge = now + self.delay(address)
+
+        if now >= deadline or not sent:
+          break
+
+        wait = deadline - now
+        if pending:
+          wait = min(wait, hedge - now)
+        readable = select.select(sent.keys(), [], [], max(0, wait))[0]
+
+        for sock in readable:
+          address, started = sent[sock]
+          try:
+            data = sock.recv(65535)
+            response = dns.message.from_wire(data)
+          except (socket.error, dns.exception.DNSException):
+            continue
+          if not request.is_response(response):
+            continue
+
+          if response.flags & dns.flags.TC:
+            try:
+              response = dns.query.tcp(request, address,
+                                       max(0, deadline - time.time()),
+                                       self.port)
+            except (socket.error, dns.exception.DNSException):
+              response = None
+
+          rtt = time.time() - started
+          if (response is not None and
+              response.rcode() in [dns.rcode.NOERROR, dns.rcode.NXDOMAIN]):
+            self.record(address, rtt)
+            # The servers queried before were slower than this one.
+            for other, (slower, before) in sent.items():
+              if other is not sock and before < started:
+                self.record(slower, time.time() - before, False)
+            return response
+
+          # Failure of the server: querying the next one at once.
+          self.record(address, self.timeout, False)
+          del sent[sock]
+          sock.close()
+          hedge = None
+
+      for address, _ in sent.values():
+        self.record(address, self.timeout, False)
+      return None
+    finally:
+      for sock in sent.keys():
+        sock.close()
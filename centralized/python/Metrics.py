@@ -0,0 +1,283 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/python/Metrics.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Module keeping metrics of the policy manager and exposing them over HTTP in
+the Prometheus text format.
+"""
+
+import BaseHTTPServer  # for the HTTP endpoint
+import bisect          # to find the bucket of an observation
+import collections     # for OrderedDict
+import socket          # for getaddrinfo
+import threading       # for locks and to serve in the background
+
+COUNTER   = 'counter'
+GAUGE     = 'gauge'
+HISTOGRAM = 'histogram'
+
+# Upper bounds (seconds) of the buckets of duration histograms.
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                    30, 60, 120, 300]
+
+def escape(value):
+  """Escapes the value of a label (backslash, double quote and line feed)."""
+
+  return (str(value).replace("\\", "\\\\").replace("\"", "\\\"")
+                    .replace("\n", "\\n"))
+
+def number(value):
+  """Formats a sample value."""
+
+  if value == float('inf'):
+    return "+Inf"
+  return repr(float(value))
+
+def series(name, labels, extra=None):
+  """Formats the name and the labels of a sample.
+
+  Args:
+    name: name of the sample.
+    labels: tuple of (label, value) pairs.
+    extra: additional (label, value) pair, e.g. the bucket of a histogram.
+  """
+
+  pairs = list(labels)
+  if extra is not None:
+    pairs.append(extra)
+  if len(pairs) == 0:
+    return name
+
+  return "%s{%s}" % (name, ",".join(["%s=\"%s\"" % (label, escape(value))
+                                     for label, value in pairs]))
+
+class Metrics:
+  """Registry of metrics, thread-safe.
+
+  Metrics are declared once with their type and help text, and their series
+  are identified by keyword labels, e.g.
+    metrics.declare('jobs_total', Metrics.COUNTER, "Jobs done.")
+    metrics.inc('jobs_total', result='ok')"""
+
+  def __init__(self):
+    self.lock     = threading.Lock()
+    self.families = collections.OrderedDict() # name -> (type, help, buckets)
+    self.values   = dict()                    # name -> {labels: value}
+
+  def declare(self, name, mtype, text, buckets=None):
+    """Declares a metric.
+
+    Args:
+      name: name of the metric.
+      mtype: COUNTER, GAUGE or HISTOGRAM.
+      text: help text of the metric.
+      buckets: upper bounds of the buckets of a histogram. Defaults to
+        DURATION_BUCKETS.
+    """
+
+    if mtype == HISTOGRAM and buckets is None:
+      buckets = DURATION_BUCKETS
+
+    with self.lock:
+      self.families[name] = (mtype, text, buckets)
+      self.values.setdefault(name, dict())
+
+  def inc(self, name, value=1, **labels):
+    """Increments a counter or a gauge."""
+
+    key = tuple(sorted(labels.items()))
+    with self.lock:
+      self.values[name][key] = self.values[name].get(key, 0) + value
+
+  def set(self, name, value, **labels):
+    """Sets a gauge, or a counter to a total counted elsewhere."""
+
+    key = tuple(sorted(labels.items()))
+    with self.lock:
+      self.values[name][key] = value
+
+  def observe(self, name, value, **labels):
+    """Adds an observation to a histogram."""
+
+    key = tuple(sorted(labels.items()))
+    buckets = self.families[name][2]
+    with self.lock:
+      histogram = self.values[name].get(key)
+      if histogram is None:
+        # Count of each bucket (not cumulative), sum and count.
+        histogram = [[0] * (len(buckets) + 1), 0.0, 0]
+        self.values[name][key] = histogram
+      histogram[0][bisect.bisect_left(buckets, value)] += 1
+      histogram[1] += value
+      histogram[2] += 1
+
+  def discard(self, name, **labels):
+    """Removes a series, e.g. the series of a router which disappeared."""
+
+    key = tuple(sorted(labels.items()))
+    with self.lock:
+      self.values[name].pop(key, None)
+
+  def labels(self, name, label, **match):
+    """Gets the values of a label among the series of a metric.
+
+    Args:
+      name: name of the metric.
+      label: label whose values are returned.
+      match: labels the series must have, e.g. domain='example.org'.
+
+    Returns:
+      A set of the values.
+    """
+
+    values = set()
+    with self.lock:
+      for key in self.values[name].keys():
+        labels = dict(key)
+        if all([labels.get(k) == v for k, v in match.items()]):
+          values.add(labels.get(label))
+
+    return values
+
+  def bind(self, **labels):
+    """Gets a view of the metrics adding labels to all the series, e.g. to
+    distinguish the series of several domains.
+
+    Returns:
+      A BoundMetrics.
+    """
+
+    return BoundMetrics(self, labels)
+
+  def render(self):
+    """Formats all the metrics in the Prometheus text format (version 0.0.4).
+
+    Returns:
+      The text of the metrics.
+    """
+
+    lines = []
+    with self.lock:
+      for name, (mtype, text, buckets) in self.families.items():
+        lines.append("# HELP %s %s" % (name, text.replace("\\", "\\\\")
+                                                 .replace("\n", "\\n")))
+        lines.append("# TYPE %s %s" % (name, mtype))
+
+        for key in sorted(self.values[name].keys()):
+          value = self.values[name][key]
+          if mtype != HISTOGRAM:
+            lines.append("%s %s" % (series(name, key), number(value)))
+            continue
+
+          counts, total, count = value
+          cumulative = 0
+          for bound, bucket in zip(buckets + [float('inf')], counts):
+            cumulative += bucket
+            lines.append("%s %i" % (series(name + "_bucket", key,
+                                           ('le', number(bound))),
+                                    cumulative))
+          lines.append("%s %s" % (series(name + "_sum", key), number(total)))
+          lines.append("%s %i" % (series(name + "_count", key), count))
+
+    return "\n".join(lines) + "\n"
+
+class BoundMetrics:
+  """View of Metrics adding fixed labels to the series it updates."""
+
+  def __init__(self, metrics, labels):
+    self.metrics = metrics
+    self.bound   = labels
+
+  def merge(self, labels):
+    labels.update(self.bound)
+    return labels
+
+  def declare(self, name, mtype, text, buckets=None):
+    self.metrics.declare(name, mtype, text, buckets)
+
+  def inc(self, name, value=1, **labels):
+    self.metrics.inc(name, value, **self.merge(labels))
+
+  def set(self, name, value, **labels):
+    self.metrics.set(name, value, **self.merge(labels))
+
+  def observe(self, name, value, **labels):
+    self.metrics.observe(name, value, **self.merge(labels))
+
+  def discard(self, name, **labels):
+    self.metrics.discard(name, **self.merge(labels))
+
+  def labels(self, name, label, **match):
+    return self.metrics.labels(name, label, **self.merge(match))
+
+  def render(self):
+    return self.metrics.render()
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Serves the metrics on /metrics."""
+
+  def do_GET(self):
+    if self.path.split("?")[0] != "/metrics":
+      self.send_error(404)
+      return
+
+    body = self.server.metrics.render()
+    self.send_response(200)
+    self.send_header("Content-Type", "text/plain; version=0.0.4")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    # Scrapes are not worth a line in the log file.
+    pass
+
+class MetricsServer(threading.Thread):
+  """Thread serving the metrics over HTTP."""
+
+  def __init__(self, logger, metrics, address="127.0.0.1", port=9120):
+    """Constructor.
+
+    Args:
+      logger: logger used to report events.
+      metrics: Metrics to serve.
+      address: address to listen on.
+      port: TCP port to listen on.
+
+    Raises:
+      socket.error if the socket cannot be bound.
+    """
+
+    threading.Thread.__init__(self, name="metrics-server")
+    self.daemon = True
+
+    self.logger = logger
+
+    family = socket.getaddrinfo(address, port, 0, socket.SOCK_STREAM)[0][0]
+
+    class Server(BaseHTTPServer.HTTPServer):
+      address_family = family
+
+    self.server = Server((address, port), MetricsHandler)
+    self.server.metrics = metrics
+
+  def run(self):
+    """Serves the metrics until stop() is called."""
+
+    self.server.serve_forever()
+    self.server.server_close()
+
+  def stop(self):
+    """Stops serving."""
+
+    self.server.shutdown()
@@ -0,0 +1,134 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/python/NotifyListener.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Module providing a listener of DNS NOTIFY messages (RFC 1996) which wakes the
+policy manager up as soon as the primary server announces a change of the zone.
+"""
+
+import socket          # for UDP sockets
+import select          # to wait for messages with a timeout
+import threading       # to listen in the background
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.opcode
+import dns.rdatatype
+
+class NotifyListener(threading.Thread):
+  """Thread listening for NOTIFY messages concerning one or several zones.
+
+  Each NOTIFY for a zone is acknowledged and sets the event of the zone. The
+  content of the message is not trusted: the event only makes the policy
+  manager check the serial of the zone immediately instead of at the end of its
+  polling period."""
+
+  def __init__(self, logger, domain, event, address="0.0.0.0", port=5300):
+    """Constructor.
+
+    Args:
+      logger: logger used to report events.
+      domain: zone whose NOTIFY messages are listened to. Other zones can be
+        added with add().
+      event: threading.Event set when a NOTIFY for the zone is received.
+      address: address to listen on.
+      port: UDP port to listen on.
+
+    Raises:
+      socket.error if the socket cannot be bound.
+    """
+
+    threading.Thread.__init__(self, name="notify-listener")
+    self.daemon = True
+
+    self.logger  = logger
+    self.zones   = {dns.name.from_text(domain): event}
+    self.running = False
+
+    family, _, _, _, sockaddr = socket.getaddrinfo(address, port, 0,
+                                                   socket.SOCK_DGRAM)[0]
+    self.socket = socket.socket(family, socket.SOCK_DGRAM)
+    self.socket.bind(sockaddr)
+
+  def add(self, domain, event):
+    """Listens for the NOTIFY messages of another zone too.
+
+    Args:
+      domain: zone whose NOTIFY messages are listened to.
+      event: threading.Event set when a NOTIFY for the zone is received.
+    """
+
+    self.zones[dns.name.from_text(domain)] = event
+
+  def run(self):
+    """Listens for NOTIFY messages until stop() is called."""
+
+    self.running = True
+    while self.running:
+      # Waking up regularly to check whether we have been stopped.
+      readable, _, _ = select.select([self.socket], [], [], 1)
+      if not readable:
+        continue
+
+      try:
+        wire, source = self.socket.recvfrom(65535)
+      except socket.error:
+        continue
+
+      self.handle(wire, source)
+
+    self.socket.close()
+
+  def handle(self, wire, source):
+    """Handles a received message.
+
+    Args:
+      wire: content of the message.
+      source: address of the sender.
+    """
+
+    try:
+      message = dns.message.from_wire(wire)
+    except dns.exception.DNSException as e:
+      self.logger.debug("Invalid message received from %s: %s" %
+                        (source[0], e))
+      return
+
+    if (message.opcode() != dns.opcode.NOTIFY or
+        message.flags & dns.flags.QR or
+        len(message.question) != 1 or
+        message.question[0].rdtype != dns.rdatatype.SOA or
+        not message.question[0].name in self.zones):
+      self.logger.debug("Ignoring message from %s which is not a NOTIFY " %
+                        source[0] + "for a known zone.")
+      return
+
+    # Acknowledging the NOTIFY so that the server stops retransmitting it.
+    response = dns.message.make_response(message)
+    response.flags |= dns.flags.AA
+    try:
+      self.socket.sendto(response.to_wire(), source)
+    except socket.error as e:
+      self.logger.warning("Unable to acknowledge NOTIFY from %s: %s" %
+                          (source[0], e))
+
+    self.logger.debug("NOTIFY for %s received from %s." %
+                      (message.question[0].name, source[0]))
+    self.zones[message.question[0].name].set()
+
+  def stop(self):
+    """Stops listening."""
+
+    self.running = False
@@ -0,0 +1,174 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/python/ParallelCompiler.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Module compiling and writing the firewall files of several routers in
+parallel, in a pool of processes.
+"""
+
+import logging         # to log from the workers
+import multiprocessing # for the pool of processes
+import signal          # to restore default signal handlers in the workers
+import time            # to time the phases
+
+import PolicyEngine    # to match rules against services
+import RuleWriter      # to write the firewall files
+
+# State of a worker process: the logger set by initialize() and, for the
+# settings of each RuleWriter, the last rules with their compiled engine and
+# the writer, so that the rules are only compiled again when they change.
+logger  = None
+engines = dict() # settings -> (rules, PolicyEngine, RuleWriter)
+
+def initialize(logger_name):
+  """Initializes a worker process.
+
+  Args:
+    logger_name: name of the logger to use in the worker.
+  """
+
+  global logger
+
+  # Workers inherit the handlers of the daemon, which would stop the policy
+  # manager of the worker instead of terminating it.
+  for signum in [signal.SIGTERM, signal.SIGINT, signal.SIGABRT, signal.SIGQUIT,
+                 signal.SIGHUP]:
+    signal.signal(signum, signal.SIG_DFL)
+
+  logger = logging.getLogger(logger_name)
+
+def settings(writer):
+  """Gets the settings of a RuleWriter sent to the workers.
+
+  Args:
+    writer: RuleWriter.
+
+  Returns:
+    A tuple (directory, formats, aggregation, optimize).
+  """
+
+  return (writer.directory, tuple(writer.formats), writer.aggregation,
+          writer.optimize)
+
+def compileChunk(chunk):
+  """Computes and writes the files of several routers in a worker process,
+  with the engine of the rules compiled by an earlier chunk if the rules are
+  the same.
+
+  Args:
+    chunk: tuple (rules, settings, tasks). rules is the array of the rules as
+      returned by PolicyManager.getRules(), settings the settings of the
+      RuleWriter as returned by settings() and tasks an array of tuples
+      (router, types, interfaces) as expected by PolicyEngine.match().
+
+  Returns:
+    An array of the results of compileRouter(), one per task.
+  """
+
+  rules, writer_settings, tasks = chunk
+
+  entry = engines.get(writer_settings)
+  if entry is None or entry[0] != rules:
+    directory, formats, aggregation, optimize = writer_settings
+    entry = (rules, PolicyEngine.PolicyEngine(logger, rules),
+             RuleWriter.RuleWriter(directory, list(formats), aggregation,
+                                   optimize))
+    engines[writer_settings] = entry
+
+  return [compileRouter(entry[1], entry[2], task) for task in tasks]
+
+def compileRouter(engine, writer, task):
+  """Computes and writes the files of a router.
+
+  Args:
+    engine: PolicyEngine compiled from the rules.
+    writer: RuleWriter writing the files.
+    task: tuple (router, types, interfaces) as expected by
+      PolicyEngine.match().
+
+  Returns:
+    A tuple (router, error, entries, rules, match_time, write_time). error is
+    None on success, or the description of the error if the files could not be
+    written. entries is the number of firewall entries matched and rules the
+    number of firewall rules written. match_time and write_time are the
+    durations (seconds) of the matching and of the writing.
+  """
+
+  router, types, interfaces = task
+
+  start   = time.time()
+  matches = engine.match(router, types, interfaces)
+  matched = time.time()
+  try:
+    rules = writer.write(router, matches)
+  except (IOError, OSError) as e:
+    return (router, str(e), len(matches), 0, matched - start,
+            time.time() - matched)
+
+  return (router, None, len(matches), rules, matched - start,
+          time.time() - matched)
+
+class ParallelCompiler:
+  """Compiles and writes the files of routers in a pool of processes, to use
+  several cores for the CPU-bound matching of rules against services.
+
+  The pool lives as long as the compiler, possibly shared by the policy
+  managers of several domains. It forks its workers when created: it has to
+  be created before any thread is started, since a forked process only gets
+  the thread which forked it (e.g. one holding the lock of a logger would
+  leave it locked in the workers)."""
+
+  def __init__(self, logger, workers):
+    """Constructor. Starts the worker processes.
+
+    Args:
+      logger: logger used to report events.
+      workers: number of worker processes.
+    """
+
+    self.logger  = logger
+    self.workers = workers
+    self.pool    = multiprocessing.Pool(workers, initialize, (logger.name,))
+
+  def run(self, rules, writer, tasks):
+    """Computes and writes the files of routers.
+
+    The rules and the settings of the writer are sent with each chunk of
+    routers: a worker only compiles the rules again when they differ from the
+    ones of its last chunk for the same settings.
+
+    Args:
+      rules: array of the rules as returned by PolicyManager.getRules().
+      writer: RuleWriter whose settings the workers use.
+      tasks: array of tuples (router, types, interfaces).
+
+    Returns:
+      An array of tuples (router, error, entries, rules, match_time,
+      write_time), one per task, as returned by compileRouter().
+    """
+
+    # Sending several routers at once to amortize inter-process messages.
+    size   = max(1, len(tasks) // (4 * self.workers))
+    chunks = [(rules, settings(writer), tasks[i:i + size])
+              for i in range(0, len(tasks), size)]
+
+    results = []
+    for chunk in self.pool.map(compileChunk, chunks, 1):
+      results.extend(chunk)
+    return results
+
+  def close(self):
+    """Stops the worker processes once their tasks are done."""
+
+    self.pool.close()
+    self.pool.join()
@@ -0,0 +1,209 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/python/PolicyEngine.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Module compiling the rules of the configuration file once so that they can be
+matched against the services of each router without re-parsing anything.
+"""
+
+import re              # for regular expressions
+import collections     # for namedtuple
+import operator        # for attrgetter
+import hashlib         # for fingerprints
+
+import netaddr         # for manipulation of IP addresses
+
+import ServiceModel    # to unpack the addresses of the services
+
+# A firewall entry: a rule applied to one address of a service on one
+# interface. 'protocol' is either 'tcp' or '!tcp'.
+Match = collections.namedtuple('Match', ['rule', 'version', 'protocol',
+                                         'interface', 'address', 'port'])
+
+class Rule:
+  """A rule of the configuration file with its patterns compiled and its
+  source address parsed."""
+
+  def __init__(self, index, rule, patterns):
+    """Constructor.
+
+    Args:
+      index: position of the rule in the configuration file.
+      rule: dictionary of the rule as returned by PolicyManager.getRules().
+      patterns: dictionary of already compiled patterns, shared between rules.
+
+    Raises:
+      netaddr.core.AddrFormatError if the source address is not valid.
+      re.error if one of the regular expressions is not valid.
+    """
+
+    self.index             = index
+    self.router            = rule['router']
+    self.action            = rule['action']
+    self.src_address       = rule['src-address']
+    self.src_prefix_length = rule['src-prefix-length']
+    self.version           = netaddr.IPAddress(self.src_address).version
+    self.source            = "%s/%s" % (self.src_address,
+                                        self.src_prefix_length)
+    self.definition        = [self.router, self.action, self.src_address,
+                              self.src_prefix_length, rule['name'],
+                              rule['type']]
+
+    # ACCEPT or DROP based on the rule.
+    if (self.action == 'allow'):
+      self.target = "ACCEPT"
+    else:
+      self.target = "DROP"
+
+    # Identical patterns are compiled only once.
+    for attribute in ['name', 'type']:
+      if not rule[attribute] in patterns:
+        patterns[rule[attribute]] = re.compile(rule[attribute])
+      setattr(self, attribute, patterns[rule[attribute]])
+
+class PolicyEngine:
+  """Rules of the configuration file compiled once and bucketed per router.
+
+  An engine is built from one result of PolicyManager.getRules() and can then
+  be matched against the services of every router."""
+
+  def __init__(self, logger, rules):
+    """Constructor.
+
+    Args:
+      logger: logger used to report ignored rules.
+      rules: array of the rules as returned by PolicyManager.getRules().
+    """
+
+    self.logger   = logger
+    self.rules    = []
+    self.routers  = dict()  # Rules of each router.
+    self.wildcard = []      # Rules applying to every router ('*').
+    self.merged   = dict()  # Cache of rulesFor().
+
+    patterns = dict()
+    for index, rule in enumerate(rules):
+      try:
+        compiled = Rule(index, rule, patterns)
+      except netaddr.core.AddrFormatError:
+        self.logger.warning("%s is not a valid address. Rule ignored." %
+                            rule['src-address'])
+        continue
+      except re.error as e:
+        self.logger.warning("Invalid regular expression in rule %i (%s). " %
+                            (index, e) + "Rule ignored.")
+        continue
+
+      self.rules.append(compiled)
+      if compiled.router == "*":
+        self.wildcard.append(compiled)
+      else:
+        self.routers.setdefault(compiled.router, []).append(compiled)
+
+  def rulesFor(self, router):
+    """Gets the rules applying to a router, in the configuration file order.
+
+    Args:
+      router: name of the router.
+
+    Returns:
+      An array of Rule.
+    """
+
+    if not router in self.merged:
+      self.merged[router] = sorted(self.routers.get(router, []) +
+                                   self.wildcard,
+                                   key=operator.attrgetter('index'))
+
+    return self.merged[router]
+
+  def match(self, router, types, interfaces):
+    """Computes the firewall entries of a router.
+
+    Implementation of Algorithm 1 Section 5.1.4.3 of the report. Each type
+    pattern is evaluated once per type and each name pattern once per service
+    name, whatever the number of rules sharing them.
+
+    Args:
+      router: name of the router.
+      types: array of ServiceModel.ServiceType of the router, as found in the
+        result of DNSWrapper.getServices() for the router.
+      interfaces: array of the public interfaces of the router.
+
+    Returns:
+      An array of Match, without duplicates, in the order in which they have to
+      be applied.
+    """
+
+    names   = dict()  # (pattern, string) -> bool
+    known   = {4: dict(), 6: dict()}  # packed address -> text, per version
+    emitted = set()
+    matches = []
+
+    for rule in self.rulesFor(router):
+      texts = known[rule.version]
+      for stype in types:
+        key = (rule.type, stype.name)
+        if not key in names:
+          names[key] = rule.type.match(stype.name) is not None
+        if not names[key]:
+          continue
+
+        for service in stype.services:
+          if rule.version == 4:
+            addresses = service.ipv4
+          else:
+            addresses = service.ipv6
+          if not addresses:
+            continue
+
+          key = (rule.name, service.name)
+          if not key in names:
+            names[key] = rule.name.match(service.name) is not None
+          if not names[key]:
+            continue
+
+          for ifc in interfaces:
+            for value in addresses:
+              entry = (rule.source, rule.target, stype.protocol, ifc, value,
+                       service.port)
+              if entry in emitted:
+                continue
+              emitted.add(entry)
+
+              address = texts.get(value)
+              if address is None:
+                address = ServiceModel.unpack(rule.version, value)
+                texts[value] = address
+              matches.append(Match(rule, rule.version, stype.protocol, ifc,
+                                   address, service.port))
+
+    return matches
+
+  def fingerprint(self, router, types, interfaces):
+    """Computes a fingerprint of everything the output of a router depends on.
+
+    Args:
+      router: name of the router.
+      types: array of ServiceModel.ServiceType of the router, as found in the
+        result of DNSWrapper.getServices() for the router.
+      interfaces: array of the public interfaces of the router.
+
+    Returns:
+      A hexadecimal digest which changes as soon as the services, the
+      interfaces or the rules of the router change.
+    """
+
+    data = ([stype.key() for stype in types], interfaces,
+            [rule.definition for rule in self.rulesFor(router)])
+    return hashlib.sha1(repr(data)).hexdigest()
@@ -14,15 +14,26 @@ Advisor: Guy Leduc
 """
 
 import sys             # for sys.exit
+import os              # for the output directory
 import logging         # for logging
-import re              # for regular expressions 
-import time            # to compare config modification times and time.sleep
-import os              # to get config modification time
+import socket          # for socket errors
+import threading       # for events
+import time            # to time the generations
 
-import netaddr         # for manipulation of IP addresses
-from lxml import etree # to parse .xml and .dtd files
+import dns.exception   # for the errors of the incremental transfers
 
 import DNSWrapper      # to communicate with the DNS
+import HedgedResolver  # to query the authoritative servers of the domain
+import PolicyEngine    # to match rules against services
+import ServiceModel    # for the digest of the services
+import RuleWriter      # to write the firewall files
+import ZoneTransfer    # to follow the DNS with zone transfers
+import NotifyListener  # to be notified of changes of the DNS
+import ParallelCompiler # to compute the files of routers in parallel
+import ConfigWatcher   # to follow the configuration file
+import Metrics         # to expose metrics
+import Snapshot        # to restart where we stopped
+import ShardCoordinator # to share the routers between several instances
 
 class ConfigError(Exception):
   """Exception raised when encountering an error in the configuration file."""
@@ -31,168 +42,959 @@ class ConfigError(Exception):
   def __str__(self):
     return repr(self.value)
 
+# Default path of the snapshot of the state of the policy manager.
+SNAPSHOT_PATH = '/var/lib/policy-manager/snapshot.json'
+
+class Generation:
+  """State of the generation of the rules of one change, filled phase by
+  phase by PolicyManager.generate()."""
+
+  def __init__(self, serial, config, members, changed, retrying):
+    """Constructor.
+
+    Args:
+      serial: serial of the zone.
+      config: hash of the configuration file.
+      members: instances sharing the routers, or None if not sharded.
+      changed: whether the zone, the configuration file or the instances
+        changed since the last generation.
+      retrying: whether subdomains which could not be crawled are due.
+    """
+
+    self.serial   = serial
+    self.config   = config
+    self.members  = members
+    self.changed  = changed
+    self.retrying = retrying
+
+    # Set by PolicyManager.crawl().
+    self.services   = None    # Routers crawled, by FQDN or a generator.
+    self.reuse      = False   # Whether the services of the last generation
+                              # are reused.
+    self.partial    = False   # Whether only the retried routers are crawled.
+    self.retried    = set()   # Routers crawled again.
+    self.crawl_time = 0
+
+    # Set by PolicyManager.compile() and write().
+    self.fingerprints = dict()
+    self.interfaces   = dict()
+    self.digests      = dict()  # Digest of the services of each router.
+    self.counts       = dict()  # Number of services of each router.
+    self.stale        = []      # Routers with data of an earlier crawl.
+    self.held         = set()   # Routers not crawled, whose files are kept.
+    self.catalog      = None
+    self.timings      = [0, 0]  # Durations of the matching and the writing.
+    self.written      = 0       # Routers whose files were written.
+    self.failed       = False
+    self.skipped      = False
+
 class PolicyManager:
   """Class allowing to establish iptables rules based on user-defined
   preferences and on the content of a DNS zone.
 
   To start the process, simply call the start() method."""
 
-  def __init__(self, logger, domain, rate):
-    """Constructor."""
+  def __init__(self, logger, domain, rate, options=None, shared=None):
+    """Constructor.
+
+    Args:
+      logger: logger used to report events.
+      domain: domain in which services are announced.
+      rate: number of seconds between two checks for changes.
+      options: dictionary of the optional settings of the configuration file.
+        Supported keys:
+          directory: directory in which the files are written. Defaults to
+            /etc/policy-manager/.
+          formats: array of output formats (see RuleWriter.FORMATS). Defaults
+            to ['script'].
+          aggregation: aggregation of destinations (see
+            RuleWriter.AGGREGATIONS). Defaults to 'none'.
+          optimize: whether rules are compacted by RuleOptimizer. Defaults to
+            False.
+          workers: number of concurrent DNS queries used to crawl the zone.
+            Defaults to 1.
+          crawl: 'query' to crawl the zone record by record or 'transfer' to
+            follow it with zone transfers. Defaults to 'query'.
+          server: address of the server to transfer the zone from. Defaults
+            to the primary server of the SOA.
+          port: port of the server to transfer the zone from. Defaults to 53.
+          hedge: percentile of the RTTs of an authoritative server (e.g.
+            0.95) after which a query of the crawl is also sent to the next
+            server (see HedgedResolver). Ignored with zone transfers.
+            Defaults to None (queries sent to the recursive resolver).
+          notify: (address, port) on which NOTIFY messages of the primary
+            server are listened to. Defaults to None (polling only).
+          cache: (size, maximum TTL) of the cache of DNS answers. The maximum
+            TTL may be None. When the serial changes, only the answers of the
+            names changed are removed if the server (see server and port)
+            allows incremental transfers (IXFR) of the domain. Otherwise all
+            the answers of the domain are removed, and the cache only saves
+            queries when subdomains are retried or the configuration file or
+            the instances change. Ignored with zone transfers. Defaults to
+            None (no cache).
+          processes: number of processes computing the files of the routers.
+            Defaults to 1.
+          stream: whether each router is crawled, matched and written before
+            the next one is crawled, so that the memory used depends on the
+            largest router rather than on the whole zone. The services are
+            then not kept between generations and the files are computed in
+            the process (processes is ignored). The retries of subdomains
+            which could not be crawled only crawl these subdomains.
+            Defaults to False.
+          metrics: (address, port) on which metrics are served over HTTP.
+            Defaults to None (no endpoint).
+          snapshot: path of the snapshot of the state of the policy manager,
+            or None to always start from scratch. Defaults to SNAPSHOT_PATH.
+          shard: (directory, name, TTL) to only handle the routers assigned to
+            this instance among the instances sharing the directory (see
+            ShardCoordinator). The name and the TTL may be None to default to
+            the host name and three times the rate. Defaults to None (all the
+            routers are handled).
+          settle: (window, maximum) in seconds to wait, after a change of the
+            serial, until the serial did not change during the window, but no
+            longer than the maximum after the first change. Defaults to None
+            (rules are generated as soon as a change is seen).
+          retry: (delay, maximum) in seconds between the retries of a
+            subdomain which could not be crawled, the delay doubling at each
+            consecutive failure. Its last known services are used in the
+            meantime (see DNSWrapper.CrawlRecovery). Defaults to the rate and
+            ten times the rate.
+      shared: dictionary of the resources shared with the managers of other
+        domains (see DomainManager), with the keys config (ConfigWatcher),
+        cache (ResolverCache or None), pool (ThreadPool of the crawl or None),
+        compiler (ParallelCompiler or None) and metrics (Metrics or
+        BoundMetrics). None if the manager is alone.
+    """
 
-    self.run    = False  # Currently not running.
-    self.logger = logger
-    self.domain = domain
-    self.rate   = rate
+    self.run     = False  # Currently not running.
+    self.logger  = logger
+    self.domain  = domain
+    self.rate    = rate
+    self.options = options or dict()
+    self.shared  = shared
+    self.settle  = self.options.get('settle')
+
+    self.directory = self.options.get('directory', '/etc/policy-manager/')
+    self.writer = RuleWriter.RuleWriter(self.directory,
+                                        self.options.get('formats',
+                                                         ['script']),
+                                        self.options.get('aggregation',
+                                                         'none'),
+                                        self.options.get('optimize', False))
+
+    # Processes computing the files of the routers, kept between generations.
+    # They are forked first, before any thread is started.
+    self.compiler = None
+    processes = self.options.get('processes', 1)
+    if self.shared is not None:
+      self.compiler = self.shared['compiler']
+    elif processes > 1 and not self.options.get('stream', False):
+      self.compiler = ParallelCompiler.ParallelCompiler(self.logger, processes)
+
+    # Fingerprint of the data used to generate the file of each router.
+    self.fingerprints = dict()
+
+    # Services and public interfaces of the routers of the last generation,
+    # reused as long as the serial of the zone does not change.
+    self.services   = None
+    self.interfaces = dict()
+
+    # Digest of the services and public interfaces of the last generation
+    # (see ServiceModel.catalog()), and of each of its routers with their
+    # number of services, so that a generation crawling again only some
+    # routers can be completed with the others.
+    self.catalog = None
+    self.digests = dict()
+    self.counts  = dict()
+
+    # Serial of the zone, hash of the configuration file and instances sharing
+    # the routers of the last generation.
+    self.last_serial  = 0
+    self.last_config  = None
+    self.last_members = None
+
+    self.changed_at     = None  # When the new serial was first seen.
+    self.settle_serial  = None  # Last serial seen while settling.
+    self.settle_started = None  # When the zone started changing.
+    self.settle_since   = None  # When settle_serial was first seen.
+
+    # Created by initialize().
+    self.wrapper  = None  # DNSWrapper crawling the domain.
+    self.resolver = None  # HedgedResolver of the wrapper, if any.
+    self.recovery = None  # CrawlRecovery of the subdomains not crawled.
+    self.journal  = None  # TransferWrapper listing the names changed.
+
+    self.snapshot = None
+    if self.options.get('snapshot', SNAPSHOT_PATH) is not None:
+      self.snapshot = Snapshot.Snapshot(self.logger,
+                                        self.options.get('snapshot',
+                                                         SNAPSHOT_PATH))
+
+    # Set to check for changes before the end of the polling period.
+    self.wakeup = threading.Event()
+
+    # Rules of the configuration file, re-parsed only when it changes.
+    if self.shared is not None:
+      self.config = self.shared['config']
+      self.config.subscribe(self.wakeup)
+    else:
+      self.config = ConfigWatcher.ConfigWatcher(self.logger,
+                                                '/etc/policy-manager/',
+                                                self.wakeup)
+
+    # Cache of the DNS answers of the crawl.
+    self.cache = None
+    if self.shared is not None:
+      self.cache = self.shared['cache']
+    elif self.options.get('cache') is not None:
+      size, max_ttl = self.options['cache']
+      self.cache = DNSWrapper.ResolverCache(size, max_ttl)
+
+    # Routers assigned to this instance, if the domain is sharded.
+    self.shards = None
+    if self.options.get('shard') is not None:
+      directory, name, ttl = self.options['shard']
+      self.shards = ShardCoordinator.ShardCoordinator(self.logger, directory,
+                                                      name,
+                                                      ttl or 3 * int(rate))
+
+    if self.shared is not None:
+      self.metrics = self.shared['metrics']
+    else:
+      self.metrics = Metrics.Metrics()
+    self.declareMetrics()
+
+  def declareMetrics(self):
+    """Declares the metrics of the policy manager."""
+
+    declare = self.metrics.declare
+    declare('policy_manager_phase_duration_seconds', Metrics.HISTOGRAM,
+            "Duration of the phases of a generation (serial, crawl, match, " +
+            "write). With several compile workers, match and write are " +
+            "summed over the workers.")
+    declare('policy_manager_cycles_total', Metrics.COUNTER,
+            "Checks for changes, by result (generated, skipped, unchanged, " +
+            "failed, settling).")
+    declare('policy_manager_generations_skipped_total', Metrics.COUNTER,
+            "Generations skipped although the serial changed, by reason.")
+    declare('policy_manager_propagation_seconds', Metrics.HISTOGRAM,
+            "Time from the detection of a new serial to the rules written.")
+    declare('policy_manager_dns_queries_total', Metrics.COUNTER,
+            "DNS queries sent (zone transfers count as one query).")
+    declare('policy_manager_dns_query_failures_total', Metrics.COUNTER,
+            "DNS queries which failed (negative answers excluded).")
+    declare('policy_manager_dns_hedged_queries_total', Metrics.COUNTER,
+            "DNS queries sent to more than one authoritative server.")
+    declare('policy_manager_dns_server_rtt_seconds', Metrics.GAUGE,
+            "Median round-trip time of an authoritative server.")
+    declare('policy_manager_serial', Metrics.GAUGE,
+            "Serial of the zone the current rules were generated from.")
+    declare('policy_manager_services', Metrics.GAUGE,
+            "Services found in the zone by the last generation.")
+    declare('policy_manager_routers', Metrics.GAUGE,
+            "Routers found in the zone by the last generation.")
+    declare('policy_manager_stale_routers', Metrics.GAUGE,
+            "Routers which could not be crawled by the last generation, " +
+            "whose services or files come from an earlier one.")
+    declare('policy_manager_routers_unchanged_total', Metrics.COUNTER,
+            "Routers skipped because their inputs did not change.")
+    declare('policy_manager_router_entries', Metrics.GAUGE,
+            "Firewall entries matched for a router.")
+    declare('policy_manager_router_rules', Metrics.GAUGE,
+            "Firewall rules written for a router.")
+    declare('policy_manager_router_match_seconds', Metrics.GAUGE,
+            "Duration of the last matching of the rules of a router.")
+    declare('policy_manager_router_write_seconds', Metrics.GAUGE,
+            "Duration of the last writing of the files of a router.")
+    declare('policy_manager_router_write_failures_total', Metrics.COUNTER,
+            "Files of a router which could not be written.")
+    declare('policy_manager_last_generation_timestamp_seconds', Metrics.GAUGE,
+            "Time of the last successful generation.")
+    declare('policy_manager_shard_members', Metrics.GAUGE,
+            "Instances sharing the routers of the domain.")
 
   def start(self):
     """Starts the process."""
 
     self.run = True
-    wrapper = DNSWrapper.DNSWrapper(self.domain)
-
-    config_last_change = time.gmtime(0) # Initial modification: epoch time.
-    dns_last_change    = 0              # Initial serial: zero.
+    listener, server = self.initialize()
 
     while(self.run):
-      self.logger.debug("Checking for changes.")
+      timeout = self.cycle()
+
+      # Every x seconds or as soon as a NOTIFY is received.
+      self.wakeup.wait(timeout)
+      self.wakeup.clear()
+
+    self.finalize(listener, server)
+
+  def initialize(self):
+    """Prepares the generations: creates the output directory, starts the
+    NOTIFY listener and the metrics endpoint, creates the wrapper crawling the
+    domain and loads the snapshot.
+
+    Returns:
+      A tuple (NotifyListener or None, MetricsServer or None) to give to
+      finalize().
+    """
+
+    if not os.path.isdir(self.directory):
+      try:
+        os.makedirs(self.directory)
+      except OSError as e:
+        self.logger.error("Unable to create output directory %s: %s" %
+                          (self.directory, e))
+
+    # Listening for NOTIFY messages, polling is kept as a fallback.
+    listener = None
+    if self.options.get('notify') is not None:
+      address, port = self.options['notify']
+      try:
+        listener = NotifyListener.NotifyListener(self.logger, self.domain,
+                                                 self.wakeup, address, port)
+        listener.start()
+      except socket.error as e:
+        self.logger.error("Unable to listen for NOTIFY on %s port %i: %s" %
+                          (address, port, e))
+
+    # Serving metrics.
+    server = None
+    if self.options.get('metrics') is not None:
+      address, port = self.options['metrics']
+      try:
+        server = Metrics.MetricsServer(self.logger, self.metrics, address, port)
+        server.start()
+      except socket.error as e:
+        self.logger.error("Unable to serve metrics on %s port %i: %s" %
+                          (address, port, e))
+
+    # The heartbeat is renewed even while a generation lasts longer than its
+    # TTL.
+    if self.shards is not None:
+      self.shards.start()
+
+    self.resolver = None
+    if self.options.get('crawl', 'query') == 'transfer':
+      self.wrapper = ZoneTransfer.TransferWrapper(self.domain,
+                                                  self.options.get('server'),
+                                                  port=self.options.get('port',
+                                                                        53))
+    else:
+      pool = None
+      if self.shared is not None:
+        pool = self.shared['pool']
+      # One slow server does not slow down the crawl.
+      if self.options.get('hedge') is not None:
+        self.resolver = HedgedResolver.HedgedResolver(self.domain,
+                                                      self.options['hedge'])
+      self.wrapper = DNSWrapper.DNSWrapper(self.domain,
+                                           self.options.get('workers', 1),
+                                           self.cache, pool, self.resolver)
+      # The answers cached for the names which did not change are kept.
+      if self.cache is not None:
+        port = self.options.get('port', 53)
+        self.journal = ZoneTransfer.TransferWrapper(self.domain,
+                                                    self.options.get('server'),
+                                                    port=port)
+
+    # A subdomain which cannot be crawled keeps its last known services and is
+    # retried on its own. They are not kept when streaming.
+    delay, maximum = self.options.get('retry') or (int(self.rate),
+                                                   10 * int(self.rate))
+    self.recovery = DNSWrapper.CrawlRecovery(delay, maximum,
+                                             not self.options.get('stream',
+                                                                  False))
+
+    # Starting from the state saved by the previous run, if any, so that
+    # nothing is done until the zone or the configuration file changes.
+    if self.snapshot is not None:
+      state = self.snapshot.load(self.domain, Snapshot.settings(self.writer))
+      if state is not None:
+        self.last_config  = state['config']
+        self.last_serial  = state['serial']
+        self.services     = state['services']
+        self.interfaces   = state['interfaces']
+        self.fingerprints = state['fingerprints']
+        self.catalog      = state.get('catalog')
+        self.digests      = state['digests']
+        self.counts       = state['counts']
+        self.last_members = state['members']
+        self.logger.info("Snapshot of serial %i loaded." % self.last_serial)
+
+    return listener, server
+
+  def finalize(self, listener, server):
+    """Stops what initialize() started, and the compile workers.
+
+    Args:
+      listener: NotifyListener or None.
+      server: MetricsServer or None.
+    """
+
+    if listener is not None:
+      listener.stop()
+    if server is not None:
+      server.stop()
+    if self.shards is not None:
+      self.shards.leave()
+    if self.shared is None:
+      self.config.stop()
+    if self.shared is None and self.compiler is not None:
+      self.compiler.close()
+
+  def cycle(self):
+    """Checks once for changes of the zone, of the configuration file and of
+    the instances sharing the routers, and generates new rules if needed.
 
-      # Retrieving SOA and modification time.
-      dns_current_serial    = wrapper.getSerial()
-      config_current_change = os.path.getmtime('/etc/policy-manager/config.xml')
+    Returns:
+      The number of seconds to wait before the next check, unless woken up
+      before.
+    """
 
-      if (dns_current_serial    > dns_last_change or
-          config_current_change > config_last_change):
+    self.logger.debug("Checking for changes.")
+
+    # Retrieving SOA and hash of the configuration file.
+    started = time.time()
+    serial  = self.wrapper.getSerial()
+    self.metrics.observe('policy_manager_phase_duration_seconds',
+                         time.time() - started, phase='serial')
+    config  = self.config.refresh()
+
+    # Routers move between instances when instances join or leave.
+    members = None
+    if self.shards is not None:
+      members = self.shards.refresh()
+      self.metrics.set('policy_manager_shard_members', len(members))
+
+    # The propagation latency is only meaningful for changes of the zone
+    # after the first generation.
+    if (self.last_serial > 0 and serial > self.last_serial and
+        self.changed_at is None):
+      self.changed_at = started
+
+    # Subdomains which could not be crawled are crawled again when their
+    # retry delay expires, even if nothing changed.
+    retry    = self.recovery.next()
+    retrying = retry is not None and retry <= time.time()
+
+    changed  = (serial  > self.last_serial or
+                config  != self.last_config or
+                members != self.last_members)
+    settling = self.settling(serial)
+
+    if settling is not None:
+      self.logger.debug("Serial %i not settled yet. Waiting %.3fs." %
+                        (serial, settling))
+      self.metrics.inc('policy_manager_cycles_total', result='settling')
+
+    elif changed or retrying:
+      if changed:
         self.logger.info("Change detected. Generating new rules.")
+      else:
+        self.logger.info("Crawling again the subdomains which could not " +
+                         "be crawled.")
+
+      self.generate(Generation(serial, config, members, changed, retrying))
+
+      if self.cache is not None:
+        self.logger.debug("DNS cache: %i hits, %i misses, %i evictions." %
+                          (self.cache.hits, self.cache.misses,
+                           self.cache.evictions))
+
+    else:
+      self.logger.debug("No change detected.")
+      self.metrics.inc('policy_manager_cycles_total', result='unchanged')
+
+    self.metrics.set('policy_manager_dns_queries_total', self.wrapper.queries)
+    self.metrics.set('policy_manager_dns_query_failures_total',
+                     self.wrapper.failures)
+    if self.resolver is not None:
+      self.metrics.set('policy_manager_dns_hedged_queries_total',
+                       self.resolver.hedged)
+      for address in self.resolver.servers():
+        self.metrics.set('policy_manager_dns_server_rtt_seconds',
+                         self.resolver.estimate(address), server=address)
+
+    # While settling or retrying, checking again at the end of the delay.
+    timeout = int(self.rate)
+    if settling is not None:
+      timeout = min(timeout, settling)
+    retry = self.recovery.next()
+    if retry is not None and retry > time.time():
+      timeout = min(timeout, retry - time.time())
+
+    return timeout
+
+  def settling(self, serial):
+    """Waits for the serial to stop changing, e.g. while the services of a
+    site are announced one by one, so that a burst of updates gives one
+    generation. The delay is bounded by the maximum of the window.
+
+    Args:
+      serial: current serial of the zone.
+
+    Returns:
+      The number of seconds to wait before generating the rules of the serial,
+      or None if they can be generated now.
+    """
+
+    if serial <= self.last_serial or self.settle is None:
+      return None
+
+    window, maximum = self.settle
+    now = time.time()
+    if self.settle_started is None:
+      self.settle_started = now
+    if serial != self.settle_serial:
+      self.settle_serial = serial
+      self.settle_since  = now
+
+    remaining = min(self.settle_since + window,
+                    self.settle_started + maximum) - now
+    if remaining > 0:
+      return remaining
+    return None
+
+  def generate(self, generation):
+    """Generates the rules of a change, one phase after the other: crawl(),
+    compile(), write() (called by compile() for each router when streaming)
+    and save() if the generation completed.
+
+    Args:
+      generation: Generation of the change, filled by the phases.
+    """
+
+    rules = self.getRules()
+    self.crawl(generation)
+
+    if rules is None or generation.services is None:
+      self.logger.error("Unable to get rules or services. Firewall " +
+                        "rules not generated.")
+      self.metrics.inc('policy_manager_cycles_total', result='failed')
+      return
+
+    # Rules are compiled once for all the routers.
+    engine = PolicyEngine.PolicyEngine(self.logger, rules)
+
+    tasks = self.compile(engine, rules, generation)
+    if tasks:
+      self.write(engine, rules, tasks, generation)
+
+    # Retrying routers which still cannot be crawled, or whose services did
+    # not change, is not a new generation.
+    if not generation.changed and generation.written == 0:
+      generation.skipped = True
+
+    self.metrics.observe('policy_manager_phase_duration_seconds',
+                         generation.crawl_time, phase='crawl')
+    self.metrics.observe('policy_manager_phase_duration_seconds',
+                         generation.timings[0], phase='match')
+    self.metrics.observe('policy_manager_phase_duration_seconds',
+                         generation.timings[1], phase='write')
+
+    if generation.failed:
+      self.logger.error("Unable to get services. Firewall rules of " +
+                        "the remaining routers not generated.")
+      self.metrics.inc('policy_manager_cycles_total', result='failed')
+      return
+
+    self.updateMetrics(set(generation.interfaces.keys()) | generation.held,
+                       sum(generation.counts.values()), generation.serial)
+    self.metrics.set('policy_manager_stale_routers',
+                     len(generation.stale) + len(generation.held))
+    if generation.skipped and not generation.changed:
+      self.logger.info("Services unchanged.")
+    elif generation.skipped:
+      self.logger.info("Serial %i changed but not the services nor " %
+                       generation.serial + "the public interfaces. " +
+                       "Generation skipped.")
+      self.metrics.inc('policy_manager_generations_skipped_total',
+                       reason='services_unchanged')
+    else:
+      self.logger.info("Rules updated.")
 
-        rules = self.getRules()
-        services = wrapper.getServices()
-
-        # Implementation of Algorithm 1 Section 5.1.4.3 of the report. 
-
-        # For each router.
-        for router_fqdn in services.keys():
-          # Getting only the name of the router.
-          router = router_fqdn.split(".")[0]
-
-          # Getting public interfaces of the router.
-          input_ifcs = wrapper.getPublicInterfaces(router)
-          if not input_ifcs or len(input_ifcs) == 0:
-            self.logger.warning("No public interface found for router %s. " +
-                                "No rules applied." % router)
-            break
-
-          # Creating iptables file.
-          iptables_file = open('/etc/policy-manager/iptables_' + router + '.sh',
-                               'w')
-
-          # Storing written lines to avoid writing duplicates.
-          iptables_rules = []
-
-          # Removing rules not concerning the current router.
-          rules_routers_filtered = []
-          for rule in rules:
-            if rule['router'] == router or rule['router'] == "*":
-              rules_routers_filtered.append(rule)
-
-          # For each rule.
-          for rule in rules_routers_filtered:
-            try:
-              ip_version = netaddr.IPAddress(rule['src-address']).version
-            except netaddr.core.AddrFormatError:
-              self.logger.warning("%s is not a valid address. Rule " +
-                                  "ignored." % rule['src-address'])
-              break
-
-            # Computing the services matching the rule.
-            match_services = []
-            for stype_fqdn in services[router_fqdn].keys():
-              # Keeping only service name.
-              stype = stype_fqdn.strip(".")[:-len(router_fqdn.strip("."))-1]
-
-              for service in services[router_fqdn][stype_fqdn]:
-                # Check if IP versions are the same.
-                ip_ok = False
-                for add in service['addresses']:
-                  if ip_version == netaddr.IPAddress(add).version:
-                    ip_ok = True
-                    break
-
-                # Check if the regular expressions match the name and type of
-                # the service.
-                if (ip_ok and re.match(rule['name'], service['name'])
-                          and re.match(rule['type'], stype)):
-                  match_services.append(service)
-  
-            # For each service matching the rule.
-            for match_service in match_services:
-              # For each interface.
-              for ifc in input_ifcs:
-                # For each address.
-                for address in match_service['addresses']:
-
-                  # Creation of the rule (only if IP addresses match).
-                  if ip_version == netaddr.IPAddress(address).version:
-
-                    # Choosing between iptables and ip6tables.
-                    string = ""
-                    if (ip_version == 4):
-                      string += "iptables -t filter -A FORWARD "
-                    else:
-                      string += "ip6tables -t filter -A FORWARD "
-
-                    # Choosing between tcp and !tcp. Indeed, RFC6763 specifies
-                    # that _udp is for any other protocol than TCP. It does 
-                    # not mean UDP.
-                    if (stype.split(".")[-1][1:]) == 'tcp':
-                      string += "-p tcp "
-                    else:
-                      string += "-p !tcp "
-
-                    # Specifying source address and prefix from the rule.
-                    string += "-s %s/%s " % (rule['src-address'],
-                                             rule['src-prefix-length'])
-  
-                    # Interface.
-                    string += "-i %s " % ifc
-      
-                    # Destination is the address of the service.
-                    string += "-d %s " % address
-  
-                    # Port is the port on which the service is running.
-                    string += "--dport %i " % match_service['port']
-
-                    # ACCEPT or DROP based on the rule.
-                    if (rule['action'] == 'allow'):
-                      string += "-j ACCEPT"
-                    else:
-                      string += "-j DROP"
-
-                    if not string in iptables_rules: 
-                      iptables_rules.append(string)
-                      iptables_file.write(string + "\n")
-
-          # Deny by default
-          iptables_file.write("iptables  -t filter -P FORWARD DROP\n")
-          iptables_file.write("ip6tables -t filter -P FORWARD DROP\n")
-          iptables_file.close()
-
-        self.logger.info("Rules updated.")
-
-        # Update SOA and modification time only if we computed the new rules.
-        if services and rules:
-          dns_last_change = dns_current_serial
-          config_last_change = config_current_change  
+    # Update SOA and hash as the generation completed, even if no router or no
+    # rule was found (e.g. all the routers belong to other instances).
+    self.save(generation)
 
+  def crawl(self, generation):
+    """Crawl phase: gets the services of the routers, reused from the last
+    generation if the zone and the routers of this instance did not change.
+
+    Args:
+      generation: Generation whose services, reuse, partial, retried and
+        crawl_time are set. When streaming, the services are a generator
+        crawling each router when it is needed.
+    """
+
+    started = time.time()
+    stream  = self.options.get('stream', False)
+
+    # The services only have to be crawled again if the zone or the routers of
+    # this instance changed.
+    generation.reuse = (generation.serial  == self.last_serial and
+                        generation.members == self.last_members and
+                        self.services is not None)
+    owned = None
+    if self.shards is not None:
+      owned = self.shards.owns
+
+    # Subdomains crawled again, the zone being the same. When streaming, the
+    # generation only crawls them if nothing else changed.
+    due = []
+    if generation.retrying:
+      due = [subdomain for subdomain in self.recovery.failing()
+             if self.recovery.due(subdomain)]
+    generation.retried = set([subdomain.split(".")[0] for subdomain in due])
+    generation.partial = (stream and generation.retrying and
+                          not generation.changed)
+
+    # The answers cached before the change of the serial may be stale.
+    if generation.serial != self.last_serial and self.cache is not None:
+      self.invalidate()
+    if generation.reuse:
+      self.logger.debug("Zone unchanged. Reusing services of serial " +
+                        "%i." % generation.serial)
+      services = self.services
+      if generation.retrying:
+        services = dict(services)
+        for router in self.wrapper.iterRouters(due, self.recovery):
+          services[router.fqdn] = router
+    elif generation.partial:
+      self.logger.debug("Zone unchanged. Only crawling again the " +
+                        "subdomains which could not be crawled.")
+      services = self.wrapper.iterRouters(due, self.recovery)
+    elif stream:
+      # Each router is matched and written before the next one is crawled.
+      services = self.wrapper.iterServices(owned, self.recovery)
+    else:
+      services = self.wrapper.getServices(owned, self.recovery)
+
+    generation.services   = services
+    generation.crawl_time = time.time() - started
+
+  def invalidate(self):
+    """Removes the answers of the domain from the cache which may have changed
+    since the last generation: those of the names changed since its serial if
+    the server sends them in an incremental transfer, all of them otherwise.
+    Incremental transfers are no longer requested once refused."""
+
+    names = None
+    if self.journal is not None and self.last_serial > 0:
+      try:
+        names = self.journal.changes(self.last_serial)
+      except (dns.exception.DNSException, socket.error, EOFError) as e:
+        self.logger.info("Unable to get the changes of the zone since " +
+                         "serial %i (%s). The DNS cache of the domain " %
+                         (self.last_serial, e) +
+                         "is cleared at each change.")
+        self.journal = None
+
+    if names is None:
+      self.cache.clear(self.domain)
+    else:
+      self.logger.debug("%i names changed since serial %i." %
+                        (len(names), self.last_serial))
+      self.cache.invalidate(names, self.domain)
+
+  def compile(self, engine, rules, generation):
+    """Compile phase: gets the public interfaces of each router crawled and
+    decides which routers have to be written, by comparing the fingerprints
+    of their inputs. When streaming, the files of each router are written
+    before the next router is crawled.
+
+    Serials also change for records the rules do not depend on (TTLs, other
+    TXT records, updates cancelling each other...): nothing is written if the
+    zone is the only change and the services and public interfaces are the
+    same as for the last generation.
+
+    Args:
+      engine: PolicyEngine compiled from the rules.
+      rules: array of the rules as returned by getRules().
+      generation: Generation crawled by crawl(), whose interfaces, digests,
+        counts, stale, held, catalog, failed and skipped are set.
+
+    Returns:
+      An array of tasks (router, types, interfaces) for write().
+    """
+
+    stream = self.options.get('stream', False)
+
+    # The routers which are not crawled again keep their results.
+    if generation.partial:
+      generation.interfaces = dict(self.interfaces)
+      generation.digests    = dict(self.digests)
+      generation.counts     = dict(self.counts)
+
+    if isinstance(generation.services, dict):
+      routers = iter(generation.services.values())
+    else:
+      routers = generation.services
+
+    found = []  # Routers and their interfaces, if batched.
+
+    # For each router.
+    while True:
+      started = time.time()
+      try:
+        router = next(routers)
+      except StopIteration:
+        break
+      finally:
+        generation.crawl_time += time.time() - started
+      if router is None:
+        generation.failed = True
+        break
+      generation.counts[router.name] = router.count()
+      if router.stale():
+        generation.stale.append(router.name)
+
+      # Getting public interfaces of the router.
+      started = time.time()
+      if (generation.reuse and not router.name in generation.retried and
+          self.interfaces.get(router.name) is not None):
+        input_ifcs = self.interfaces[router.name]
+      else:
+        input_ifcs = self.wrapper.getPublicInterfaces(router.name)
+        if input_ifcs is None:
+          # Keeping the interfaces of the last generation until the subdomain
+          # is crawled again.
+          self.recovery.postpone(router.fqdn)
+          input_ifcs = self.interfaces.get(router.name)
+          if not router.name in generation.stale:
+            generation.stale.append(router.name)
+        else:
+          self.recovery.confirm(router.fqdn)
+      generation.crawl_time += time.time() - started
+      generation.interfaces[router.name] = input_ifcs
+      generation.digests[router.name] = ServiceModel.digest(router, input_ifcs)
+
+      if stream:
+        task = self.prepare(engine, router, input_ifcs,
+                            generation.fingerprints)
+        if task is not None:
+          self.write(engine, rules, [task], generation)
       else:
-        self.logger.debug("No change detected.")
+        found.append((router, input_ifcs))
+
+    # Routers which could not be crawled and have no earlier services (e.g.
+    # when streaming): their files are left as they are.
+    generation.held = set([subdomain.split(".")[0]
+                           for subdomain in self.recovery.failing()])
+    generation.held -= set(generation.interfaces.keys())
+    if generation.stale or generation.held:
+      self.logger.warning("Unable to crawl routers %s. " %
+                          ", ".join(sorted(generation.stale +
+                                           list(generation.held))) +
+                          "Services or files of an earlier crawl kept, " +
+                          "crawled again later.")
+
+    generation.catalog = ServiceModel.catalog(generation.digests)
+    pending = [router for router in generation.interfaces.keys()
+               if generation.interfaces[router] and
+               not router in self.fingerprints]
+    if (not generation.failed and generation.catalog == self.catalog and
+        not pending and not generation.held and
+        generation.config  == self.last_config and
+        generation.members == self.last_members):
+      generation.skipped = True
+      found = []
+
+    tasks = []
+    for router, input_ifcs in found:
+      task = self.prepare(engine, router, input_ifcs, generation.fingerprints)
+      if task is not None:
+        tasks.append(task)
+
+    return tasks
+
+  def write(self, engine, rules, tasks, generation):
+    """Write phase: computes and writes the files of routers, in a pool of
+    processes if several compile workers are configured.
+
+    Args:
+      engine: PolicyEngine compiled from the rules.
+      rules: array of the rules as returned by getRules().
+      tasks: array of tuples (router, types, interfaces) returned by
+        prepare().
+      generation: Generation whose fingerprints are recorded for the routers
+        written and whose timings are increased.
+    """
+
+    if self.compiler is not None and len(tasks) > 1:
+      results = self.compiler.run(rules, self.writer, tasks)
+    else:
+      results = []
+      for router, types, interfaces in tasks:
+        started = time.time()
+        matches = engine.match(router, types, interfaces)
+        matched = time.time()
+        try:
+          written = self.writer.write(router, matches)
+          results.append((router, None, len(matches), written,
+                          matched - started, time.time() - matched))
+        except (IOError, OSError) as e:
+          results.append((router, str(e), len(matches), 0, matched - started,
+                          time.time() - matched))
+
+    self.record(results, generation.fingerprints, generation.timings)
+    generation.written += len(tasks)
+
+  def save(self, generation):
+    """Save phase: keeps the results of a generation for the next ones and
+    saves them in the snapshot.
+
+    Args:
+      generation: Generation completed.
+    """
 
-      time.sleep(int(self.rate)) # every x seconds.
+    self.last_serial    = generation.serial
+    self.last_config    = generation.config
+    self.last_members   = generation.members
+    self.settle_serial  = None
+    self.settle_started = None
+    self.settle_since   = None
+
+    # Forgetting the routers which disappeared from the zone or now belong to
+    # another instance.
+    for router in self.fingerprints.keys():
+      if (not router in generation.interfaces and
+          not router in generation.held):
+        del self.fingerprints[router]
+
+    # When streaming, the services are not kept: they are crawled again if
+    # only the configuration file changes.
+    if self.options.get('stream', False) and not generation.reuse:
+      self.services = None
+    else:
+      self.services = generation.services
+    self.interfaces = generation.interfaces
+    self.catalog    = generation.catalog
+    self.digests    = generation.digests
+    self.counts     = generation.counts
+    self.saveSnapshot(self.last_serial, self.last_config)
+
+    if generation.skipped and not generation.changed:
+      self.metrics.inc('policy_manager_cycles_total', result='unchanged')
+    elif generation.skipped:
+      self.metrics.inc('policy_manager_cycles_total', result='skipped')
+    else:
+      self.metrics.inc('policy_manager_cycles_total', result='generated')
+    if self.changed_at is not None and not generation.skipped:
+      self.metrics.observe('policy_manager_propagation_seconds',
+                           time.time() - self.changed_at)
+    self.changed_at = None
+
+  def saveSnapshot(self, serial, config):
+    """Saves the state of the last generation, if snapshots are enabled.
+
+    Args:
+      serial: serial of the zone the rules were generated from.
+      config: hash of the configuration file the rules were generated from.
+    """
+
+    if self.snapshot is None:
+      return
+
+    self.snapshot.save(self.domain, Snapshot.settings(self.writer), serial,
+                       config, self.services, self.interfaces,
+                       self.fingerprints, self.catalog, self.digests,
+                       self.counts, self.last_members)
+
+  def prepare(self, engine, router, interfaces, fingerprints):
+    """Decides whether the files of a router have to be generated.
+
+    Args:
+      engine: PolicyEngine compiled from the rules.
+      router: ServiceModel.Router.
+      interfaces: array of the public interfaces of the router.
+      fingerprints: dictionary the fingerprint of the inputs of the router is
+        added to if its files have to be generated.
+
+    Returns:
+      A task for compile(), or None if the router has no public interface or
+      if its services, interfaces and rules did not change since its files
+      were last written.
+    """
+
+    if not interfaces or len(interfaces) == 0:
+      self.logger.warning("No public interface found for router " +
+                          "%s. No rules applied." % router.name)
+      return None
+
+    fingerprint = engine.fingerprint(router.name, router.types, interfaces)
+    if (self.fingerprints.get(router.name) == fingerprint and
+        self.writer.exists(router.name)):
+      self.logger.debug("No change for router %s." % router.name)
+      self.metrics.inc('policy_manager_routers_unchanged_total')
+      return None
+
+    fingerprints[router.name] = fingerprint
+    return (router.name, router.types, interfaces)
+
+  def record(self, results, fingerprints, timings):
+    """Records the results of the computation of the files of routers.
+
+    Args:
+      results: array of tuples as returned by compile().
+      fingerprints: dictionary of the fingerprints of the inputs of the
+        routers, kept for the routers whose files were written.
+      timings: array [match time, write time] the durations are added to.
+    """
+
+    for router, error, entries, written, matching, writing in results:
+      timings[0] += matching
+      timings[1] += writing
+      self.metrics.set('policy_manager_router_entries', entries,
+                       router=router)
+      self.metrics.set('policy_manager_router_match_seconds', matching,
+                       router=router)
+      self.metrics.set('policy_manager_router_write_seconds', writing,
+                       router=router)
+
+      if error is not None:
+        self.logger.error("Unable to write rules of router %s: %s" %
+                          (router, error))
+        self.metrics.inc('policy_manager_router_write_failures_total',
+                         router=router)
+        # Written again at the next generation, even if nothing changes.
+        self.fingerprints.pop(router, None)
+        continue
+
+      self.fingerprints[router] = fingerprints[router]
+      self.metrics.set('policy_manager_router_rules', written, router=router)
+      if self.writer.optimize:
+        self.logger.debug("Router %s: %i entries written as %i rules " %
+                          (router, entries, written) +
+                          "(%i removed)." % (entries - written))
+
+  def updateMetrics(self, routers, count, serial):
+    """Updates the metrics describing the result of a generation.
+
+    Args:
+      routers: set of the names of the routers found.
+      count: number of services found.
+      serial: serial of the zone the rules were generated from.
+    """
+
+    self.metrics.set('policy_manager_serial', serial)
+    self.metrics.set('policy_manager_services', count)
+    self.metrics.set('policy_manager_routers', len(routers))
+    self.metrics.set('policy_manager_last_generation_timestamp_seconds',
+                     time.time())
+
+    # Forgetting the routers which disappeared from the zone.
+    for name in ['policy_manager_router_entries', 'policy_manager_router_rules',
+                 'policy_manager_router_match_seconds',
+                 'policy_manager_router_write_seconds']:
+      for router in self.metrics.labels(name, 'router') - routers:
+        self.metrics.discard(name, router=router)
 
   def stop(self):
     """Stops the computations."""
 
     self.run = False
+    self.wakeup.set()
 
   def getRules(self):
     """Gets rules from the configuration file.
@@ -201,39 +1003,4 @@ class PolicyManager:
       An array of the rules (which are dictionaries) or None in case of failure.
     """
 
-    # Checking configuration file versus DTD.
-    try:
-      dtd = etree.DTD("/etc/policy-manager/config.dtd")
-      xml = etree.parse("/etc/policy-manager/config.xml")
-      if (not dtd.validate(xml)):
-        self.logger.error("Configuration file is not a valid instance of DTD. "+
-                          "Firewall rules not generated.")
-        return None
-    except etree.LxmlError as e:
-      self.logger.error("Error while parsing configuration file: %s" % e)
-      return None      
-
-    # Since we performed the DTD validation, we are sure the requested tags
-
-    rules = []
-    rules_tag = xml.find("./rules")
-    if (rules_tag == None):
-      pass # Rules are not mandatory.
-    else:
-      # For each rule.
-      for el in rules_tag:
-        action = el.text.strip() # Remove leading/trailing blanks.
-        if (action.lower() != "allow" and action.lower() != "deny"):
-          self.logger.warning("Action '%s' is neither 'allow' nor 'deny'. " +
-                              "Rule ignored.", action)
-          continue
-
-        # Add each rule in the 'rules' array.
-        d = dict(el.items())
-        d["action"] = action.lower()
-        rules.append(d)
-
-    if (len(rules) == 0):
-      self.logger.warning("No rules found.")
-
-    return rules
+    return self.config.getRules()
@@ -0,0 +1,199 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/python/PolicyQuery.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Module answering "what can this host reach?" from the rules of the
+configuration file and the crawled services, without reading the generated
+firewall files.
+"""
+
+import collections     # for namedtuple
+
+import netaddr         # for manipulation of IP addresses
+
+import PolicyEngine    # to compile the rules
+import ServiceModel    # to unpack the addresses of the services
+
+# The effective policy of a source for one service of a router. 'action' is
+# 'allow' or 'deny', or None if no rule applies (the default policy of the
+# router then decides). 'rule' is the position of the deciding rule in the
+# configuration file, or None.
+Decision = collections.namedtuple('Decision', ['router', 'type', 'protocol',
+                                               'service', 'port', 'addresses',
+                                               'action', 'rule'])
+
+class PrefixTrie:
+  """Binary radix trie of the source prefixes of the rules of one IP
+  version. Finding the prefixes containing an address takes at most one step
+  per bit of the address, whatever the number of rules."""
+
+  def __init__(self, bits):
+    """Constructor.
+
+    Args:
+      bits: number of bits of the addresses (32 or 128).
+    """
+
+    self.bits = bits
+    self.root = [None, None, []]  # Child of bit 0, child of bit 1, items.
+
+  def insert(self, value, length, item):
+    """Adds an item to a prefix.
+
+    Args:
+      value: integer value of the network address of the prefix.
+      length: length of the prefix.
+      item: item to add.
+    """
+
+    node = self.root
+    for i in range(length):
+      bit = (value >> (self.bits - 1 - i)) & 1
+      if node[bit] is None:
+        node[bit] = [None, None, []]
+      node = node[bit]
+    node[2].append(item)
+
+  def covering(self, address):
+    """Gets the items of all the prefixes containing an address.
+
+    Args:
+      address: integer value of the address.
+
+    Returns:
+      An array of the items, from the shortest prefix to the longest one.
+    """
+
+    items = []
+    node  = self.root
+    shift = self.bits - 1
+    while node is not None:
+      items.extend(node[2])
+      if shift < 0:
+        break
+      node = node[(address >> shift) & 1]
+      shift -= 1
+
+    return items
+
+class PolicyQuery:
+  """Index of the rules and services of a domain answering effective policy
+  queries.
+
+  The source prefixes of the rules are indexed in a PrefixTrie per IP version
+  and the services each rule applies to (by router, type and name) are found
+  once when the index is built. A query then only walks the trie and the
+  services of the rules containing the source, in the order of the
+  configuration file: the first rule applying to a service decides, as for the
+  generated firewall rules."""
+
+  def __init__(self, logger, rules, services):
+    """Constructor.
+
+    Args:
+      logger: logger used to report ignored rules.
+      rules: array of the rules as returned by PolicyManager.getRules().
+      services: services as returned by DNSWrapper.getServices().
+    """
+
+    self.logger  = logger
+    self.engine  = PolicyEngine.PolicyEngine(logger, rules)
+    self.tries   = {4: PrefixTrie(32), 6: PrefixTrie(128)}
+    self.targets = []      # (router, ServiceType, Service) of every service.
+    self.routers = dict()  # Positions in self.targets of each router.
+    self.applies = dict()  # Positions in self.targets of each rule.
+
+    for rule in self.engine.rules:
+      try:
+        network = netaddr.IPNetwork(rule.source)
+      except (netaddr.core.AddrFormatError, ValueError):
+        self.logger.warning("%s is not a valid prefix. Rule ignored." %
+                            rule.source)
+        continue
+      self.tries[rule.version].insert(network.first, network.prefixlen, rule)
+      self.applies[rule.index] = []
+
+    names = dict()  # (pattern, string) -> bool
+    for router in sorted(services.values(), key=lambda router: router.name):
+      positions = self.routers.setdefault(router.name, [])
+      rules = [rule for rule in self.engine.rulesFor(router.name)
+               if rule.index in self.applies]
+
+      for stype in router.types:
+        for service in stype.services:
+          position = len(self.targets)
+          self.targets.append((router.name, stype, service))
+          positions.append(position)
+
+          for rule in rules:
+            if not service.addresses(rule.version):
+              continue
+            for pattern, string in [(rule.type, stype.name),
+                                    (rule.name, service.name)]:
+              if not (pattern, string) in names:
+                names[(pattern, string)] = pattern.match(string) is not None
+            if (names[(rule.type, stype.name)] and
+                names[(rule.name, service.name)]):
+              self.applies[rule.index].append(position)
+
+  def query(self, source, router=None):
+    """Computes the effective policy of a source address.
+
+    Args:
+      source: text of the source address.
+      router: name of the router whose services are considered. None for all
+        the routers.
+
+    Returns:
+      An array of Decision, one per service having addresses of the IP version
+      of the source, sorted by router, type and name. None if the source is not
+      a valid address.
+    """
+
+    try:
+      address = netaddr.IPAddress(source)
+    except (netaddr.core.AddrFormatError, ValueError):
+      self.logger.warning("%s is not a valid address." % source)
+      return None
+    version = address.version
+
+    # First rule containing the source which applies to each service.
+    decided = dict()
+    rules = sorted(self.tries[version].covering(int(address)),
+                   key=lambda rule: rule.index)
+    for rule in rules:
+      for position in self.applies[rule.index]:
+        if not position in decided:
+          decided[position] = rule
+
+    if router is None:
+      positions = range(len(self.targets))
+    else:
+      positions = self.routers.get(router, [])
+
+    decisions = []
+    for position in positions:
+      name, stype, service = self.targets[position]
+      addresses = service.addresses(version)
+      if not addresses:
+        continue
+
+      rule = decided.get(position)
+      decisions.append(Decision(name, stype.name, stype.protocol, service.name,
+                                service.port,
+                                [ServiceModel.unpack(version, value)
+                                 for value in addresses],
+                                rule.action if rule is not None else None,
+                                rule.index if rule is not None else None))
+
+    return decisions
@@ -0,0 +1,119 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/python/RuleOptimizer.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Module reducing the number of firewall rules of a router while keeping their
+first-match semantics.
+"""
+
+import collections     # for namedtuple and OrderedDict
+
+import netaddr         # for manipulation of IP addresses
+
+# A firewall rule to write. 'ports' is a tuple of ports, matched with multiport
+# when it has more than one element (TCP only, see optimize()).
+Entry = collections.namedtuple('Entry', ['version', 'protocol', 'source',
+                                         'interface', 'address', 'ports',
+                                         'target'])
+
+# Maximum number of ports of a multiport match.
+MULTIPORT_MAX = 15
+
+def entries(matches):
+  """Converts firewall entries to rules to write, without any optimization.
+
+  Args:
+    matches: array of PolicyEngine.Match to apply, in order.
+
+  Returns:
+    An array of Entry, in order.
+  """
+
+  return [Entry(match.version, match.protocol, match.rule.source,
+                match.interface, match.address, (match.port,),
+                match.rule.target) for match in matches]
+
+def optimize(matches):
+  """Reduces the number of firewall rules needed to apply firewall entries.
+
+  Two entries can only match the same packet if they share their interface,
+  destination, protocol and port (their 'slot'): the verdict of a packet only
+  depends on the order of the entries of its slot, and slots can be reordered
+  freely. Within each slot:
+    - entries whose source is covered by the sources of the previous entries
+      never fire and are removed (shadow elimination),
+    - an entry is merged with the closest previous entry having the same
+      action, provided no entry in between with another action overlaps it,
+      and the sources of merged entries are aggregated with cidr_merge.
+  Then, TCP entries of different slots sharing their source, interface,
+  destination, action and position in their slot are folded into multiport
+  rules. iptables only accepts multiport with an explicit protocol, so the
+  entries of '!tcp' keep one rule per port.
+
+  Args:
+    matches: array of PolicyEngine.Match to apply, in order.
+
+  Returns:
+    An array of Entry, in an order giving the same verdicts as the entries.
+  """
+
+  # Entries of each slot, in order.
+  slots = collections.OrderedDict()
+  for match in matches:
+    key = (match.version, match.protocol, match.interface, match.address,
+           match.port)
+    slots.setdefault(key, []).append(
+      (netaddr.IPNetwork(match.rule.source).cidr, match.rule.target))
+
+  # Compacting each slot into groups [target, IPSet of sources].
+  folds = collections.OrderedDict()
+  for key, slot in slots.items():
+    covered = netaddr.IPSet()
+    groups  = []
+    for source, target in slot:
+      # Shadowed by the previous entries.
+      if source in covered:
+        continue
+      covered.add(source)
+
+      # Looking for the closest previous group with the same action which can
+      # be reached without crossing an overlapping group with another action.
+      for group in reversed(groups):
+        if group[0] == target:
+          group[1].add(source)
+          break
+        if not group[1].isdisjoint(netaddr.IPSet([source])):
+          groups.append([target, netaddr.IPSet([source])])
+          break
+      else:
+        groups.append([target, netaddr.IPSet([source])])
+
+    version, protocol, interface, address, port = key
+    for rank, (target, sources) in enumerate(groups):
+      for source in sources.iter_cidrs():
+        # The port is part of the fold of the entries which cannot be folded.
+        fold = (rank, version, protocol, str(source), interface, address,
+                target, None if protocol == 'tcp' else port)
+        folds.setdefault(fold, []).append(port)
+
+  # Ranks are written in increasing order so that the order of each slot is
+  # kept, whatever the folding.
+  result = []
+  for fold in sorted(folds.keys(), key=lambda fold: fold[0]):
+    _, version, protocol, source, interface, address, target, _ = fold
+    ports = folds[fold]
+    for i in range(0, len(ports), MULTIPORT_MAX):
+      result.append(Entry(version, protocol, source, interface, address,
+                          tuple(ports[i:i + MULTIPORT_MAX]), target))
+
+  return result
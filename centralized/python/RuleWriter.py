@@ -0,0 +1,520 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/python/RuleWriter.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Module writing the firewall entries computed for a router in the different
+supported output formats.
+"""
+
+import os              # for path manipulation, rename and chmod
+import bisect          # for the ranges of addresses covered
+import tempfile        # to write files atomically
+import collections     # for OrderedDict
+
+import netaddr         # for manipulation of IP addresses
+
+import RuleOptimizer   # to reduce the number of rules
+
+# Supported output formats:
+#   script:  shell script of iptables/ip6tables commands (iptables_<router>.sh).
+#   restore: iptables-restore and ip6tables-restore payloads
+#            (iptables_<router>.rules and ip6tables_<router>.rules).
+#   nft:     nftables ruleset to be loaded with 'nft -f' (nftables_<router>.nft).
+FORMATS = ['script', 'restore', 'nft']
+
+# Supported aggregations of the destinations of a rule in the iptables formats:
+#   none:  one firewall rule per destination address and port.
+#   ipset: destinations of each rule are grouped in a hash:ip,port ipset
+#          (ipset_<router>.ipset, to be loaded with 'ipset restore' before the
+#          firewall rules) and matched with one firewall rule per interface.
+AGGREGATIONS = ['none', 'ipset']
+
+# Protocols carrying ports which are not TCP. RFC6763 specifies that _udp is for
+# any other protocol than TCP, such services are thus added for all of them.
+NON_TCP_PROTOCOLS = ['udp', 'sctp', 'udplite']
+
+# Number of bits of the addresses of each IP version.
+BITS = {4: 32, 6: 128}
+
+def writeAtomically(path, lines):
+  """Writes lines to a file so that readers either see the previous content or
+  the new one, never a partially written file.
+
+  Args:
+    path: path of the file.
+    lines: iterable of the lines to write (without the trailing newline),
+      e.g. a generator so that the lines are not all kept in memory.
+
+  Raises:
+    IOError or OSError if the file cannot be written.
+  """
+
+  # The temporary file must be on the same file system for rename() to be
+  # atomic.
+  fd, temporary = tempfile.mkstemp(prefix=".", dir=os.path.dirname(path))
+  try:
+    with os.fdopen(fd, 'w') as f:
+      for line in lines:
+        f.write(line + "\n")
+    os.chmod(temporary, 0o644)
+    os.rename(temporary, path)
+  except:
+    os.remove(temporary)
+    raise
+
+def ruleSpecification(entry):
+  """Gets the iptables rule specification of a firewall rule.
+
+  Args:
+    entry: a RuleOptimizer.Entry.
+
+  Returns:
+    The rule specification, without the chain, as a string.
+  """
+
+  if len(entry.ports) == 1:
+    ports = "--dport %i" % entry.ports[0]
+  else:
+    ports = "-m multiport --dports %s" % ",".join(str(port) for port
+                                                  in entry.ports)
+
+  return ("-p %s -s %s -i %s -d %s %s -j %s" %
+          (entry.protocol, entry.source, entry.interface, entry.address, ports,
+           entry.target))
+
+def setName(rule):
+  """Gets the name of the ipset gathering the destinations of a rule.
+
+  Args:
+    rule: a PolicyEngine.Rule.
+
+  Returns:
+    The name of the set (at most 31 characters as required by ipset).
+  """
+
+  return "pm-rule%i" % rule.index
+
+def rangePrefixes(first, last, shortest, bits):
+  """Splits a range of addresses into the fewest prefixes, in order.
+
+  Args:
+    first: integer value of the first address of the range.
+    last: integer value of the last address of the range.
+    shortest: length of the shortest prefix possible, i.e. of a prefix
+      containing the whole range.
+    bits: number of bits of the addresses (32 or 128).
+
+  Returns:
+    An array of tuples (integer value of the network, prefix length).
+  """
+
+  prefixes = []
+  while first <= last:
+    # Largest block aligned on first and ending at last at most.
+    length = shortest
+    while (first % (1 << (bits - length)) or
+           first + (1 << (bits - length)) - 1 > last):
+      length += 1
+    prefixes.append((first, length))
+    first += 1 << (bits - length)
+
+  return prefixes
+
+class Coverage:
+  """Addresses covered by the entries of a verdict map key, as sorted
+  disjoint ranges of integers, adjacent ranges being merged. Adding a range
+  takes a binary search and the replacement of the ranges it touches, instead
+  of the set operations of a netaddr.IPSet."""
+
+  def __init__(self):
+    self.starts = []  # First address of each range, sorted.
+    self.ends   = []  # Last address of each range.
+
+  def add(self, first, last):
+    """Covers a range of addresses.
+
+    Args:
+      first: integer value of the first address of the range.
+      last: integer value of the last address of the range.
+
+    Returns:
+      An array of the ranges (first, last) of the addresses of the range which
+      were not covered yet, in order.
+    """
+
+    # Ranges overlapping or adjacent to the new one.
+    low  = bisect.bisect_left(self.ends, first - 1)
+    high = low
+    while high < len(self.starts) and self.starts[high] <= last + 1:
+      high += 1
+
+    uncovered = []
+    current = first
+    for start, end in zip(self.starts[low:high], self.ends[low:high]):
+      if start > current:
+        uncovered.append((current, min(start - 1, last)))
+      current = max(current, end + 1)
+    if current <= last:
+      uncovered.append((current, last))
+
+    if low < high:
+      first = min(first, self.starts[low])
+      last  = max(last, self.ends[high - 1])
+    self.starts[low:high] = [first]
+    self.ends[low:high]   = [last]
+
+    return uncovered
+
+class RuleWriter:
+  """Writes the firewall entries of routers in a directory, in one or several
+  formats."""
+
+  def __init__(self, directory, formats, aggregation='none', optimize=False):
+    """Constructor.
+
+    Args:
+      directory: directory in which the files are written.
+      formats: array of formats (see FORMATS) to write.
+      aggregation: aggregation (see AGGREGATIONS) of the destinations.
+      optimize: whether the rules of the iptables formats without aggregation
+        are compacted with RuleOptimizer.optimize().
+    """
+
+    self.directory   = directory
+    self.formats     = formats
+    self.aggregation = aggregation
+    self.optimize    = optimize
+
+    # Whether iptables files (and thus possibly ipsets) are written.
+    self.iptables = 'script' in formats or 'restore' in formats
+
+  def paths(self, router):
+    """Gets the paths of all the files written for a router.
+
+    Args:
+      router: name of the router.
+
+    Returns:
+      An array of paths.
+    """
+
+    paths = []
+    if 'script' in self.formats:
+      paths.append(os.path.join(self.directory, 'iptables_%s.sh' % router))
+    if 'restore' in self.formats:
+      paths.append(os.path.join(self.directory, 'iptables_%s.rules' % router))
+      paths.append(os.path.join(self.directory, 'ip6tables_%s.rules' % router))
+    if self.iptables and self.aggregation == 'ipset':
+      paths.append(os.path.join(self.directory, 'ipset_%s.ipset' % router))
+    if 'nft' in self.formats:
+      paths.append(os.path.join(self.directory, 'nftables_%s.nft' % router))
+
+    return paths
+
+  def exists(self, router):
+    """Checks whether all the files of a router have already been written.
+
+    Args:
+      router: name of the router.
+
+    Returns:
+      True if all the files exist, False otherwise.
+    """
+
+    for path in self.paths(router):
+      if not os.path.exists(path):
+        return False
+
+    return True
+
+  def write(self, router, matches):
+    """Writes the files of a router in all the configured formats.
+
+    Args:
+      router: name of the router.
+      matches: array of PolicyEngine.Match to apply, in order.
+
+    Returns:
+      The number of firewall rules written (iptables rules if iptables formats
+      are written, elements of the verdict maps otherwise).
+
+    Raises:
+      IOError or OSError if a file cannot be written.
+    """
+
+    if not self.iptables:
+      specifications = []
+    elif self.aggregation == 'ipset':
+      # Sets must be written first as the rules refer to them.
+      sets, specifications = self.aggregate(matches)
+      writeAtomically(os.path.join(self.directory, 'ipset_%s.ipset' % router),
+                      self.ipset(sets))
+    else:
+      if self.optimize:
+        entries = RuleOptimizer.optimize(matches)
+      else:
+        entries = RuleOptimizer.entries(matches)
+      specifications = [(entry.version, ruleSpecification(entry))
+                        for entry in entries]
+
+    if 'script' in self.formats:
+      writeAtomically(os.path.join(self.directory, 'iptables_%s.sh' % router),
+                      self.script(specifications))
+
+    if 'restore' in self.formats:
+      writeAtomically(os.path.join(self.directory,
+                                   'iptables_%s.rules' % router),
+                      self.restore(specifications, 4))
+      writeAtomically(os.path.join(self.directory,
+                                   'ip6tables_%s.rules' % router),
+                      self.restore(specifications, 6))
+
+    if 'nft' in self.formats:
+      elements = self.verdicts(matches)
+      writeAtomically(os.path.join(self.directory, 'nftables_%s.nft' % router),
+                      self.nft(elements))
+      if not self.iptables:
+        return len(elements[4]) + len(elements[6])
+
+    return len(specifications)
+
+  def aggregate(self, matches):
+    """Groups the destinations of each rule in an ipset.
+
+    Since all the entries of a rule share its source and action, and since the
+    rules keep their order, first-match semantics are preserved.
+
+    Args:
+      matches: array of PolicyEngine.Match to apply, in order.
+
+    Returns:
+      A tuple (sets, specifications). sets is an ordered dictionary whose keys
+      are the rules and whose values are ordered dictionaries of the entries
+      (address,protocol:port) of the set of the rule. specifications is an
+      array of (IP version, rule specification) with one element per rule and
+      interface, in order.
+    """
+
+    sets       = collections.OrderedDict()
+    interfaces = collections.OrderedDict()
+
+    for match in matches:
+      entries = sets.setdefault(match.rule, collections.OrderedDict())
+
+      if match.protocol == 'tcp':
+        protocols = ['tcp']
+      else:
+        protocols = NON_TCP_PROTOCOLS
+
+      for protocol in protocols:
+        entries["%s,%s:%i" % (match.address, protocol, match.port)] = True
+
+      interfaces[(match.rule, match.interface)] = True
+
+    specifications = []
+    for rule, interface in interfaces.keys():
+      specifications.append((rule.version,
+                             "-m set --match-set %s dst,dst -s %s -i %s -j %s" %
+                             (setName(rule), rule.source, interface,
+                              rule.target)))
+
+    return sets, specifications
+
+  def ipset(self, sets):
+    """Gets the 'ipset restore' payload defining the sets of the rules.
+
+    Each set is filled under a temporary name and swapped with the set in use so
+    that the content of a set is replaced atomically.
+
+    Args:
+      sets: ordered dictionary of the sets, as returned by aggregate().
+
+    Returns:
+      An array of lines.
+    """
+
+    lines = []
+    for rule, entries in sets.items():
+      name      = setName(rule)
+      temporary = name + "-new"
+      if rule.version == 4:
+        family = "inet"
+      else:
+        family = "inet6"
+
+      lines.append("create %s hash:ip,port family %s -exist" % (name, family))
+      lines.append("create %s hash:ip,port family %s -exist" % (temporary,
+                                                                family))
+      lines.append("flush %s" % temporary)
+      for entry in entries.keys():
+        lines.append("add %s %s" % (temporary, entry))
+      lines.append("swap %s %s" % (temporary, name))
+      lines.append("destroy %s" % temporary)
+
+    return lines
+
+  def script(self, specifications):
+    """Gets the shell script applying firewall rules one command at a time.
+
+    Args:
+      specifications: array of (IP version, rule specification) to apply, in
+        order.
+
+    Returns:
+      A generator of the lines.
+    """
+
+    for version, specification in specifications:
+      # Choosing between iptables and ip6tables.
+      if (version == 4):
+        yield "iptables -t filter -A FORWARD " + specification
+      else:
+        yield "ip6tables -t filter -A FORWARD " + specification
+
+    # Deny by default
+    yield "iptables  -t filter -P FORWARD DROP"
+    yield "ip6tables -t filter -P FORWARD DROP"
+
+  def restore(self, specifications, version):
+    """Gets the iptables-restore (or ip6tables-restore) payload of the rules
+    of one IP version.
+
+    The payload only touches the FORWARD chain of the filter table and must be
+    loaded with 'iptables-restore --noflush' (or 'ip6tables-restore --noflush')
+    so that other chains are kept. The whole chain is replaced in one commit.
+
+    Args:
+      specifications: array of (IP version, rule specification) to apply, in
+        order.
+      version: IP version (4 or 6) of the payload.
+
+    Returns:
+      A generator of the lines.
+    """
+
+    yield "*filter"
+    yield ":FORWARD DROP [0:0]" # Deny by default.
+    yield "-F FORWARD"
+
+    for rule_version, specification in specifications:
+      if rule_version == version:
+        yield "-A FORWARD " + specification
+
+    yield "COMMIT"
+
+  def verdicts(self, matches):
+    """Computes the elements of the nftables verdict maps.
+
+    Verdict maps do not have an order, while firewall entries follow
+    first-match semantics. For each (interface, destination, protocol, port),
+    the source prefix of an entry is thus reduced to the addresses not already
+    covered by the previous entries, which gives disjoint intervals with the
+    same verdicts as the ordered entries. The addresses covered are kept as
+    sorted disjoint ranges of integers (see Coverage).
+
+    Args:
+      matches: array of PolicyEngine.Match to apply, in order.
+
+    Returns:
+      A dictionary whose keys are the IP versions and whose values are arrays
+      of tuples (interface, source prefix, destination, protocol, port,
+      verdict).
+    """
+
+    covered  = dict()  # (interface, destination, protocol, port) -> Coverage
+    sources  = dict()  # Source of a rule -> its network.
+    elements = {4: [], 6: []}
+
+    for match in matches:
+      if match.protocol == 'tcp':
+        protocols = ['tcp']
+      else:
+        protocols = NON_TCP_PROTOCOLS
+
+      if match.rule.target == "ACCEPT":
+        verdict = "accept"
+      else:
+        verdict = "drop"
+
+      source = sources.get(match.rule.source)
+      if source is None:
+        source = netaddr.IPNetwork(match.rule.source).cidr
+        sources[match.rule.source] = source
+      first, last = source.first, source.last
+
+      for protocol in protocols:
+        key = (match.interface, match.address, protocol, match.port)
+        coverage = covered.get(key)
+        if coverage is None:
+          coverage = Coverage()
+          covered[key] = coverage
+
+        for start, end in coverage.add(first, last):
+          if start == first and end == last:
+            prefixes = [source]
+          else:
+            prefixes = [netaddr.IPNetwork((network, length), match.version)
+                        for network, length
+                        in rangePrefixes(start, end, source.prefixlen,
+                                         BITS[match.version])]
+          for prefix in prefixes:
+            elements[match.version].append((match.interface, prefix,
+                                            match.address, protocol,
+                                            match.port, verdict))
+
+    return elements
+
+  def nft(self, elements):
+    """Gets the nftables ruleset applying the entries of a router.
+
+    The forward chain looks up a verdict map per IP version keyed on (input
+    interface, source prefix, destination, protocol, port), which replaces the
+    linear walk of the FORWARD chain by a single lookup. The previous table is
+    deleted in the same transaction so that 'nft -f' swaps the whole ruleset
+    atomically.
+
+    Args:
+      elements: elements of the verdict maps, as returned by verdicts().
+
+    Returns:
+      An array of lines.
+    """
+
+    lines = ["table inet policy_manager",
+             "delete table inet policy_manager",
+             "table inet policy_manager {"]
+
+    for version, family in [(4, "ipv4_addr"), (6, "ipv6_addr")]:
+      lines.append("  map forward%i {" % version)
+      lines.append("    type ifname . %s . %s . inet_proto . inet_service : "
+                   % (family, family) + "verdict")
+      lines.append("    flags interval")
+      if elements[version]:
+        lines.append("    elements = {")
+        for ifc, prefix, address, protocol, port, verdict in elements[version]:
+          lines.append('      "%s" . %s . %s . %s . %i : %s,' %
+                       (ifc, prefix, address, protocol, port, verdict))
+        lines.append("    }")
+      lines.append("  }")
+
+    lines.append("  chain forward {")
+    # Deny by default.
+    lines.append("    type filter hook forward priority 0; policy drop;")
+    lines.append("    meta nfproto ipv4 iifname . ip saddr . ip daddr . " +
+                 "meta l4proto . th dport vmap @forward4")
+    lines.append("    meta nfproto ipv6 iifname . ip6 saddr . ip6 daddr . " +
+                 "meta l4proto . th dport vmap @forward6")
+    lines.append("  }")
+    lines.append("}")
+
+    return lines
@@ -0,0 +1,288 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/python/ServiceModel.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Module defining the compact representation of the services crawled in a
+domain, as returned by DNSWrapper.getServices().
+"""
+
+import hashlib         # for digests
+
+import dns.exception   # for invalid addresses
+import dns.ipv4        # to pack IPv4 addresses
+import dns.ipv6        # to pack IPv6 addresses
+
+def pack(version, address):
+  """Packs the text of an address into an integer.
+
+  Args:
+    version: 4 or 6.
+    address: text of the address.
+
+  Returns:
+    The integer value of the address, or None if it is not valid.
+  """
+
+  try:
+    if version == 4:
+      return int(dns.ipv4.inet_aton(address).encode('hex'), 16)
+    return int(dns.ipv6.inet_aton(address).encode('hex'), 16)
+  except (dns.exception.SyntaxError, ValueError):
+    return None
+
+def unpack(version, value):
+  """Gets the text of an address packed by pack().
+
+  Args:
+    version: 4 or 6.
+    value: integer value of the address.
+
+  Returns:
+    The text of the address, in the canonical form used by dnspython.
+  """
+
+  if version == 4:
+    return dns.ipv4.inet_ntoa(("%08x" % value).decode('hex'))
+  return dns.ipv6.inet_ntoa(("%032x" % value).decode('hex'))
+
+def protocol(stype):
+  """Gets the protocol of a service type.
+
+  Choosing between tcp and !tcp. Indeed, RFC6763 specifies that _udp is for
+  any other protocol than TCP. It does not mean UDP.
+
+  Args:
+    stype: the type, without the domain of the router (e.g. _http._tcp).
+
+  Returns:
+    'tcp' or '!tcp'.
+  """
+
+  if stype.split(".")[-1][1:] == 'tcp':
+    return 'tcp'
+  return '!tcp'
+
+class Service(object):
+  """A service instance: its name, port, host and addresses. The addresses
+  are packed into integers and sorted, separately for each IP version."""
+
+  __slots__ = ('name', 'port', 'host', 'ipv4', 'ipv6')
+
+  def __init__(self, name, port, host, ipv4=(), ipv6=()):
+    """Constructor.
+
+    Args:
+      name: name of the instance (unescaped FQDN).
+      port: port of the service.
+      host: FQDN of the host of the service.
+      ipv4: iterable of the IPv4 addresses, packed by pack().
+      ipv6: iterable of the IPv6 addresses, packed by pack().
+    """
+
+    self.name = name
+    self.port = port
+    self.host = intern(host)
+    self.ipv4 = tuple(sorted(ipv4))
+    self.ipv6 = tuple(sorted(ipv6))
+
+  def addresses(self, version):
+    """Gets the packed addresses of an IP version.
+
+    Args:
+      version: 4 or 6.
+
+    Returns:
+      A sorted tuple of integers.
+    """
+
+    if version == 4:
+      return self.ipv4
+    return self.ipv6
+
+  def key(self):
+    """Gets a tuple of everything the firewall rules depend on, e.g. to
+    compare services or compute fingerprints."""
+
+    return (self.name, self.port, self.host, self.ipv4, self.ipv6)
+
+  def __getstate__(self):
+    return self.key()
+
+  def __setstate__(self, state):
+    self.name, self.port, self.host, self.ipv4, self.ipv6 = state
+
+  def __eq__(self, other):
+    return isinstance(other, Service) and self.key() == other.key()
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __repr__(self):
+    return "Service(%r, %r, %r, %r, %r)" % self.key()
+
+class ServiceType(object):
+  """The services of a given type announced by a router, sorted by name."""
+
+  __slots__ = ('name', 'protocol', 'services', 'stale')
+
+  def __init__(self, name, services, stale=False):
+    """Constructor.
+
+    Args:
+      name: the type, without the domain of the router (e.g. _http._tcp).
+      services: iterable of Service.
+      stale: whether the services come from an earlier crawl, the type
+        having failed to be crawled again.
+    """
+
+    self.name     = intern(name)
+    self.protocol = protocol(name)
+    self.services = sorted(services, key=lambda service: service.name)
+    self.stale    = stale
+
+  def key(self):
+    """Gets a tuple of everything the firewall rules depend on."""
+
+    return (self.name, tuple([service.key() for service in self.services]))
+
+  def __getstate__(self):
+    return (self.name, self.protocol, self.services, self.stale)
+
+  def __setstate__(self, state):
+    self.name, self.protocol, self.services, self.stale = state
+
+  def __repr__(self):
+    return "ServiceType(%r, %r)" % (self.name, self.services)
+
+class Router(object):
+  """The service types announced in the subdomain of a router, sorted by
+  name."""
+
+  __slots__ = ('fqdn', 'name', 'types')
+
+  def __init__(self, fqdn, types):
+    """Constructor.
+
+    Args:
+      fqdn: FQDN of the subdomain of the router.
+      types: iterable of ServiceType.
+    """
+
+    self.fqdn  = fqdn
+    self.name  = intern(fqdn.split(".")[0])
+    self.types = sorted(types, key=lambda stype: stype.name)
+
+  def count(self):
+    """Gets the number of services announced by the router."""
+
+    return sum([len(stype.services) for stype in self.types])
+
+  def stale(self):
+    """Gets the names of the types whose services come from an earlier
+    crawl."""
+
+    return [stype.name for stype in self.types if stype.stale]
+
+  def key(self):
+    """Gets a tuple of everything the firewall rules depend on."""
+
+    return tuple([stype.key() for stype in self.types])
+
+  def __getstate__(self):
+    return (self.fqdn, self.name, self.types)
+
+  def __setstate__(self, state):
+    self.fqdn, self.name, self.types = state
+
+  def __repr__(self):
+    return "Router(%r, %r)" % (self.fqdn, self.types)
+
+def typeName(stype_fqdn, subdomain):
+  """Gets the name of a type without the domain of its router.
+
+  Args:
+    stype_fqdn: FQDN of the type (e.g. _http._tcp.router.example.org.).
+    subdomain: FQDN of the subdomain of the router.
+
+  Returns:
+    The type without the domain (e.g. _http._tcp).
+  """
+
+  suffix = len(subdomain.strip(".")) + 1
+  return stype_fqdn.strip(".")[:-suffix]
+
+def dump(services):
+  """Converts services to a JSON-serializable value.
+
+  Args:
+    services: dictionary of Router as returned by DNSWrapper.getServices().
+
+  Returns:
+    A dictionary of the types of each router, whose services are arrays
+    [name, port, host, IPv4 addresses, IPv6 addresses].
+  """
+
+  return dict([(fqdn, [[stype.name,
+                        [[service.name, service.port, service.host,
+                          list(service.ipv4), list(service.ipv6)]
+                         for service in stype.services]]
+                       for stype in router.types])
+               for fqdn, router in services.items()])
+
+def load(value):
+  """Converts a value returned by dump() back to services.
+
+  Args:
+    value: value returned by dump(), with UTF-8 strings.
+
+  Returns:
+    A dictionary of Router, as returned by DNSWrapper.getServices().
+  """
+
+  return dict([(fqdn, Router(fqdn, [ServiceType(name,
+                                                [Service(*service)
+                                                 for service in services])
+                                    for name, services in types]))
+               for fqdn, types in value.items()])
+
+def digest(router, interfaces):
+  """Gets a digest of what the rules of a router depend on in the zone: the
+  type, name, port and addresses of its services and its public interfaces.
+
+  Args:
+    router: Router.
+    interfaces: array of the public interfaces of the router.
+
+  Returns:
+    A hexadecimal digest.
+  """
+
+  return hashlib.sha1(repr((router.name, interfaces,
+                            [(stype.name,
+                              [(service.name, service.port, service.ipv4,
+                                service.ipv6) for service in stype.services])
+                             for stype in router.types]))).hexdigest()
+
+def catalog(digests):
+  """Combines the digests of the routers of a domain.
+
+  Args:
+    digests: dictionary of the digest of each router, as returned by
+      digest().
+
+  Returns:
+    A hexadecimal digest which does not depend on the order in which the
+    routers were crawled.
+  """
+
+  return hashlib.sha1(repr(sorted(digests.items()))).hexdigest()
@@ -0,0 +1,205 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/python/ShardCoordinator.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Module sharing the routers of a domain between several policy managers with
+consistent hashing, coordinated through heartbeat files in a shared directory.
+"""
+
+import os              # for the heartbeat files
+import bisect          # to walk the ring
+import hashlib         # for the positions on the ring
+import json            # for the content of the heartbeat files
+import socket          # for the default name of the instance
+import threading       # to renew the heartbeat in the background
+import time            # for heartbeats
+
+import RuleWriter      # to write the heartbeat files atomically
+
+# Suffix of the heartbeat files.
+SUFFIX = '.heartbeat'
+
+def position(key):
+  """Gets the position of a key on the ring.
+
+  Args:
+    key: string.
+
+  Returns:
+    An integer in [0, 2^64).
+  """
+
+  return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+class ShardCoordinator:
+  """Decides which routers a policy manager instance is responsible for.
+
+  Each instance periodically rewrites its heartbeat file in a directory shared
+  by all the instances (e.g. over NFS, or a local directory for instances of
+  the same host), from a thread (see start()) so that generations longer than
+  the TTL do not remove it from the ring. Instances whose heartbeat is more
+  recent than the TTL are members of a consistent hashing ring, each with
+  several virtual nodes. A router belongs to the first member found on the
+  ring after the position of its name: when an instance joins or leaves, only
+  the routers of its virtual nodes change of owner."""
+
+  def __init__(self, logger, directory, name=None, ttl=90, replicas=64):
+    """Constructor.
+
+    Args:
+      logger: logger used to report events.
+      directory: directory shared by the instances.
+      name: name of the instance, unique among the instances. Defaults to the
+        host name.
+      ttl: number of seconds after which an instance which did not renew its
+        heartbeat is considered as gone.
+      replicas: number of virtual nodes of each instance on the ring.
+    """
+
+    self.logger    = logger
+    self.directory = directory
+    self.name      = name or socket.gethostname()
+    self.ttl       = ttl
+    self.replicas  = replicas
+
+    self.members   = None  # Sorted tuple of the names of the members.
+    self.ring      = []    # Sorted positions of the virtual nodes.
+    self.owners    = []    # Member owning each position of self.ring.
+
+    self.thread    = None  # Thread renewing the heartbeat, if started.
+    self.stopped   = threading.Event()
+
+  def path(self, name):
+    return os.path.join(self.directory, name + SUFFIX)
+
+  def start(self):
+    """Starts renewing the heartbeat of the instance every third of the TTL
+    in the background, until stop() or leave() is called."""
+
+    self.beat()
+    self.stopped.clear()
+    self.thread = threading.Thread(target=self.beating,
+                                   name="shard-heartbeat")
+    self.thread.daemon = True
+    self.thread.start()
+
+  def beating(self):
+    """Renews the heartbeat until stopped."""
+
+    while not self.stopped.wait(self.ttl / 3.0):
+      self.beat()
+
+  def stop(self):
+    """Stops renewing the heartbeat."""
+
+    self.stopped.set()
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+
+  def beat(self):
+    """Renews the heartbeat of the instance."""
+
+    try:
+      if not os.path.isdir(self.directory):
+        os.makedirs(self.directory)
+      RuleWriter.writeAtomically(self.path(self.name),
+                                 [json.dumps({'name': self.name,
+                                              'host': socket.gethostname(),
+                                              'pid': os.getpid(),
+                                              'time': time.time()})])
+    except (IOError, OSError) as e:
+      self.logger.error("Unable to write heartbeat in %s: %s" %
+                        (self.directory, e))
+
+  def refresh(self):
+    """Renews the heartbeat of the instance and updates the members of the
+    ring.
+
+    Returns:
+      The sorted tuple of the names of the members, which changes when an
+      instance joins or leaves.
+    """
+
+    self.beat()
+
+    members = set([self.name])
+    now = time.time()
+    try:
+      for filename in os.listdir(self.directory):
+        if not filename.endswith(SUFFIX):
+          continue
+        try:
+          if now - os.stat(os.path.join(self.directory,
+                                        filename)).st_mtime <= self.ttl:
+            members.add(filename[:-len(SUFFIX)])
+        except OSError:
+          pass # Removed in between.
+    except OSError as e:
+      self.logger.error("Unable to list instances in %s: %s" %
+                        (self.directory, e))
+
+    members = tuple(sorted(members))
+    if members != self.members:
+      self.logger.info("Shard members: %s." % ", ".join(members))
+      self.members = members
+      self.build()
+
+    return self.members
+
+  def build(self):
+    """Builds the ring of the current members."""
+
+    nodes = sorted([(position("%s#%i" % (member, i)), member)
+                    for member in self.members
+                    for i in range(self.replicas)])
+    self.ring   = [node[0] for node in nodes]
+    self.owners = [node[1] for node in nodes]
+
+  def owner(self, router):
+    """Gets the instance responsible for a router.
+
+    Args:
+      router: name of the router (first label of its subdomain).
+
+    Returns:
+      The name of the instance.
+    """
+
+    if self.members is None:
+      self.refresh()
+
+    index = bisect.bisect(self.ring, position(router)) % len(self.ring)
+    return self.owners[index]
+
+  def owns(self, subdomain):
+    """Checks whether the instance is responsible for a router.
+
+    Args:
+      subdomain: FQDN of the subdomain of the router.
+
+    Returns:
+      True if the router belongs to this instance.
+    """
+
+    return self.owner(subdomain.split(".")[0]) == self.name
+
+  def leave(self):
+    """Removes the heartbeat of the instance so that the others take over its
+    routers without waiting for the TTL."""
+
+    self.stop()
+    try:
+      os.remove(self.path(self.name))
+    except OSError:
+      pass
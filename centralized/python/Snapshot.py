@@ -0,0 +1,171 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/python/Snapshot.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Module saving the state of the policy manager after each generation so that a
+restart does not crawl the zone and rewrite the files again when nothing
+changed.
+"""
+
+import json            # for the format of the snapshot
+
+import RuleWriter      # to write the snapshot atomically
+import ServiceModel    # to save the services
+
+# Version of the format of the snapshot. Snapshots of other versions are
+# ignored.
+VERSION = 2
+
+def encode(value):
+  """Converts the unicode strings of a decoded JSON value to UTF-8 strings, like
+  the ones returned by dnspython."""
+
+  if isinstance(value, unicode):
+    return value.encode('utf-8')
+  if isinstance(value, list):
+    return [encode(element) for element in value]
+  if isinstance(value, dict):
+    return dict([(encode(key), encode(element))
+                 for key, element in value.items()])
+  return value
+
+class Snapshot:
+  """Snapshot of the state of the policy manager after its last generation: the
+  serial of the zone and the hash of the configuration file it was generated
+  from, the instances sharing its routers, the services and public interfaces
+  crawled, their digests and the fingerprint of each router file."""
+
+  def __init__(self, logger, path):
+    """Constructor.
+
+    Args:
+      logger: logger used to report events.
+      path: path of the snapshot file.
+    """
+
+    self.logger = logger
+    self.path   = path
+
+  def load(self, domain, output):
+    """Loads the snapshot.
+
+    Args:
+      domain: domain the policy manager is generating rules for.
+      output: settings of the RuleWriter, as returned by settings(). None to
+        read the snapshot without comparing the settings (e.g. to only use
+        its services).
+
+    Returns:
+      A dictionary with the keys serial, config, services (None if they were
+      not kept), interfaces, fingerprints, catalog, digests, counts and
+      members (None if not sharded), or None if there is no usable snapshot.
+      The fingerprints are empty if the output settings changed since the
+      snapshot was taken.
+    """
+
+    try:
+      with open(self.path) as f:
+        state = encode(json.load(f))
+    except IOError:
+      self.logger.info("No snapshot found in %s. Starting from scratch." %
+                       self.path)
+      return None
+    except ValueError as e:
+      self.logger.warning("Invalid snapshot %s ignored: %s" % (self.path, e))
+      return None
+
+    if state.get('version') != VERSION or state.get('domain') != domain:
+      self.logger.info("Snapshot %s is for another version or domain. " %
+                       self.path + "Starting from scratch.")
+      return None
+
+    # Files written with other settings must be written again.
+    if output is not None and state.get('output') != output:
+      self.logger.info("Output settings changed since the snapshot. " +
+                       "Regenerating all the files.")
+      state['fingerprints'] = dict()
+
+    if state.get('services') is not None:
+      state['services'] = ServiceModel.load(state['services'])
+    state['digests'] = state.get('digests') or dict()
+    state['counts']  = state.get('counts') or dict()
+    if state.get('members') is not None:
+      state['members'] = tuple(state['members'])
+    else:
+      state['members'] = None
+
+    return state
+
+  def save(self, domain, output, serial, config, services, interfaces,
+           fingerprints, catalog=None, digests=None, counts=None,
+           members=None):
+    """Saves the snapshot.
+
+    Args:
+      domain: domain the rules were generated for.
+      output: settings of the RuleWriter, as returned by settings().
+      serial: serial of the zone the rules were generated from.
+      config: hash of the configuration file the rules were generated from.
+      services: services as returned by DNSWrapper.getServices(), or None
+        if they were not kept.
+      interfaces: dictionary of the public interfaces of each router.
+      fingerprints: dictionary of the fingerprint of each router file.
+      catalog: digest of the services and public interfaces (see
+        ServiceModel.catalog()).
+      digests: dictionary of the digest of the services and public interfaces
+        of each router (see ServiceModel.digest()), from which the catalog is
+        computed.
+      counts: dictionary of the number of services of each router.
+      members: tuple of the instances sharing the routers (see
+        ShardCoordinator.refresh()), or None if not sharded.
+
+    Returns:
+      True if the snapshot was saved, False otherwise.
+    """
+
+    state = {'version': VERSION,
+             'domain': domain,
+             'output': output,
+             'serial': serial,
+             'config': config,
+             'services': None,
+             'interfaces': interfaces,
+             'fingerprints': fingerprints,
+             'catalog': catalog,
+             'digests': digests or dict(),
+             'counts': counts or dict(),
+             'members': members}
+
+    if services is not None:
+      state['services'] = ServiceModel.dump(services)
+
+    try:
+      RuleWriter.writeAtomically(self.path,
+                                 [json.dumps(state, separators=(',', ':'))])
+    except (IOError, OSError) as e:
+      self.logger.warning("Unable to save snapshot %s: %s" % (self.path, e))
+      return False
+
+    return True
+
+def settings(writer):
+  """Gets the settings of a RuleWriter which the files depend on.
+
+  Args:
+    writer: RuleWriter.
+
+  Returns:
+    A JSON-serializable value.
+  """
+
+  return [sorted(writer.formats), writer.aggregation, writer.optimize]
@@ -0,0 +1,326 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/python/ZoneTransfer.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Module providing a DNSWrapper which pulls the whole zone with a zone transfer
+(AXFR) and then follows its changes with incremental transfers (IXFR) instead
+of crawling it record by record.
+"""
+
+import socket
+
+import dns.exception
+import dns.message
+import dns.name
+import dns.query
+import dns.rdataclass
+import dns.rdatatype
+import dns.rdataset
+import dns.resolver
+import dns.zone
+
+import DNSWrapper
+
+class TransferWrapper(DNSWrapper.DNSWrapper):
+  """A DNSWrapper answering the queries of the crawl from an in-memory copy of
+  the zone kept up to date with zone transfers from the primary server.
+
+  getServices() first synchronizes the copy (AXFR the first time, IXFR from the
+  serial of the copy afterwards) and then crawls it exactly like DNSWrapper
+  crawls the network, so that the result has the same structure."""
+
+  def __init__(self, domain, server=None, timeout=10, port=53):
+    """Constructor.
+
+    Args:
+      domain: domain to transfer.
+      server: address (IPv4 or IPv6) of the server to transfer the zone from.
+        If None, the primary server found in the SOA (MNAME) is used.
+      timeout: number of seconds before a transfer or a query is abandoned.
+      port: port of the server to transfer the zone from.
+    """
+
+    DNSWrapper.DNSWrapper.__init__(self, domain)
+
+    self.origin  = dns.name.from_text(domain)
+    self.server  = server
+    self.timeout = timeout
+    self.port    = port
+    self.zone    = None  # In-memory copy of the zone.
+    self.serial  = None  # Serial of the in-memory copy.
+
+  def master(self):
+    """Gets the address of the server to transfer the zone from.
+
+    Returns:
+      The address of the server.
+
+    Raises:
+      dns.exception.DNSException if the primary server cannot be resolved.
+    """
+
+    if self.server is None:
+      soa = dns.resolver.query(self.origin, 'SOA')
+      try:
+        answer = dns.resolver.query(soa[0].mname, 'A')
+      except dns.resolver.NoAnswer:
+        # IPv6-only primary server.
+        answer = dns.resolver.query(soa[0].mname, 'AAAA')
+      self.server = answer[0].address
+
+    return self.server
+
+  def getSerial(self):
+    """Gets the serial field of the SOA of the domain, as known by the server
+    the zone is transferred from.
+
+    Returns:
+      The serial field of the SOA or 0 if query fails.
+    """
+
+    try:
+      query  = dns.message.make_query(self.origin, dns.rdatatype.SOA)
+      answer = dns.query.udp(query, self.master(), timeout=self.timeout,
+                             port=self.port)
+      self.count(False)
+      for rrset in answer.answer:
+        if rrset.rdtype == dns.rdatatype.SOA:
+          return rrset[0].serial
+    except (dns.exception.DNSException, socket.error, EOFError):
+      self.count(True)
+
+    return 0
+
+  def transfer(self):
+    """Synchronizes the in-memory copy of the zone with the server.
+
+    Returns:
+      True if the copy is up to date, False in case of failure.
+    """
+
+    # Each transfer is counted as one query.
+    try:
+      if self.zone is not None:
+        try:
+          self.incrementalTransfer()
+          self.count(False)
+          return True
+        except (dns.exception.DNSException, socket.error, EOFError):
+          self.count(True) # Falling back to a full transfer.
+
+      self.fullTransfer()
+      self.count(False)
+      return True
+    except (dns.exception.DNSException, socket.error, EOFError):
+      self.count(True)
+      return False
+
+  def fullTransfer(self):
+    """Replaces the in-memory copy by the whole zone (AXFR).
+
+    Raises:
+      dns.exception.DNSException, socket.error or EOFError in case of failure.
+    """
+
+    zone = dns.zone.from_xfr(dns.query.xfr(self.master(), self.origin,
+                                           timeout=self.timeout,
+                                           port=self.port,
+                                           lifetime=self.timeout,
+                                           relativize=False),
+                             relativize=False)
+
+    self.zone   = zone
+    self.serial = self.zoneSerial()
+
+  def incrementalTransfer(self):
+    """Applies the changes made to the zone since the serial of the in-memory
+    copy (IXFR).
+
+    Raises:
+      dns.exception.DNSException, socket.error or EOFError in case of failure.
+    """
+
+    rrsets = self.ixfr(self.serial)
+
+    # Only the SOA: the copy is up to date.
+    if len(rrsets) == 1:
+      return
+
+    # The server sent the whole zone instead of the differences (RFC 1995
+    # Section 4).
+    if rrsets[1].rdtype != dns.rdatatype.SOA:
+      zone = dns.zone.Zone(self.origin, relativize=False)
+      for rrset in rrsets:
+        zone.find_rdataset(rrset.name, rrset.rdtype, rrset.covers,
+                           create=True).update(rrset)
+      self.zone   = zone
+      self.serial = self.zoneSerial()
+      return
+
+    # Sequences of differences: old SOA, deleted records, new SOA, added
+    # records. The last SOA closes the answer.
+    deleting = False
+    for rrset in rrsets[1:-1]:
+      if rrset.rdtype == dns.rdatatype.SOA:
+        deleting = not deleting
+        continue
+
+      for rdata in rrset:
+        if deleting:
+          rdataset = self.zone.get_rdataset(rrset.name, rrset.rdtype,
+                                            rrset.covers)
+          if rdataset is not None:
+            rdataset.discard(rdata)
+            if len(rdataset) == 0:
+              self.zone.delete_rdataset(rrset.name, rrset.rdtype, rrset.covers)
+        else:
+          self.zone.find_rdataset(rrset.name, rrset.rdtype, rrset.covers,
+                                  create=True).add(rdata, rrset.ttl)
+
+    soa = dns.rdataset.Rdataset(rrsets[0].rdclass, rrsets[0].rdtype)
+    soa.update(rrsets[0])
+    self.zone.replace_rdataset(self.origin, soa)
+    self.serial = self.zoneSerial()
+
+  def ixfr(self, serial):
+    """Requests the changes made to the zone since a serial (IXFR).
+
+    Args:
+      serial: serial the changes are requested from.
+
+    Returns:
+      The array of the rrsets of the answer, starting with the SOA of the
+      zone.
+
+    Raises:
+      dns.exception.DNSException, socket.error or EOFError in case of failure.
+    """
+
+    rrsets = []
+    for message in dns.query.xfr(self.master(), self.origin,
+                                 rdtype=dns.rdatatype.IXFR, serial=serial,
+                                 timeout=self.timeout, port=self.port,
+                                 lifetime=self.timeout, relativize=False):
+      rrsets.extend(message.answer)
+
+    if len(rrsets) == 0 or rrsets[0].rdtype != dns.rdatatype.SOA:
+      raise dns.exception.FormError("IXFR answer does not start with a SOA.")
+
+    return rrsets
+
+  def changes(self, serial):
+    """Gets the names whose records changed since a serial, from an
+    incremental transfer, without keeping a copy of the zone.
+
+    Args:
+      serial: serial the changes are requested from.
+
+    Returns:
+      A set of dns.name.Name, empty if the zone did not change, or None if
+      the server sent the whole zone instead of the differences (e.g. its
+      journal does not go back to the serial).
+
+    Raises:
+      dns.exception.DNSException, socket.error or EOFError in case of failure
+      (e.g. incremental transfers refused).
+    """
+
+    rrsets = self.ixfr(serial)
+    if len(rrsets) == 1:
+      return set()
+    if rrsets[1].rdtype != dns.rdatatype.SOA:
+      return None
+
+    return set([rrset.name for rrset in rrsets[1:-1]
+                if rrset.rdtype != dns.rdatatype.SOA])
+
+  def zoneSerial(self):
+    """Gets the serial of the in-memory copy of the zone.
+
+    Returns:
+      The serial field of the SOA of the copy.
+    """
+
+    return self.zone.find_rdataset(self.origin, dns.rdatatype.SOA)[0].serial
+
+  def query(self, name, rdtype):
+    """Answers a query from the in-memory copy of the zone.
+
+    Args:
+      name: name to query (string or dns.name.Name).
+      rdtype: type of the record to query (e.g. 'PTR').
+
+    Returns:
+      An iterable of the rdata of the answer.
+
+    Raises:
+      dns.resolver.NXDOMAIN if the name does not exist, dns.resolver.NoAnswer
+      if it has no record of the given type and dns.exception.DNSException if
+      the zone has not been transferred yet.
+    """
+
+    if self.zone is None:
+      raise dns.exception.DNSException("Zone not transferred.")
+
+    if not isinstance(name, dns.name.Name):
+      name = dns.name.from_text(name)
+
+    try:
+      node = self.zone.get_node(name)
+    except KeyError: # Not in the zone.
+      node = None
+    if node is None:
+      raise dns.resolver.NXDOMAIN()
+
+    rdataset = node.get_rdataset(dns.rdataclass.IN,
+                                 dns.rdatatype.from_text(rdtype))
+    if rdataset is None:
+      raise dns.resolver.NoAnswer()
+
+    return list(rdataset)
+
+  def getServices(self, owned=None, recovery=None):
+    """Gets the services announced in the domain and its subdomains, after
+    having synchronized the in-memory copy of the zone.
+
+    Args:
+      owned: same as for DNSWrapper.getServices().
+      recovery: same as for DNSWrapper.getServices().
+
+    Returns:
+      Same as DNSWrapper.getServices().
+    """
+
+    if not self.transfer():
+      return None
+
+    return DNSWrapper.DNSWrapper.getServices(self, owned, recovery)
+
+  def iterServices(self, owned=None, recovery=None):
+    """Gets the services announced in the domain one router at a time, after
+    having synchronized the in-memory copy of the zone.
+
+    Args:
+      owned: same as for DNSWrapper.iterServices().
+      recovery: same as for DNSWrapper.iterServices().
+
+    Returns:
+      Same as DNSWrapper.iterServices().
+    """
+
+    if not self.transfer():
+      yield None
+      return
+
+    for router in DNSWrapper.DNSWrapper.iterServices(self, owned, recovery):
+      yield router
@@ -0,0 +1,189 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/python/flow-simulator.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Evaluates a recorded flow log against the rules of a configuration file, e.g.
+a modified copy of the current one, before it is applied.
+
+The flow log has one flow per line: source address, destination address,
+destination port and protocol (name or number), separated by commas or
+blanks. Lines starting with # are ignored. The number of flows decided by
+each rule is printed, and the verdict of each flow is written to a file if
+--verdicts is given (allow, deny or default, followed by the rule).
+
+The services are read from the snapshot of the policy manager (--snapshot) or,
+by default, by crawling the domain. Requires NumPy.
+
+Usage example:
+  ./flow-simulator.py --config /tmp/config.xml --verdicts verdicts.txt flows.csv
+"""
+
+import sys             # for the standard input and sys.exit
+import argparse        # for the command line
+import logging         # for the logger of the modules
+import time            # to report the throughput
+
+from lxml import etree # to read the domain in the configuration file
+
+import ConfigWatcher   # to read the rules
+import DNSWrapper      # to crawl the domain
+import Snapshot        # to read the services saved by the policy manager
+
+try:
+  import FlowSimulator # to evaluate the flows
+except ImportError as e:
+  sys.stderr.write("Sorry, to use this tool you need to install numpy.\n%s\n" %
+                   e)
+  sys.exit(1)
+
+def records(f):
+  """Reads the flows of a flow log.
+
+  Args:
+    f: file of the flow log.
+
+  Returns:
+    A generator of tuples (source, destination, port, protocol).
+  """
+
+  for line in f:
+    line = line.strip()
+    if not line or line.startswith("#"):
+      continue
+    fields = line.replace(",", " ").split()
+    if len(fields) < 4:
+      fields += [""] * (4 - len(fields))
+    yield tuple(fields[:4])
+
+def batches(flows, size):
+  """Groups flows in batches.
+
+  Args:
+    flows: iterable of flows.
+    size: number of flows of a batch.
+
+  Returns:
+    A generator of arrays of flows.
+  """
+
+  current = []
+  for flow in flows:
+    current.append(flow)
+    if len(current) == size:
+      yield current
+      current = []
+  if current:
+    yield current
+
+def verdict(simulator, position):
+  """Formats the verdict of a flow."""
+
+  if position == FlowSimulator.NO_RULE:
+    return "default"
+  rule = simulator.rule(position)
+  return "%s %i" % (rule.action, rule.index)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description="Evaluates a flow log against the rules of a configuration "
+                "file.")
+  parser.add_argument("flows", nargs="?", default="-",
+                      help="flow log (default: the standard input)")
+  parser.add_argument("--directory", default="/etc/policy-manager/",
+                      help="directory of config.xml and config.dtd "
+                           "(default: %(default)s)")
+  parser.add_argument("--config",
+                      help="configuration file whose rules are evaluated "
+                           "(default: config.xml of --directory)")
+  parser.add_argument("--domain",
+                      help="domain of the services (default: first domain "
+                           "of the configuration file)")
+  parser.add_argument("--snapshot",
+                      help="read the services from this snapshot instead of "
+                           "crawling the domain")
+  parser.add_argument("--workers", type=int, default=1,
+                      help="concurrent queries of the crawl (default: 1)")
+  parser.add_argument("--batch", type=int, default=100000,
+                      help="number of flows evaluated at once "
+                           "(default: %(default)s)")
+  parser.add_argument("--verdicts",
+                      help="file the verdict of each flow is written to")
+  arguments = parser.parse_args()
+
+  logging.basicConfig(format="%(levelname)s - %(message)s",
+                      level=logging.WARNING)
+  logger = logging.getLogger("flow-simulator")
+
+  config = ConfigWatcher.ConfigWatcher(logger, arguments.directory)
+  config.stop()
+  path = arguments.config or config.path
+  try:
+    with open(path, 'rb') as f:
+      content = f.read()
+    rules = config.parse(content)
+    if rules is None:
+      sys.exit(1)
+
+    domain = arguments.domain
+    if domain is None:
+      domain = etree.fromstring(content).find("./domain").get("name")
+  except (IOError, etree.LxmlError, AttributeError) as e:
+    logger.error("Unable to read %s: %s" % (path, e))
+    sys.exit(1)
+
+  if arguments.snapshot is not None:
+    state = Snapshot.Snapshot(logger, arguments.snapshot).load(domain, None)
+    if state is None:
+      sys.exit(1)
+    services = state['services']
+    if services is None:
+      logger.error("Snapshot %s has no services (streaming mode). Crawl " %
+                   arguments.snapshot + "the domain instead.")
+      sys.exit(1)
+  else:
+    services = DNSWrapper.DNSWrapper(domain, arguments.workers).getServices()
+    if services is None:
+      logger.error("Unable to crawl the services of %s." % domain)
+      sys.exit(1)
+
+  simulator = FlowSimulator.FlowSimulator(logger, rules, services)
+
+  flows  = sys.stdin if arguments.flows == "-" else open(arguments.flows)
+  output = None
+  if arguments.verdicts is not None:
+    output = open(arguments.verdicts, 'w')
+
+  count   = 0
+  started = time.time()
+  for flows_batch in batches(records(flows), max(1, arguments.batch)):
+    verdicts = simulator.evaluate(FlowSimulator.batch(flows_batch))
+    count += len(verdicts)
+    if output is not None:
+      output.writelines(["%s\n" % verdict(simulator, position)
+                         for position in verdicts])
+  elapsed = time.time() - started
+
+  if output is not None:
+    output.close()
+
+  decided = 0
+  print("%6s %-6s %-8s %-32s %12s" % ("rule", "action", "router", "source",
+                                       "flows"))
+  for position, hits in enumerate(simulator.hits):
+    rule = simulator.rule(position)
+    decided += hits
+    print("%6i %-6s %-8s %-32s %12i" % (rule.index, rule.action, rule.router,
+                                        rule.source, hits))
+  print("%6s %-6s %-8s %-32s %12i" % ("-", "-", "-", "default",
+                                      count - decided))
+  print("%i flows evaluated in %.3fs." % (count, elapsed))
@@ -35,7 +35,9 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 
 try:
-  from PolicyManager import PolicyManager
+  from PolicyManager import PolicyManager, SNAPSHOT_PATH
+  from DomainManager import DomainManager
+  import RuleWriter
 
   from daemon import runner # daemon module
   import lockfile
@@ -50,26 +52,36 @@ class PolicyManagerDaemon():
   """Daemon using the PolicyManager class to generate firewall rules for
   routers involved in the system."""
 
-  def __init__(self, logger, pidpath, domain, rate):
+  def __init__(self, logger, pidpath, domains, rate, options):
     # We redirect the ouputs to /dev/null so that nothing is printed.
     # All information should be forwarded to the .log file via the logger.
     self.stdin_path  = '/dev/null'
     self.stdout_path = '/dev/null'
     self.stderr_path = '/dev/null'
 
-    self.logger = logger 
-    self.domain = domain  
-    self.rate   = rate
+    self.logger  = logger 
+    self.domains = domains
+    self.rate    = rate
+    self.options = options
 
     self.pidfile_path =  pidpath
     self.pidfile_timeout = 5 # Timeout before considering PID file is locked.
 
-    self.pm = None # PolicyManager instance used.
+    self.pm = None # PolicyManager (or DomainManager) instance used.
 
   def run(self):
     """Starts the daemon."""
 
-    self.pm = PolicyManager(self.logger, self.domain, self.rate)
+    if len(self.domains) == 1:
+      domain, directory = self.domains[0]
+      options = dict(self.options)
+      if directory is not None:
+        options['directory'] = directory
+      self.pm = PolicyManager(self.logger, domain, self.rate, options)
+    else:
+      # Several domains share one process.
+      self.pm = DomainManager(self.logger, self.domains, self.rate,
+                              self.options)
     self.logger.info("Policy manager daemon startup.")
     self.pm.start()
 
@@ -101,8 +113,119 @@ if __name__ == '__main__':
                             "DTD.")
 
     level  = xml.find("./log").get("level")
-    domain = xml.find("./domain").get("name")
+    domains = [(el.get("name"), el.get("directory"))
+               for el in xml.findall("./domain")]
     rate   = xml.find("./update").get("rate")
+
+    # Optional settings.
+    options = dict()
+
+    update = xml.find("./update")
+    if update.get("settle") is not None:
+      try:
+        window = int(update.get("settle")) / 1000.0
+        maximum = int(update.get("settle-max",
+                                 str(10 * int(update.get("settle"))))) / 1000.0
+      except ValueError:
+        raise etree.LxmlError("Settle window and maximum must be integers " +
+                              "(milliseconds).")
+      options['settle'] = (window, max(window, maximum))
+
+    output = xml.find("./output")
+    if output is not None and output.get("format") is not None:
+      options['formats'] = output.get("format").split()
+      for fmt in options['formats']:
+        if not fmt in RuleWriter.FORMATS:
+          raise etree.LxmlError("Unknown output format '%s'." % fmt)
+    if output is not None and output.get("aggregation") is not None:
+      options['aggregation'] = output.get("aggregation")
+    if output is not None and output.get("optimize") is not None:
+      options['optimize'] = (output.get("optimize") == "yes")
+
+    crawl = xml.find("./crawl")
+    if crawl is not None and crawl.get("workers") is not None:
+      try:
+        options['workers'] = int(crawl.get("workers"))
+      except ValueError:
+        raise etree.LxmlError("Number of crawl workers must be an integer.")
+    if crawl is not None and crawl.get("mode") is not None:
+      options['crawl'] = crawl.get("mode")
+    if crawl is not None and crawl.get("server") is not None:
+      options['server'] = crawl.get("server")
+    if crawl is not None and crawl.get("port") is not None:
+      try:
+        options['port'] = int(crawl.get("port"))
+      except ValueError:
+        raise etree.LxmlError("Transfer port must be an integer.")
+    if crawl is not None and crawl.get("stream") is not None:
+      options['stream'] = (crawl.get("stream") == "yes")
+    if crawl is not None and crawl.get("hedge") is not None:
+      try:
+        options['hedge'] = float(crawl.get("hedge")) / 100
+      except ValueError:
+        options['hedge'] = None
+      if options['hedge'] is None or not 0 < options['hedge'] <= 1:
+        raise etree.LxmlError("Hedge percentile must be a number in " +
+                              "]0, 100].")
+    if crawl is not None and crawl.get("retry") is not None:
+      try:
+        delay = int(crawl.get("retry")) / 1000.0
+        maximum = int(crawl.get("retry-max",
+                                str(10 * int(crawl.get("retry"))))) / 1000.0
+      except ValueError:
+        raise etree.LxmlError("Retry delay and maximum must be integers " +
+                              "(milliseconds).")
+      options['retry'] = (delay, max(delay, maximum))
+
+    notify = xml.find("./notify")
+    if notify is not None:
+      try:
+        options['notify'] = (notify.get("address", "0.0.0.0"),
+                             int(notify.get("port", "5300")))
+      except ValueError:
+        raise etree.LxmlError("NOTIFY port must be an integer.")
+
+    cache = xml.find("./cache")
+    if cache is not None:
+      try:
+        max_ttl = cache.get("max-ttl")
+        if max_ttl is not None:
+          max_ttl = int(max_ttl)
+        options['cache'] = (int(cache.get("size", "10000")), max_ttl)
+      except ValueError:
+        raise etree.LxmlError("Cache size and maximum TTL must be integers.")
+
+    compilation = xml.find("./compile")
+    if compilation is not None and compilation.get("workers") is not None:
+      try:
+        options['processes'] = int(compilation.get("workers"))
+      except ValueError:
+        raise etree.LxmlError("Number of compile workers must be an integer.")
+
+    metrics = xml.find("./metrics")
+    if metrics is not None:
+      try:
+        options['metrics'] = (metrics.get("address", "127.0.0.1"),
+                              int(metrics.get("port", "9120")))
+      except ValueError:
+        raise etree.LxmlError("Metrics port must be an integer.")
+
+    snapshot = xml.find("./snapshot")
+    if snapshot is not None:
+      if snapshot.get("enabled") == "no":
+        options['snapshot'] = None
+      elif snapshot.get("path") is not None:
+        options['snapshot'] = snapshot.get("path")
+
+    shard = xml.find("./shard")
+    if shard is not None:
+      try:
+        ttl = shard.get("ttl")
+        if ttl is not None:
+          ttl = int(ttl)
+        options['shard'] = (shard.get("directory"), shard.get("name"), ttl)
+      except ValueError:
+        raise etree.LxmlError("Shard TTL must be an integer.")
   except etree.LxmlError as e:
     logger.error("Error while parsing configuration file: %s" % e)
     logger.error("Daemon not started.")
@@ -133,7 +256,15 @@ if __name__ == '__main__':
 
   os.chown('/var/run/policy-manager/', uid, gid)
   os.chmod('/var/run/policy-manager/', 0755)
-  app = PolicyManagerDaemon(logger, "/var/run/policy-manager/pid", domain, rate)
+
+  # Directory of the snapshot, written by the daemon.
+  snapshot = os.path.dirname(options.get('snapshot', SNAPSHOT_PATH) or "")
+  if snapshot and not os.path.exists(snapshot):
+    os.makedirs(snapshot)
+    os.chown(snapshot, uid, gid)
+    os.chmod(snapshot, 0755)
+  app = PolicyManagerDaemon(logger, "/var/run/policy-manager/pid", domains,
+                            rate, options)
   daemon_runner = runner.DaemonRunner(app)
 
   # Ensuring logger file handler does not get closed during daemonization.
@@ -0,0 +1,136 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/python/policy-query.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Prints the effective policy of source addresses: for each service of the
+domain, whether the rules of the configuration file allow or deny the source
+to reach it, and which rule decides.
+
+The rules are read from the configuration file and the services from the
+snapshot of the policy manager (--snapshot) or, by default, by crawling the
+domain. The index is built once, then each source given on the command line,
+or read from the standard input (one per line) if none is given, is answered.
+
+Usage example:
+  ./policy-query.py --router r1 2001:db8::1 10.1.2.3
+"""
+
+import sys             # for the standard input and sys.exit
+import argparse        # for the command line
+import json            # for the JSON output
+import logging         # for the logger of the modules
+
+from lxml import etree # to read the domain in the configuration file
+
+import ConfigWatcher   # to read the rules
+import DNSWrapper      # to crawl the domain
+import PolicyQuery     # to answer the queries
+import Snapshot        # to read the services saved by the policy manager
+
+def sources(arguments):
+  """Gets the source addresses to query, from the command line or the standard
+  input."""
+
+  if arguments.sources:
+    for source in arguments.sources:
+      yield source
+    return
+
+  for line in sys.stdin:
+    line = line.strip()
+    if line and not line.startswith("#"):
+      yield line
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description="Prints the effective policy of source addresses for the "
+                "services of the domain.")
+  parser.add_argument("sources", nargs="*",
+                      help="source addresses (default: read from the standard "
+                           "input, one per line)")
+  parser.add_argument("--router",
+                      help="only print the services of this router")
+  parser.add_argument("--directory", default="/etc/policy-manager/",
+                      help="directory of config.xml and config.dtd "
+                           "(default: %(default)s)")
+  parser.add_argument("--domain",
+                      help="domain of the services (default: first domain "
+                           "of the configuration file)")
+  parser.add_argument("--snapshot",
+                      help="read the services from this snapshot instead of "
+                           "crawling the domain")
+  parser.add_argument("--workers", type=int, default=1,
+                      help="concurrent queries of the crawl (default: 1)")
+  parser.add_argument("--json", action="store_true",
+                      help="print one JSON object per decision")
+  arguments = parser.parse_args()
+
+  logging.basicConfig(format="%(levelname)s - %(message)s",
+                      level=logging.WARNING)
+  logger = logging.getLogger("policy-query")
+
+  config = ConfigWatcher.ConfigWatcher(logger, arguments.directory)
+  rules = config.getRules()
+  config.stop()
+  if rules is None:
+    sys.exit(1)
+
+  domain = arguments.domain
+  if domain is None:
+    try:
+      domain = etree.parse(config.path).find("./domain").get("name")
+    except (etree.LxmlError, IOError, AttributeError) as e:
+      logger.error("Unable to read the domain of %s: %s" % (config.path, e))
+      sys.exit(1)
+
+  if arguments.snapshot is not None:
+    state = Snapshot.Snapshot(logger, arguments.snapshot).load(domain, None)
+    if state is None:
+      sys.exit(1)
+    services = state['services']
+    if services is None:
+      logger.error("Snapshot %s has no services (streaming mode). Crawl " %
+                   arguments.snapshot + "the domain instead.")
+      sys.exit(1)
+  else:
+    services = DNSWrapper.DNSWrapper(domain, arguments.workers).getServices()
+    if services is None:
+      logger.error("Unable to crawl the services of %s." % domain)
+      sys.exit(1)
+
+  index = PolicyQuery.PolicyQuery(logger, rules, services)
+
+  failed = False
+  for source in sources(arguments):
+    decisions = index.query(source, arguments.router)
+    if decisions is None:
+      failed = True
+      continue
+
+    for decision in decisions:
+      if arguments.json:
+        result = decision._asdict()
+        result['source'] = source
+        print(json.dumps(result, sort_keys=True))
+        continue
+
+      if decision.action is None:
+        verdict = "default"
+      else:
+        verdict = "%s (rule %i)" % (decision.action, decision.rule)
+      print("%s %s %s %s %s/%s:%i %s" %
+            (source, decision.router, decision.type, decision.service,
+             ",".join(decision.addresses), decision.protocol, decision.port,
+             verdict))
+
+  sys.exit(1 if failed else 0)
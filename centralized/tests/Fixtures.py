@@ -0,0 +1,95 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/tests/Fixtures.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Module shared by the tests: it makes the modules of the policy manager and of
+the benchmarks importable and serves synthetic zones with the stand-in server
+of the benchmarks, the resolver of dnspython being pointed to it.
+"""
+
+import sys             # for sys.path
+import os              # for paths
+import socket          # to find free ports
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "python"))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+import dns.resolver
+
+import SyntheticZone   # to generate zones
+import ZoneServer      # to serve them
+
+DOMAIN = "test.example."
+
+class ZoneFixture:
+  """A synthetic zone served on the loopback interface, queried by the
+  resolver of dnspython until stop() is called."""
+
+  def __init__(self, routers=3, types=2, instances=2):
+    """Constructor. Starts serving the zone.
+
+    Args:
+      routers: number of routers of the zone.
+      types: number of service types per router.
+      instances: number of instances per service type.
+    """
+
+    self.zone   = SyntheticZone.zone(DOMAIN, routers, types, instances)
+    self.server = ZoneServer.ZoneServer(self.zone)
+    self.server.start()
+
+    self.previous = dns.resolver.default_resolver
+    resolver = dns.resolver.Resolver(configure=False)
+    resolver.nameservers = [self.server.address]
+    resolver.port        = self.server.port
+    resolver.lifetime    = 2.0
+    dns.resolver.default_resolver = resolver
+
+  def stop(self):
+    """Stops serving the zone and restores the resolver."""
+
+    dns.resolver.default_resolver = self.previous
+    self.server.stop()
+
+def instanceRecords(router, stype, name, port, address):
+  """Gets the records announcing a service instance on its own host.
+
+  Args:
+    router: name of the router (e.g. 'r0').
+    stype: service type relative to the router (e.g. '_t0._udp').
+    name: name of the instance, without spaces.
+    port: port of the service.
+    address: IPv4 address of the host.
+
+  Returns:
+    An array of records (name, type, rdata, TTL) for ZoneServer.update().
+  """
+
+  stype    = "%s.%s" % (stype, router)
+  instance = "%s.%s" % (name, stype)
+  host     = "%s-host.%s" % (name.lower(), router)
+
+  return [(stype, 'PTR', instance, SyntheticZone.TTL),
+          (instance, 'SRV', "0 0 %i %s" % (port, host), SyntheticZone.TTL),
+          (host, 'A', address, SyntheticZone.TTL)]
+
+def freePort():
+  """Gets a UDP port of the loopback interface no one listens on."""
+
+  sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  try:
+    sock.bind(("127.0.0.1", 0))
+    return sock.getsockname()[1]
+  finally:
+    sock.close()
@@ -0,0 +1,191 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/tests/test_PolicyManager.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Tests of the crawl and of the generation loop against the stand-in server: a
+NOTIFY wakes the loop up, a restart from the snapshot writes nothing and a
+change of one router only rewrites its file.
+
+Usage:
+  python2 -m unittest discover -s centralized/tests
+"""
+
+import logging         # for the logger of the managers
+import os              # for the output files
+import shutil          # to remove the temporary directory
+import tempfile        # for the output and the configuration file
+import threading       # to run the loop in the background
+import time            # to wait for the loop
+import unittest
+
+import Fixtures        # to serve the zones
+
+import ConfigWatcher   # to read the rules of the test
+import DNSWrapper      # to crawl the zone
+import Metrics         # for the metrics of the managers
+import PolicyManager   # to run the loop
+
+CONFIG = """<?xml version="1.0"?>
+<!DOCTYPE config SYSTEM "config.dtd">
+<config>
+  <log level="debug"/>
+  <update rate="60"/>
+  <domain name="%s"/>
+  <rules>
+    <rule src-address="192.0.2.0" src-prefix-length="24" name=".*" type=".*"
+          router="*">allow</rule>
+  </rules>
+</config>
+""" % Fixtures.DOMAIN
+
+# Address of the host of the instance added by the tests.
+ADDRESS = "198.51.100.7"
+
+class PolicyManagerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.fixture   = Fixtures.ZoneFixture()
+    self.server    = self.fixture.server
+    self.directory = tempfile.mkdtemp()
+    self.output    = os.path.join(self.directory, "output")
+    self.logger    = logging.getLogger("test")
+
+    with open(os.path.join(self.directory, "config.xml"), "w") as f:
+      f.write(CONFIG)
+    shutil.copy(os.path.join(Fixtures.ROOT, "config", "config.dtd"),
+                self.directory)
+    self.config = ConfigWatcher.ConfigWatcher(self.logger, self.directory)
+
+  def tearDown(self):
+    self.config.stop()
+    self.fixture.stop()
+    shutil.rmtree(self.directory)
+
+  def manager(self, **options):
+    """Gets a manager of the zone writing in the output directory, with its
+    snapshot in the temporary directory."""
+
+    options.setdefault('directory', self.output)
+    options.setdefault('snapshot', os.path.join(self.directory,
+                                                "snapshot.json"))
+    shared = {'config': self.config,
+              'cache': None,
+              'pool': None,
+              'compiler': None,
+              'metrics': Metrics.Metrics()}
+    return PolicyManager.PolicyManager(self.logger, Fixtures.DOMAIN, 60,
+                                       options, shared)
+
+  def files(self):
+    """Gets the modification time and the content of each output file."""
+
+    files = dict()
+    for name in os.listdir(self.output):
+      path = os.path.join(self.output, name)
+      with open(path) as f:
+        files[name] = (os.stat(path).st_mtime, f.read())
+    return files
+
+  def age(self):
+    """Sets the modification time of the output files to the epoch, so that
+    rewritten files are told apart whatever the resolution of the clock."""
+
+    for name in os.listdir(self.output):
+      os.utime(os.path.join(self.output, name), (0, 0))
+
+  def wait(self, condition, timeout=5.0):
+    """Waits until a condition is true. Returns whether it became true."""
+
+    deadline = time.time() + timeout
+    while not condition():
+      if time.time() > deadline:
+        return False
+      time.sleep(0.02)
+    return True
+
+  def testCrawl(self):
+    services = DNSWrapper.DNSWrapper(Fixtures.DOMAIN).getServices()
+
+    self.assertEqual(sorted([router.name for router in services.values()]),
+                     ['r0', 'r1', 'r2'])
+    for router in services.values():
+      self.assertEqual(router.count(), 4)
+
+  def testNotify(self):
+    port    = Fixtures.freePort()
+    manager = self.manager(notify=("127.0.0.1", port))
+    thread  = threading.Thread(target=manager.start)
+    thread.start()
+    try:
+      self.assertTrue(self.wait(lambda: manager.last_serial == 1))
+
+      self.server.update(added=Fixtures.instanceRecords('r1', '_t0._udp',
+                                                        'Added', 4000,
+                                                        ADDRESS))
+      started = time.time()
+      self.assertTrue(self.server.notify("127.0.0.1", port))
+      self.assertTrue(self.wait(lambda: manager.last_serial == 2))
+
+      # Well before the next poll.
+      self.assertLess(time.time() - started, 5.0)
+      with open(os.path.join(self.output, "iptables_r1.sh")) as f:
+        self.assertIn(ADDRESS, f.read())
+    finally:
+      manager.stop()
+      thread.join()
+
+  def testWarmRestart(self):
+    manager = self.manager()
+    listener, server = manager.initialize()
+    manager.cycle()
+    manager.finalize(listener, server)
+    self.assertEqual(sorted(os.listdir(self.output)),
+                     ['iptables_r0.sh', 'iptables_r1.sh', 'iptables_r2.sh'])
+    self.age()
+    files = self.files()
+
+    manager = self.manager()
+    listener, server = manager.initialize()
+    self.assertEqual(manager.last_serial, 1)
+    manager.cycle()
+    manager.finalize(listener, server)
+
+    self.assertEqual(self.files(), files)
+    # Only the SOA was queried.
+    self.assertEqual(manager.wrapper.queries, 1)
+
+  def testSingleRouterRewrite(self):
+    manager = self.manager()
+    listener, server = manager.initialize()
+    try:
+      manager.cycle()
+      self.age()
+      files = self.files()
+
+      self.server.update(added=Fixtures.instanceRecords('r1', '_t0._udp',
+                                                        'Added', 4000,
+                                                        ADDRESS))
+      manager.cycle()
+    finally:
+      manager.finalize(listener, server)
+
+    rewritten = [name for name, (mtime, _) in self.files().items()
+                 if mtime != 0]
+    self.assertEqual(rewritten, ['iptables_r1.sh'])
+    self.assertEqual(manager.last_serial, 2)
+    self.assertNotEqual(self.files()['iptables_r1.sh'][1],
+                        files['iptables_r1.sh'][1])
+    self.assertIn(ADDRESS, self.files()['iptables_r1.sh'][1])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,172 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+"""
+/centralized/tests/test_ZoneTransfer.py
+
+Part of master thesis "Using Service Discovery to Apply Policies in Networks"
+at University of Liège 2014-2015.
+by Amaury Van Bemten.
+
+Entreprise: Cisco
+Contact entreprise: Eric Vyncke
+Advisor: Guy Leduc
+
+Tests of the zone-transfer crawl mode against the stand-in server: full and
+incremental transfers give the same services as crawling the zone with
+queries, and the names changed between two serials keep the other answers of
+the cache valid.
+
+Usage:
+  python2 -m unittest discover -s centralized/tests
+"""
+
+import unittest
+
+import Fixtures        # to serve the zones
+
+import DNSWrapper      # to crawl the zone with queries
+import ServiceModel    # to compare the services
+import ZoneTransfer    # to crawl the zone with transfers
+
+class ZoneTransferTest(unittest.TestCase):
+
+  def setUp(self):
+    self.fixture = Fixtures.ZoneFixture()
+    self.server  = self.fixture.server
+    self.wrapper = ZoneTransfer.TransferWrapper(Fixtures.DOMAIN,
+                                                self.server.address,
+                                                timeout=2,
+                                                port=self.server.port)
+
+  def tearDown(self):
+    self.fixture.stop()
+
+  def crawl(self):
+    """Gets the services of the zone crawled with queries."""
+
+    return ServiceModel.dump(
+      DNSWrapper.DNSWrapper(Fixtures.DOMAIN).getServices())
+
+  def testFullTransfer(self):
+    services = self.wrapper.getServices()
+
+    self.assertEqual(self.server.transfers, ['AXFR'])
+    self.assertEqual(ServiceModel.dump(services), self.crawl())
+    self.assertEqual(self.wrapper.getSerial(), 1)
+    self.assertEqual(self.wrapper.serial, 1)
+
+  def testIncrementalTransfer(self):
+    self.wrapper.getServices()
+
+    serial = self.server.update(
+      added=Fixtures.instanceRecords('r1', '_t0._udp', 'Added', 4000,
+                                     "192.0.2.1"),
+      deleted=[('_t1._tcp.r0', 'PTR',
+                'Room0\\032Device0._t1._tcp.r0')])
+    self.assertEqual(self.wrapper.getSerial(), serial)
+
+    services = self.wrapper.getServices()
+
+    self.assertEqual(self.server.transfers, ['AXFR', 'IXFR'])
+    self.assertEqual(self.wrapper.serial, serial)
+    self.assertEqual(ServiceModel.dump(services), self.crawl())
+
+    names = [service.name for router in services.values()
+             for stype in router.types for service in stype.services]
+    self.assertIn("Added._t0._udp.r1.test.example.", names)
+    self.assertNotIn("Room0 Device0._t1._tcp.r0.test.example.", names)
+
+  def testIncrementalTransferOfSeveralChanges(self):
+    self.wrapper.getServices()
+
+    self.server.update(added=Fixtures.instanceRecords('r0', '_t0._udp',
+                                                      'First', 4000,
+                                                      "192.0.2.1"))
+    self.server.update(added=Fixtures.instanceRecords('r2', '_t1._tcp',
+                                                      'Second', 4001,
+                                                      "192.0.2.2"),
+                       deleted=[('r2', 'TXT', '"public=eth0,eth1"')])
+    services = self.wrapper.getServices()
+
+    self.assertEqual(self.server.transfers, ['AXFR', 'IXFR'])
+    self.assertEqual(self.wrapper.serial, 3)
+    self.assertEqual(ServiceModel.dump(services), self.crawl())
+    self.assertEqual(self.wrapper.getPublicInterfaces('r2'), [])
+    self.assertEqual(self.wrapper.getPublicInterfaces('r1'),
+                     ['eth0', 'eth1'])
+
+  def testUpToDate(self):
+    before = ServiceModel.dump(self.wrapper.getServices())
+    after  = ServiceModel.dump(self.wrapper.getServices())
+
+    self.assertEqual(self.server.transfers, ['AXFR', 'IXFR'])
+    self.assertEqual(before, after)
+
+  def testUnknownSerial(self):
+    self.wrapper.getServices()
+
+    # The server answers an IXFR from a serial it no longer has the
+    # differences of with the whole zone.
+    self.server.update(added=Fixtures.instanceRecords('r0', '_t0._udp',
+                                                      'Added', 4000,
+                                                      "192.0.2.1"))
+    self.server.journal = []
+    services = self.wrapper.getServices()
+
+    self.assertEqual(self.server.transfers, ['AXFR', 'AXFR'])
+    self.assertEqual(self.wrapper.serial, 2)
+    self.assertEqual(ServiceModel.dump(services), self.crawl())
+
+  def testChanges(self):
+    self.server.update(added=Fixtures.instanceRecords('r1', '_t0._udp',
+                                                      'Added', 4000,
+                                                      "192.0.2.1"))
+    self.server.update(deleted=[('r2', 'TXT', '"public=eth0,eth1"')])
+
+    names = sorted([str(name) for name in self.wrapper.changes(1)])
+    self.assertEqual(names, ["Added._t0._udp.r1.test.example.",
+                             "_t0._udp.r1.test.example.",
+                             "added-host.r1.test.example.",
+                             "r2.test.example."])
+    self.assertEqual(self.wrapper.changes(3), set())
+    self.assertEqual(self.wrapper.zone, None)
+
+  def testChangesFromUnknownSerial(self):
+    self.server.update(deleted=[('r2', 'TXT', '"public=eth0,eth1"')])
+    self.server.journal = []
+
+    self.assertEqual(self.wrapper.changes(1), None)
+
+  def testCacheKeptForUnchangedNames(self):
+    cache   = DNSWrapper.ResolverCache()
+    wrapper = DNSWrapper.DNSWrapper(Fixtures.DOMAIN, cache=cache)
+    wrapper.getServices()
+
+    serial = self.server.update(added=Fixtures.instanceRecords(
+      'r1', '_t0._udp', 'Added', 4000, "192.0.2.1"))
+    cache.invalidate(self.wrapper.changes(serial - 1), Fixtures.DOMAIN)
+    hits = cache.hits
+    services = wrapper.getServices()
+
+    self.assertEqual(ServiceModel.dump(services), self.crawl())
+    self.assertGreater(cache.hits, hits)
+    self.assertEqual(wrapper.queries, cache.misses)
+
+  def testPrimaryFromSOA(self):
+    wrapper = ZoneTransfer.TransferWrapper(Fixtures.DOMAIN, timeout=2,
+                                           port=self.server.port)
+
+    self.assertEqual(wrapper.master(), "127.0.0.1")
+    self.assertEqual(ServiceModel.dump(wrapper.getServices()), self.crawl())
+
+  def testIPv6OnlyPrimary(self):
+    self.server.update(added=[('ns', 'AAAA', "::1", 3600)],
+                       deleted=[('ns', 'A', "127.0.0.1")])
+    wrapper = ZoneTransfer.TransferWrapper(Fixtures.DOMAIN, timeout=2,
+                                           port=self.server.port)
+
+    self.assertEqual(wrapper.master(), "::1")
+
+if __name__ == '__main__':
+  unittest.main()